@@ -0,0 +1,161 @@
+# AsyncFMS: versão asyncio do FMS
+# Os jobs são monitorados por corrotinas, sem uma thread por job: o término chega pelo pidfd do processo, registrado
+# no laço de eventos, e o próprio FMS recolhe o processo com wait4 (o rusage dá a CPU exata do acerto final)
+# As verificações de limite, a árvore de processos e a cobrança pré-paga (CreditManagerPrePago) ou pós-paga
+# (FMS.total_cpu_used) são as mesmas do FMS, pois cada job é um FMS cujo tick() é chamado pela corrotina
+#
+# Exemplo:
+#     fms = AsyncFMS(pre_pago=False)
+#     result = await fms.run(["./prog"], {"limit_cpu": 10, "limit_mem": 256, "limit_time": 60})
+#
+#     job = await fms.start(["./prog"], limits)
+#     async for progress in fms.progress(job):
+#         print(progress["cpu_time"], progress["rss_mb"])
+#     result = await job.future
+
+import asyncio
+import os
+
+from main import FMS
+from sampling import default_sampler
+
+
+class AsyncJob(FMS):
+    # FMS de um job monitorado pelo AsyncFMS
+    # O processo não passa pelo child watcher do asyncio: quem o recolhe é o reap() do FMS, com wait4, então a CPU
+    # gasta depois da última amostra também é cobrada (ver FMS.settle())
+
+    verbose = False
+
+
+class AsyncFMS:
+    # Motor de monitoramento asyncio: uma corrotina por job, todas no mesmo laço de eventos
+
+    # Intervalo mínimo entre duas invalidações do mapa de processos do backend (ver ProcSampler.begin_sweep)
+    sweep_interval = 0.01
+    # Bytes de saída capturada lidos por stream a cada evento de leitura (ver output.py)
+    output_budget = 2 ** 20
+
+    def __init__(self, pre_pago=True, sampler=None):
+        self.pre_pago = pre_pago
+        # O backend é usado só pela thread do laço de eventos
+        self.sampler = sampler or default_sampler()
+        self.jobs = {}
+        self.last_sweep = 0.0
+        self.subscribers = {}
+
+    async def start(self, command, limits):
+        # Lança o job e devolve o AsyncJob; job.future recebe o registro final (FMS.result())
+        loop = asyncio.get_running_loop()
+        job = AsyncJob(pre_pago=self.pre_pago, sampler=self.sampler)
+        job.limit_cpu = float(limits["limit_cpu"])
+        job.limit_mem = float(limits["limit_mem"])
+        job.limit_time = float(limits["limit_time"])
+        job.future = loop.create_future()
+        job.on_finish.append(self.job_finished)
+        # Mesmo lançamento do FMS (Popen ou fork server); o Popen retorna logo depois do exec, como o
+        # asyncio.create_subprocess_exec, que também o usa
+        job.launch_process(list(command))
+        # Com FMS.log_dir a saída do job é drenada pelo próprio laço de eventos
+        if job.output is not None:
+            for stream in job.output.open_streams():
+                loop.add_reader(stream.fd, self.drain_output, job, stream)
+        job.start_monitoring()
+        self.jobs[job.process.pid] = job
+        job.task = asyncio.create_task(self.monitor(job))
+        return job
+
+    async def run(self, command, limits):
+        # Lança o job e espera o término; devolve o registro final do job
+        job = await self.start(command, limits)
+        return await job.future
+
+    async def monitor(self, job):
+        # Corrotina de monitoramento: dorme até a próxima amostra ou até o processo terminar, o que vier antes
+        # O término é avisado pelo pidfd (ver FMS.exit_fd()); sem pidfd, o próprio tick percebe o término
+        loop = asyncio.get_running_loop()
+        exited = loop.create_future()
+        try:
+            exit_fd = job.exit_fd()
+        except OSError:
+            exit_fd = None
+        else:
+            loop.add_reader(exit_fd, lambda: exited.done() or exited.set_result(None))
+        # A primeira amostra é feita logo no início, como no SamplerEngine
+        interval = 0
+        try:
+            while True:
+                await asyncio.wait({exited}, timeout=interval)
+                now = loop.time()
+                if now - self.last_sweep >= self.sweep_interval:
+                    self.sampler.begin_sweep()
+                    self.last_sweep = now
+                interval = job.tick()
+                if interval is None:
+                    break
+                self.publish(job, interval)
+        except Exception as e:
+            # O processo não pode ficar sem controle se o monitoramento falhar
+            if not job.future.done():
+                job.future.set_exception(e)
+            job.abort()
+        finally:
+            if exit_fd is not None:
+                loop.remove_reader(exit_fd)
+                os.close(exit_fd)
+
+    def drain_output(self, job, stream):
+        loop = asyncio.get_running_loop()
+        if not job.output.drain(stream, self.output_budget):
+            loop.remove_reader(stream.fd)
+            job.output.close_stream(stream)
+        elif job.output.paused():
+            # Fila de gravação cheia: a leitura volta quando ela baixar
+            loop.remove_reader(stream.fd)
+            loop.call_later(0.01, self.resume_output, job, stream)
+
+    def resume_output(self, job, stream):
+        if stream.closed:
+            return
+        if job.output.ready():
+            asyncio.get_running_loop().add_reader(stream.fd, self.drain_output, job, stream)
+        else:
+            asyncio.get_running_loop().call_later(0.01, self.resume_output, job, stream)
+
+    def job_finished(self, job):
+        job.done = True
+        self.jobs.pop(job.process.pid, None)
+        if job.output is not None:
+            loop = asyncio.get_running_loop()
+            for stream in job.output.open_streams():
+                loop.remove_reader(stream.fd)
+            job.output.close()
+        if not job.future.done():
+            job.future.set_result(job.result())
+        for queue in self.subscribers.pop(job.process.pid, []):
+            queue.put_nowait(None)
+
+    def publish(self, job, interval):
+        for queue in self.subscribers.get(job.process.pid, []):
+            queue.put_nowait({
+                "pid": job.process.pid,
+                "wall_time": job.wall_clock,
+                "cpu_time": job.cpu_total,
+                "rss_mb": job.mem_rss_mb,
+                "next_sample": interval,
+            })
+
+    async def progress(self, job):
+        # Iterador assíncrono com o progresso de cada amostra do job, até o término
+        if job.done:
+            return
+        queue = asyncio.Queue()
+        self.subscribers.setdefault(job.process.pid, []).append(queue)
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            yield item
+
+    def active_jobs(self):
+        return len(self.jobs)
@@ -0,0 +1,160 @@
+# Modo batch: execução não interativa a partir de um manifesto JSONL
+# Cada linha do manifesto descreve um job:
+#   {"command": ["./prog", "arg"], "limit_cpu": 10, "limit_mem": 256, "limit_time": 60, "mode": "pre-pago"}
+# "command" também pode ser uma string (dividida em espaços como no prompt interativo) e "mode" é "pre-pago"
+# ou "pos-pago" (padrão: pos-pago). O manifesto é lido linha a linha, sem carregar o arquivo inteiro, e no máximo
+# `concurrency` jobs rodam ao mesmo tempo. Cada job terminado gera uma linha JSON no arquivo de resultados.
+# Com a fila de admissão (--fila, ver scheduler.py) os campos opcionais "priority" (padrão 0) e "submitter" definem a
+# ordem de admissão, e a fila também espera memória livre e créditos antes de lançar cada job.
+# Com --afinidade (ver placement.py) o campo opcional "cores" define quantos núcleos o job recebe.
+
+import json
+import os
+import sys
+import threading
+import time
+
+from main import FMS, CreditManagerPrePago, PostpaidAccrual, SamplerEngine
+
+
+def parse_job(job):
+    # Normaliza a descrição de um job (linha do manifesto ou pedido do daemon); ValueError, KeyError ou TypeError
+    # se ela for inválida
+    command = job["command"]
+    if isinstance(command, str):
+        command = command.split()
+    if not command or not all(isinstance(arg, str) for arg in command):
+        raise ValueError("command vazio ou com argumentos que não são texto")
+    return {
+        "command": command,
+        "limit_cpu": float(job["limit_cpu"]),
+        "limit_mem": float(job["limit_mem"]),
+        "limit_time": float(job["limit_time"]),
+        "pre_pago": job.get("mode", "pos-pago") == "pre-pago",
+        "priority": int(job.get("priority", 0)),
+        "submitter": str(job.get("submitter", "padrao")),
+        "cores": int(job["cores"]) if job.get("cores") is not None else None,
+    }
+
+
+def read_manifest(path):
+    # Gera os jobs do manifesto um por vez; linhas vazias e comentários (#) são ignorados
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                yield number, parse_job(json.loads(line))
+            except (ValueError, KeyError, TypeError) as e:
+                yield number, {"error": f"linha inválida: {e}"}
+
+
+class BatchRunner:
+    # Alimenta o SamplerEngine com os jobs do manifesto respeitando o limite de concorrência
+    # O término de cada job é tratado na thread do motor (on_finish), que grava o resultado e libera a vaga
+    # Com uma fila de admissão, a fila limita os jobs em execução e as vagas limitam os jobs na fila + em execução
+    queue_depth = 1024
+
+    def __init__(self, output, concurrency=None, engine=None, queue=None):
+        self.output = output
+        self.concurrency = concurrency or os.cpu_count() or 1
+        self.engine = engine or SamplerEngine.default()
+        self.queue = queue
+        if queue is not None:
+            queue.max_running = self.concurrency
+        self.slot_count = self.concurrency if queue is None else self.concurrency + self.queue_depth
+        self.slots = threading.BoundedSemaphore(self.slot_count)
+        self.output_lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+
+    def write(self, record):
+        with self.output_lock:
+            self.output.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def job_finished(self, fms):
+        record = fms.result()
+        record["line"] = fms.batch_line
+        with self.output_lock:
+            self.output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.completed += 1
+        self.slots.release()
+
+    def job_rejected(self, fms, reason):
+        # Job recusado pela fila ou que falhou ao lançar: nada é cobrado e a vaga é devolvida
+        with self.output_lock:
+            self.output.write(json.dumps(
+                {"line": fms.batch_line, "command": fms.command, "error": reason}, ensure_ascii=False,
+            ) + "\n")
+            self.failed += 1
+        self.slots.release()
+
+    def submit(self, number, job):
+        if "error" in job:
+            self.write({"line": number, "error": job["error"]})
+            self.failed += 1
+            return
+        self.slots.acquire()
+        fms = FMS(pre_pago=job["pre_pago"])
+        fms.verbose = False
+        fms.limit_cpu = job["limit_cpu"]
+        fms.limit_mem = job["limit_mem"]
+        fms.limit_time = job["limit_time"]
+        fms.cores = job["cores"]
+        fms.batch_line = number
+        fms.on_finish.append(self.job_finished)
+        if self.queue is not None:
+            fms.command = job["command"]
+            self.queue.submit(fms, job["command"], job["priority"], job["submitter"], on_reject=self.job_rejected)
+            self.submitted += 1
+            return
+        try:
+            fms.start_process(job["command"], engine=self.engine)
+        except OSError as e:
+            # Falha ao lançar o binário: nada é cobrado e a vaga é devolvida
+            self.slots.release()
+            self.write({"line": number, "command": job["command"], "error": f"falha ao lançar: {e}"})
+            self.failed += 1
+            return
+        self.submitted += 1
+
+    def run(self, path):
+        start = time.monotonic()
+        for number, job in read_manifest(path):
+            self.submit(number, job)
+        # Espera os últimos jobs ocupando todas as vagas
+        for _ in range(self.slot_count):
+            self.slots.acquire()
+        for _ in range(self.slot_count):
+            self.slots.release()
+        self.output.flush()
+        elapsed = time.monotonic() - start
+        return {
+            "jobs": self.completed,
+            "falhas": self.failed,
+            "tempo": elapsed,
+            "jobs_por_segundo": self.completed / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+def run_batch(path, output_path=None, concurrency=None, credits=None, queue=None):
+    # Executa o manifesto e imprime o resumo; resultados vão para output_path ou para a saída padrão
+    if credits is not None:
+        CreditManagerPrePago.set_total(credits)
+    output = open(output_path, "w", buffering=1) if output_path else sys.stdout
+    try:
+        summary = BatchRunner(output, concurrency, queue=queue).run(path)
+    finally:
+        if output_path:
+            output.close()
+    print(
+        f"{summary['jobs']} job(s) em {summary['tempo']:.2f}s "
+        f"({summary['jobs_por_segundo']:.1f} jobs/s), {summary['falhas']} falha(s)",
+        file=sys.stderr,
+    )
+    print(f"CPU pós-paga acumulada: {PostpaidAccrual.total():.2f}s", file=sys.stderr)
+    if credits is not None or FMS.ledger is not None:
+        print(f"Créditos restantes: R${CreditManagerPrePago.get_balance():.2f}", file=sys.stderr)
+    return summary
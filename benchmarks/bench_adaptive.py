@@ -0,0 +1,75 @@
+# Benchmark do intervalo de amostragem adaptativo
+# Roda as mesmas cargas com o intervalo fixo de 0.5 s e com o intervalo adaptativo e compara:
+# - custo de amostragem (amostras por job e CPU da thread do motor)
+# - quanto cada job passou do limite no momento em que foi encerrado (overshoot)
+# Uso: python benchmarks/bench_adaptive.py [--ociosos 20]
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from main import FMS, SamplerEngine
+
+PYTHON = sys.executable
+
+# Cargas: (nome, comando, limit_cpu (s), limit_mem (MB), limit_time (s))
+WORKLOADS = [
+    ("cpu", [PYTHON, "-c", "while True: pass"], 2.0, 1e6, 60.0),
+    ("memoria", [PYTHON, "-c", "import time\nx = []\nwhile True:\n    x.append(bytearray(20 * 2**20))\n    time.sleep(0.1)"], 60.0, 200.0, 60.0),
+    ("tempo", ["sleep", "60"], 60.0, 1e6, 3.0),
+]
+
+
+def run(adaptive, idle_jobs):
+    engine = SamplerEngine()
+    jobs = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name, command, limit_cpu, limit_mem, limit_time in WORKLOADS:
+            fms = FMS(pre_pago=False)
+            fms.adaptive_interval = adaptive
+            fms.limit_cpu, fms.limit_mem, fms.limit_time = limit_cpu, limit_mem, limit_time
+            fms.start_process(command, engine=engine)
+            jobs.append((name, fms))
+        # Jobs ociosos e longe dos limites, que só custam amostras
+        for _ in range(idle_jobs):
+            fms = FMS(pre_pago=False)
+            fms.adaptive_interval = adaptive
+            fms.limit_cpu, fms.limit_mem, fms.limit_time = 60.0, 1e6, 8.0
+            fms.start_process(["sleep", "60"], engine=engine)
+            jobs.append(("ocioso", fms))
+        while engine.active_jobs():
+            time.sleep(0.05)
+
+    result = {"modo": "adaptativo" if adaptive else "fixo 0.5s", "cpu_motor": engine.cpu_time}
+    idle = [fms for name, fms in jobs if name == "ocioso"]
+    result["amostras_por_ocioso"] = sum(fms.samples for fms in idle) / max(1, len(idle))
+    for name, fms in jobs[:len(WORKLOADS)]:
+        result[f"overshoot_{name}"] = fms.overshoot
+        result[f"amostras_{name}"] = fms.samples
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Intervalo adaptativo vs fixo")
+    parser.add_argument("--ociosos", type=int, default=20)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    for adaptive in (False, True):
+        result = run(adaptive, args.ociosos)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(
+                f"{result['modo']:>11} | CPU motor {1000 * result['cpu_motor']:7.1f} ms | "
+                f"amostras/ocioso {result['amostras_por_ocioso']:5.1f} | "
+                f"overshoot cpu {result['overshoot_cpu']:.3f} s ({result['amostras_cpu']} amostras) | "
+                f"memória {result['overshoot_memoria']:.1f} MB ({result['amostras_memoria']}) | "
+                f"tempo {result['overshoot_tempo']:.3f} s ({result['amostras_tempo']})"
+            )
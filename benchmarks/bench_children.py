@@ -0,0 +1,92 @@
+# Microbenchmark da descoberta de descendentes (ProcSampler.children) com e sem rastreador de processos
+# O host recebe --host processos alheios aos jobs e --jobs jobs com --filhos filhos cada; cada rodada é uma varredura
+# do motor (begin_sweep e ProcessTree.update de todos os jobs)
+# Modos: "ppid" (leitura do stat de todos os processos do host), "task" (/proc/<pid>/task/*/children) e "netlink"
+# (eventos do proc connector; omitido quando indisponível)
+# Uso: python benchmarks/bench_children.py [--host 1000] [--jobs 20] [--filhos 5] [--rodadas 50]
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from proc_connector import ProcConnector, TaskChildren
+from sampling import ProcessTree, ProcSampler
+
+JOB = "import subprocess, time; [subprocess.Popen(['sleep', '3600']) for _ in range({})]; time.sleep(3600)"
+
+
+def bench(tracker, roots, rounds):
+    sampler = ProcSampler()
+    sampler.tracker = tracker
+    trees = [ProcessTree(root) for root in roots]
+    # A primeira varredura abre os arquivos e monta as árvores; fica fora da medição
+    sampler.begin_sweep()
+    for tree in trees:
+        tree.update(sampler)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        sampler.begin_sweep()
+        for tree in trees:
+            tree.update(sampler)
+    elapsed = time.perf_counter() - start
+    processes = sum(len(tree) for tree in trees)
+    for tree in trees:
+        tree.forget(sampler)
+    return elapsed / rounds, processes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Custo da descoberta de descendentes por varredura")
+    parser.add_argument("--host", type=int, default=1000, help="processos do host fora dos jobs")
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--filhos", type=int, default=5, help="filhos de cada job")
+    parser.add_argument("--rodadas", type=int, default=50)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    trackers = [("ppid", None), ("task", TaskChildren())]
+    try:
+        trackers.append(("netlink", ProcConnector().start()))
+    except OSError as e:
+        print(f"netlink indisponível: {e}", file=sys.stderr)
+
+    others = [subprocess.Popen(["sleep", "3600"]) for _ in range(args.host)]
+    jobs = [subprocess.Popen([sys.executable, "-c", JOB.format(args.filhos)]) for _ in range(args.jobs)]
+    try:
+        # Espera os filhos dos jobs existirem
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if all(len(TaskChildren().children(job.pid)) >= args.filhos for job in jobs):
+                break
+            time.sleep(0.05)
+        for mode, tracker in trackers:
+            cost, processes = bench(tracker, [job.pid for job in jobs], args.rodadas)
+            if args.json:
+                print(json.dumps({
+                    "modo": mode,
+                    "host": args.host,
+                    "jobs": args.jobs,
+                    "processos_dos_jobs": processes,
+                    "ms_por_varredura": 1000 * cost,
+                }))
+            else:
+                print(f"{mode:>7} | {processes} processos em {args.jobs} jobs, {args.host} no host | "
+                      f"{1000 * cost:8.3f} ms por varredura")
+    finally:
+        for process in jobs:
+            # Os filhos de cada job primeiro, enquanto ainda são filhos dele
+            for child in TaskChildren().children(process.pid):
+                try:
+                    os.kill(child, 9)
+                except ProcessLookupError:
+                    pass
+            process.kill()
+            process.wait()
+        for process in others:
+            process.kill()
+            process.wait()
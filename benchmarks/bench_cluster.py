@@ -0,0 +1,108 @@
+# Benchmark do coordenador com agentes no mesmo host (cluster.py)
+# Um coordenador no processo do benchmark e --agentes agentes (python main.py --agente) com --vagas vagas cada
+# Duas cargas por número de agentes:
+# - "curtos": --jobs jobs "true" (pós-pagos), medindo a vazão do despacho (jobs/s até o último terminar)
+# - "cpu": jobs pré-pagos e pós-pagos que gastam --cpu segundos de CPU; mede-se o atraso do ledger central (do
+#   primeiro registro de uso no agente até o lote ser aplicado no coordenador) e, no fim, a diferença entre o que
+#   o coordenador cobrou e a CPU dos jobs, que deve ser zero
+# Uso: python benchmarks/bench_cluster.py [--agentes 1 2 4] [--vagas 4] [--jobs 200] [--cpu 0.3]
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from batch import parse_job
+from cluster import Coordinator
+from main import FMS, CreditManagerPrePago
+
+BURN = "import time\nt = time.process_time()\nwhile time.process_time() - t < {}: pass"
+
+
+def percentile(histogram, p):
+    # Limite do bucket em que cai o percentil p
+    target = p * histogram.count
+    cumulative = 0
+    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+        cumulative += count
+        if cumulative >= target:
+            return bound
+    return float("inf")
+
+
+def run(agents, slots, jobs):
+    FMS.total_cpu_used = 0.0
+    CreditManagerPrePago.set_total(1e6)
+    coordinator = Coordinator().start()
+    host, port = coordinator.address
+    processes = [
+        subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "main.py"), "--agente", f"{host}:{port}", "--concorrencia", str(slots)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        for _ in range(agents)
+    ]
+    try:
+        coordinator.wait_agents(agents)
+        start = time.monotonic()
+        for spec in jobs:
+            coordinator.submit(spec)
+        coordinator.wait()
+        elapsed = time.monotonic() - start
+        # Espera os últimos lotes de uso (os débitos de um job chegam antes do aviso de término dele)
+        finished = [job for job in coordinator.jobs.values() if job.state == "encerrado"]
+        cpu = sum(job.result["cpu_time"] for job in finished)
+        prepaid = sum(job.result["cpu_time"] for job in finished if job.spec["pre_pago"])
+        charged = FMS.total_cpu_used + (1e6 - CreditManagerPrePago.get_balance())
+        lag = coordinator.ledger_lag
+        return {
+            "agentes": agents,
+            "jobs": len(jobs),
+            "terminados": len(finished),
+            "jobs_por_s": len(finished) / elapsed,
+            "cpu_jobs_s": cpu,
+            "cpu_pre_paga_s": prepaid,
+            "diferenca_cobranca_s": charged - cpu,
+            "atraso_ledger_medio_ms": 1000 * lag.sum / lag.count if lag.count else 0.0,
+            "atraso_ledger_p99_ms": 1000 * percentile(lag, 0.99) if lag.count else 0.0,
+        }
+    finally:
+        coordinator.close()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vazão do coordenador e atraso do ledger central")
+    parser.add_argument("--agentes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--vagas", type=int, default=4, help="vagas de cada agente")
+    parser.add_argument("--jobs", type=int, default=200, help="jobs curtos por rodada")
+    parser.add_argument("--cpu", type=float, default=0.3, help="CPU de cada job da carga cpu")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    short = [parse_job({"command": ["true"], "limit_cpu": 5, "limit_mem": 64, "limit_time": 30})] * args.jobs
+    burn = [
+        parse_job({
+            "command": [sys.executable, "-c", BURN.format(args.cpu)], "limit_cpu": 10 * args.cpu + 1,
+            "limit_mem": 64, "limit_time": 60, "mode": "pre-pago" if index % 2 else "pos-pago",
+        })
+        for index in range(8)
+    ]
+    for agents in args.agentes:
+        for load, jobs in (("curtos", short), ("cpu", burn)):
+            result = {"carga": load, **run(agents, args.vagas, jobs)}
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print(
+                    f"{load:>6} | {agents} agente(s) | {result['terminados']}/{result['jobs']} jobs | "
+                    f"{result['jobs_por_s']:7.1f} jobs/s | CPU {result['cpu_jobs_s']:6.2f}s "
+                    f"(cobrança {result['diferenca_cobranca_s']:+.4f}s) | atraso do ledger "
+                    f"médio {result['atraso_ledger_medio_ms']:6.1f} ms, p99 <= {result['atraso_ledger_p99_ms']:g} ms"
+                )
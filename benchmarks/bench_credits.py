@@ -0,0 +1,100 @@
+# Benchmark de contenção dos créditos pré-pagos
+# Compara o débito direto no CreditManagerPrePago (um lock global por débito) com o leasing (CreditLease)
+# de 1 a 1000 jobs simultâneos, e confere que o esgotamento continua exato (nada é gasto além do saldo)
+# Uso: python benchmarks/bench_credits.py [--jobs 1 10 100 1000] [--debitos 200]
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from main import CreditLease, CreditManagerPrePago
+
+AMOUNT = 0.001
+
+
+class CountingLock:
+    # Envolve o lock do CreditManagerPrePago para contar aquisições e o tempo esperando por ele
+    def __init__(self, lock):
+        self.lock = lock
+        self.acquisitions = 0
+        self.wait = 0.0
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self.lock.acquire()
+        self.wait += time.perf_counter() - start
+        self.acquisitions += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+
+def run(mode, jobs, debits, credits):
+    CreditManagerPrePago.set_total(credits)
+    original = CreditManagerPrePago.lock
+    counting = CreditManagerPrePago.lock = CountingLock(original)
+    spent = [0.0] * jobs
+    barrier = threading.Barrier(jobs + 1)
+
+    def worker(index):
+        lease = CreditLease() if mode == "lease" else None
+        barrier.wait()
+        for _ in range(debits):
+            ok = lease.debit(AMOUNT) if lease else CreditManagerPrePago.debit(AMOUNT)
+            if not ok:
+                break
+            spent[index] += AMOUNT
+        if lease:
+            lease.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(jobs)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    CreditManagerPrePago.lock = original
+
+    total_spent = sum(spent)
+    balance = CreditManagerPrePago.get_balance()
+    return {
+        "modo": mode,
+        "jobs": jobs,
+        "debitos_s": sum(round(s / AMOUNT) for s in spent) / elapsed,
+        "aquisicoes_lock": counting.acquisitions,
+        "espera_lock_ms": 1000 * counting.wait,
+        # Exatidão: o gasto nunca passa dos créditos e gasto + saldo final fecha com o total inicial
+        "gasto": round(total_spent, 6),
+        "saldo_final": round(balance, 6),
+        "exato": total_spent <= credits + 1e-9 and abs(total_spent + balance - credits) < 1e-6,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Contenção dos créditos: débito direto vs leasing")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--debitos", type=int, default=200)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    for jobs in args.jobs:
+        # Saldo para metade da demanda: metade dos jobs esgota os créditos no meio da execução
+        credits = jobs * args.debitos * AMOUNT / 2
+        for mode in ("direto", "lease"):
+            result = run(mode, jobs, args.debitos, credits)
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print(
+                    f"{mode:>6} | jobs {jobs:5d} | {result['debitos_s']:10.0f} débitos/s | "
+                    f"lock {result['aquisicoes_lock']:7d} aquisições, espera {result['espera_lock_ms']:8.1f} ms | "
+                    f"gasto {result['gasto']:.3f} saldo {result['saldo_final']:.3f} exato={result['exato']}"
+                )
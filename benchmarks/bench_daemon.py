@@ -0,0 +1,69 @@
+# Benchmark do modo daemon: custo de enviar um job por um cliente do socket contra iniciar o FMS a cada job
+# Modos:
+# - "fms --batch": um python main.py --batch com um manifesto de uma linha por job (importa o FMS inteiro)
+# - "fmsctl": um python fmsctl.py enviar por job contra um daemon já carregado
+# - "conexão": requisições submit numa única conexão aberta (o custo do protocolo e do lançamento no daemon)
+# Os jobs são "true"; mede-se o tempo por envio (no batch, até o FMS sair)
+# Uso: python benchmarks/bench_daemon.py [--jobs 20]
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from fmsctl import Client
+
+JOB = {"command": ["true"], "limit_cpu": 5, "limit_mem": 100, "limit_time": 10}
+
+
+def per_job(n, run):
+    start = time.perf_counter()
+    for _ in range(n):
+        run()
+    return (time.perf_counter() - start) / n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Envio de jobs: daemon x FMS por job")
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        manifest = os.path.join(directory, "job.jsonl")
+        with open(manifest, "w") as f:
+            f.write(json.dumps(JOB) + "\n")
+        path = os.path.join(directory, "fms.sock")
+        env = dict(os.environ, FMS_SOCKET=path)
+        quiet = {"stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL}
+
+        results = {}
+        results["fms --batch"] = per_job(args.jobs, lambda: subprocess.run(
+            [sys.executable, os.path.join(ROOT, "main.py"), "--batch", manifest], check=True, **quiet,
+        ))
+        daemon = subprocess.Popen([sys.executable, os.path.join(ROOT, "main.py"), "--daemon"], env=env, **quiet)
+        try:
+            while not os.path.exists(path):
+                time.sleep(0.01)
+            results["fmsctl"] = per_job(args.jobs, lambda: subprocess.run(
+                [sys.executable, os.path.join(ROOT, "fmsctl.py"), "enviar", "--cpu", "5", "--mem", "100",
+                 "--tempo", "10", "--", "true"], env=env, check=True, **quiet,
+            ))
+            client = Client(path)
+            results["conexão"] = per_job(args.jobs, lambda: client.request("submit", **JOB))
+            client.close()
+        finally:
+            daemon.terminate()
+            daemon.wait()
+
+    for mode, cost in results.items():
+        if args.json:
+            print(json.dumps({"modo": mode, "jobs": args.jobs, "ms_por_envio": 1000 * cost}))
+        else:
+            print(f"{mode:>12} | {args.jobs} jobs | {1000 * cost:8.2f} ms por envio")
@@ -0,0 +1,145 @@
+# Benchmark do motor de amostragem
+# Mede o custo de CPU do próprio FMS e o atraso (jitter) das amostras com 10, 100 e 1000 jobs
+# Uso: python benchmarks/bench_engine.py [--jobs 10 100 1000] [--duracao 5] [--modo engine|threads]
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from main import FMS, SamplerEngine
+
+
+def fms_cpu():
+    # Tempo de CPU (usuário + sistema) do processo FMS inteiro, incluindo todas as threads
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def make_jobs(n, sampler=None):
+    # Jobs ociosos com limites altos: o que se mede é apenas o custo de monitorar
+    jobs = []
+    for _ in range(n):
+        fms = FMS(pre_pago=False, sampler=sampler)
+        fms.limit_cpu = fms.limit_mem = fms.limit_time = 1e9
+        fms.launch_process(["sleep", "3600"])
+        fms.start_monitoring()
+        jobs.append(fms)
+    return jobs
+
+
+def stop_jobs(jobs):
+    for fms in jobs:
+        fms.popen.kill()
+    for fms in jobs:
+        fms.popen.wait()
+
+
+def run_engine(n, duration):
+    engine = SamplerEngine()
+    jobs = make_jobs(n, engine.sampler)
+    with contextlib.redirect_stdout(io.StringIO()):
+        cpu_start = fms_cpu()
+        for fms in jobs:
+            engine.add(fms)
+        time.sleep(duration)
+        cpu = fms_cpu() - cpu_start
+        stats = engine.stats()
+        stop_jobs(jobs)
+        time.sleep(2 * FMS.interval)
+    return {
+        "modo": "engine",
+        "jobs": n,
+        "threads": 1,
+        "cpu_fms": cpu,
+        "cpu_pct": 100.0 * cpu / duration,
+        "amostras_s": stats["samples"] / duration,
+        "jitter_p50_ms": 1000 * stats["jitter_p50"],
+        "jitter_p99_ms": 1000 * stats["jitter_p99"],
+        "jitter_max_ms": 1000 * stats["jitter_max"],
+    }
+
+
+def run_threads(n, duration):
+    # Linha de base: uma thread por job executando monitor_loop, como era antes do SamplerEngine
+    # O jitter é medido envolvendo o tick() de cada job para registrar o atraso de cada acordada
+    jobs = make_jobs(n)
+    jitters = []
+    jitters_lock = threading.Lock()
+    samples = [0]
+
+    def instrumented(fms):
+        tick = fms.tick
+        state = {"deadline": time.monotonic() + fms.interval}
+        def wrapper():
+            now = time.monotonic()
+            with jitters_lock:
+                jitters.append(now - state["deadline"])
+                samples[0] += 1
+            interval = tick()
+            state["deadline"] = time.monotonic() + (interval or 0)
+            return interval
+        fms.tick = wrapper
+        time.sleep(0)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        cpu_start = fms_cpu()
+        threads = []
+        for fms in jobs:
+            instrumented(fms)
+            # O monitor_loop chama start_monitoring() de novo, então o primeiro prazo é o intervalo após o início
+            thread = threading.Thread(target=fms.monitor_loop, daemon=True)
+            thread.start()
+            threads.append(thread)
+        time.sleep(duration)
+        cpu = fms_cpu() - cpu_start
+        with jitters_lock:
+            measured = sorted(jitters)
+            count = samples[0]
+        stop_jobs(jobs)
+        for thread in threads:
+            thread.join()
+
+    def pct(p):
+        return measured[min(len(measured) - 1, int(p * len(measured)))] if measured else 0.0
+
+    return {
+        "modo": "threads",
+        "jobs": n,
+        "threads": n,
+        "cpu_fms": cpu,
+        "cpu_pct": 100.0 * cpu / duration,
+        "amostras_s": count / duration,
+        "jitter_p50_ms": 1000 * pct(0.50),
+        "jitter_p99_ms": 1000 * pct(0.99),
+        "jitter_max_ms": 1000 * (measured[-1] if measured else 0.0),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do motor de amostragem do FMS")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--duracao", type=float, default=5.0)
+    parser.add_argument("--modo", choices=["engine", "threads", "ambos"], default="ambos")
+    parser.add_argument("--json", action="store_true", help="imprime uma linha JSON por resultado")
+    args = parser.parse_args()
+
+    modes = ["engine", "threads"] if args.modo == "ambos" else [args.modo]
+    for n in args.jobs:
+        for mode in modes:
+            result = (run_engine if mode == "engine" else run_threads)(n, args.duracao)
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print(
+                    f"{result['modo']:>8} | jobs {n:5d} | CPU FMS {result['cpu_pct']:6.2f}% | "
+                    f"amostras/s {result['amostras_s']:8.1f} | jitter p50 {result['jitter_p50_ms']:7.2f} ms "
+                    f"p99 {result['jitter_p99_ms']:7.2f} ms max {result['jitter_max_ms']:7.2f} ms"
+                )
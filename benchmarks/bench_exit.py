@@ -0,0 +1,59 @@
+# Benchmark da latência de detecção de término
+# Lança jobs curtos (sleep) e mede quanto tempo depois do fim do processo o FMS fecha o job
+# Uso: python benchmarks/bench_exit.py [--jobs 50] [--duracao-job 0.1] [--sem-pidfd]
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from main import FMS, SamplerEngine
+
+
+def run(n, job_duration, use_pidfd):
+    engine = SamplerEngine(use_pidfd=use_pidfd)
+    jobs = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(n):
+            fms = FMS(pre_pago=False)
+            fms.limit_cpu = fms.limit_mem = fms.limit_time = 1e9
+            fms.start_process(["sleep", str(job_duration)], engine=engine)
+            jobs.append(fms)
+        while engine.active_jobs():
+            time.sleep(0.01)
+    # A latência é o tempo de vida do job no FMS menos a duração do próprio processo
+    # (inclui o custo de exec do sleep, que é o mesmo nos dois modos)
+    latencies = sorted(fms.wall_clock - job_duration for fms in jobs)
+    return {
+        "pidfd": engine.use_pidfd,
+        "jobs": n,
+        "latencia_p50_ms": 1000 * latencies[len(latencies) // 2],
+        "latencia_p99_ms": 1000 * latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))],
+        "latencia_max_ms": 1000 * latencies[-1],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latência de detecção de término do FMS")
+    parser.add_argument("--jobs", type=int, default=50)
+    parser.add_argument("--duracao-job", type=float, default=0.1)
+    parser.add_argument("--sem-pidfd", action="store_true", help="mede apenas o modo com polling")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    modes = [False] if args.sem_pidfd else [True, False]
+    for use_pidfd in modes:
+        result = run(args.jobs, args.duracao_job, use_pidfd)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(
+                f"{'pidfd' if result['pidfd'] else 'polling':>8} | jobs {result['jobs']:4d} | "
+                f"latência p50 {result['latencia_p50_ms']:7.2f} ms p99 {result['latencia_p99_ms']:7.2f} ms "
+                f"max {result['latencia_max_ms']:7.2f} ms"
+            )
@@ -0,0 +1,83 @@
+# Benchmark do lançamento de jobs: Popen do próprio FMS contra o fork server (com e sem o pool de Python)
+# Um lastro de memória tocada simula um FMS grande, em que o fork do Popen copia as tabelas de páginas do pai
+# Para cada modo e comando são lançados --jobs jobs em sequência no SamplerEngine; mede-se a taxa de lançamento
+# (só as chamadas de start_process) e o tempo até todos os jobs terminarem
+# Sem child_setup o Popen usa vfork e o tamanho do FMS pouco importa; com child_setup (rlimits, cgroup, afinidade)
+# ele precisa de um fork completo do FMS, por isso cada comando roda também com --rlimit (coluna "setup")
+# Uso: python benchmarks/bench_forkserver.py [--jobs 200] [--lastro-mb 512] [--pool 4]
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from forkserver import ForkServer
+from main import FMS, SamplerEngine
+
+COMMANDS = {
+    "true": ["true"],
+    "python": [sys.executable, "-c", "pass"],
+}
+
+
+def run(mode, command, n, forkserver, setup):
+    FMS.forkserver = forkserver
+    FMS.use_rlimits = setup
+    engine = SamplerEngine()
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for _ in range(n):
+            fms = FMS(pre_pago=False)
+            fms.limit_cpu = fms.limit_mem = fms.limit_time = 1e9
+            fms.start_process(COMMANDS[command], engine=engine)
+        launched = time.perf_counter() - start
+        while engine.active_jobs():
+            time.sleep(0.001)
+        total = time.perf_counter() - start
+    FMS.forkserver = None
+    FMS.use_rlimits = False
+    return {
+        "modo": mode,
+        "comando": command,
+        "setup": setup,
+        "jobs": n,
+        "lancamentos_por_s": n / launched,
+        "lancamento_medio_ms": 1000 * launched / n,
+        "jobs_por_s": n / total,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Taxa de lançamento: Popen x fork server")
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--lastro-mb", type=int, default=512, help="memória tocada pelo FMS antes dos lançamentos")
+    parser.add_argument("--pool", type=int, default=4, help="interpretadores do pool de Python do fork server")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    # Os servidores são iniciados antes do lastro, como o FMS faz antes de crescer
+    servers = [("popen", None), ("fork-server", ForkServer()), ("fork-server+pool", ForkServer(args.pool))]
+    ballast = bytearray(args.lastro_mb * 2 ** 20)
+    for offset in range(0, len(ballast), 4096):
+        ballast[offset] = 1
+    time.sleep(0.5)
+
+    for command in COMMANDS:
+        for setup in (False, True):
+            for mode, forkserver in servers:
+                if mode.endswith("pool") and command != "python":
+                    continue
+                result = run(mode, command, args.jobs, forkserver, setup)
+                if args.json:
+                    print(json.dumps(result))
+                else:
+                    print(
+                        f"{mode:>16} | {command:>6} | setup {'sim' if setup else 'não'} | {result['jobs']} jobs | "
+                        f"{result['lancamentos_por_s']:8.1f} lançamentos/s ({result['lancamento_medio_ms']:6.2f} ms) | "
+                        f"{result['jobs_por_s']:8.1f} jobs/s até o fim"
+                    )
@@ -0,0 +1,112 @@
+# Benchmark do encerramento forçado: do SIGTERM até todos os processos do job sumirem
+# A carga ignora o SIGTERM e cria processos sem parar (cada processo grava o pid em FMS_BENCH_PIDS), então parte
+# da árvore nunca aparece numa amostra; o job é encerrado por limit_time
+# Modos: "grupo" (sessão própria e killpg, o padrão) e "pids" (sem grupo: raiz e descendentes da última amostra)
+# Mede-se a latência do FMS (SIGTERM até o fechamento do job), a latência até o último processo sumir e quantos
+# processos ainda estavam vivos depois de --espera segundos
+# Uso: python benchmarks/bench_kill.py [--jobs 5] [--prazo 0.5]
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+import psutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from main import FMS, SamplerEngine
+
+WORKLOAD = """
+import os, signal, time
+signal.signal(signal.SIGTERM, signal.SIG_IGN)
+def record():
+    with open(os.environ["FMS_BENCH_PIDS"], "a") as f:
+        f.write(f"{os.getpid()}\\n")
+record()
+for _ in range(40):
+    if os.fork() == 0:
+        record()
+        time.sleep(60)
+        os._exit(0)
+    time.sleep(0.02)
+time.sleep(60)
+"""
+
+
+def alive(pid):
+    try:
+        return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+
+
+def run(mode, n, grace, wait, directory):
+    FMS.process_groups = mode == "grupo"
+    FMS.kill_grace = grace
+    engine = SamplerEngine()
+    jobs = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for index in range(n):
+            path = os.path.join(directory, f"{mode}-{index}")
+            os.environ["FMS_BENCH_PIDS"] = path
+            fms = FMS(pre_pago=False)
+            fms.limit_cpu, fms.limit_mem, fms.limit_time = 60.0, 1e6, 0.5
+            fms.start_process([sys.executable, "-c", WORKLOAD], engine=engine)
+            jobs.append((fms, path))
+        while engine.active_jobs():
+            time.sleep(0.005)
+    # Espera os processos sumirem, até o limite --espera contado a partir do SIGTERM
+    pids = {}
+    for fms, path in jobs:
+        with open(path) as f:
+            pids[fms] = [int(line) for line in f if line.strip()]
+    reclaim, survivors = [], 0
+    for fms, job_pids in pids.items():
+        while any(alive(pid) for pid in job_pids) and time.monotonic() < fms.term_time + wait:
+            time.sleep(0.002)
+        remaining = [pid for pid in job_pids if alive(pid)]
+        survivors += len(remaining)
+        if not remaining:
+            reclaim.append(time.monotonic() - fms.term_time)
+        # Limpeza dos processos que escaparam, para não afetarem o próximo modo
+        for pid in remaining:
+            with contextlib.suppress(psutil.Error):
+                psutil.Process(pid).kill()
+    latencies = sorted(fms.kill_latency for fms in pids)
+    return {
+        "modo": mode,
+        "jobs": n,
+        "prazo_s": grace,
+        "processos": sum(len(job_pids) for job_pids in pids.values()),
+        "latencia_fms_max_ms": 1000 * latencies[-1],
+        "latencia_liberacao_max_ms": 1000 * max(reclaim) if reclaim else None,
+        "sobreviventes": survivors,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latência do encerramento forçado até a liberação dos processos")
+    parser.add_argument("--jobs", type=int, default=5)
+    parser.add_argument("--prazo", type=float, default=0.5, help="kill_grace: segundos entre SIGTERM e SIGKILL")
+    parser.add_argument("--espera", type=float, default=3.0, help="tempo máximo de espera pelos processos")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ("grupo", "pids"):
+            result = run(mode, args.jobs, args.prazo, args.espera, directory)
+            if args.json:
+                print(json.dumps(result))
+            else:
+                reclaim = result["latencia_liberacao_max_ms"]
+                print(
+                    f"{mode:>6} | {result['jobs']} jobs, {result['processos']} processos | "
+                    f"FMS max {result['latencia_fms_max_ms']:7.1f} ms | "
+                    f"liberação max {'-' if reclaim is None else f'{reclaim:7.1f} ms'} | "
+                    f"sobreviventes {result['sobreviventes']}"
+                )
@@ -0,0 +1,70 @@
+# Benchmark da captura de saída
+# Roda jobs ociosos amostrados a cada 50 ms, com e sem um job que escreve sem parar (cat /dev/zero) no stdout,
+# e mede a vazão capturada para os logs e o atraso das amostras dos demais jobs
+# Uso: python benchmarks/bench_output.py [--ociosos 20] [--duracao 3] [--dir /tmp]
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from main import FMS, SamplerEngine
+from output import LogWriter
+
+
+def run(directory, idle_jobs, duration, spew):
+    FMS.log_dir = directory
+    FMS.log_max_bytes = 64 * 2 ** 20
+    engine = SamplerEngine()
+    jobs = []
+    if spew:
+        fms = FMS(pre_pago=False)
+        fms.verbose = False
+        fms.limit_cpu, fms.limit_mem, fms.limit_time = 1e6, 1e6, duration
+        fms.start_process(["cat", "/dev/zero"], engine=engine)
+        jobs.append(fms)
+    for _ in range(idle_jobs):
+        fms = FMS(pre_pago=False)
+        fms.verbose = False
+        fms.adaptive_interval = False
+        fms.interval = 0.05
+        fms.limit_cpu, fms.limit_mem, fms.limit_time = 1e6, 1e6, duration
+        fms.start_process(["sleep", str(2 * duration)], engine=engine)
+        jobs.append(fms)
+    while engine.active_jobs():
+        time.sleep(0.05)
+    LogWriter.default().flush()
+    jitters = sorted(engine.jitters)
+    return {
+        "escritor": spew,
+        "mb_s": engine.output_bytes / 2 ** 20 / duration,
+        "atraso_p50_ms": 1000 * jitters[len(jitters) // 2],
+        "atraso_p99_ms": 1000 * jitters[min(len(jitters) - 1, int(0.99 * len(jitters)))],
+        "atraso_max_ms": 1000 * jitters[-1],
+        "cpu_motor_s": engine.cpu_time,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Captura de saída: vazão e impacto na amostragem")
+    parser.add_argument("--ociosos", type=int, default=20)
+    parser.add_argument("--duracao", type=float, default=3.0)
+    parser.add_argument("--dir", default=None, help="diretório dos logs (padrão: temporário)")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    for spew in (False, True):
+        with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+            result = run(directory, args.ociosos, args.duracao, spew)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(
+                f"{'com' if spew else 'sem'} escritor | {result['mb_s']:7.1f} MB/s capturados | "
+                f"atraso das amostras p50 {result['atraso_p50_ms']:6.2f} ms p99 {result['atraso_p99_ms']:6.2f} ms "
+                f"max {result['atraso_max_ms']:6.2f} ms | CPU do motor {result['cpu_motor_s']:.2f} s"
+            )
@@ -0,0 +1,61 @@
+# Microbenchmark dos backends de amostragem (sampling.py)
+# Compara o custo por pid de uma amostra completa (CPU, RSS, estado, pai) entre o ProcSampler e o PsutilSampler
+# Uso: python benchmarks/bench_sampling.py [--pids 200] [--rodadas 50]
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sampling import ProcSampler, PsutilSampler
+
+
+def bench(sampler, pids, rounds):
+    # A primeira rodada abre os arquivos / cria os objetos e fica fora da medição
+    for pid in pids:
+        sampler.sample(pid)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        sampler.begin_sweep()
+        for pid in pids:
+            sampler.sample(pid)
+    elapsed = time.perf_counter() - start
+    for pid in pids:
+        sampler.forget(pid)
+    return elapsed / (rounds * len(pids))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmark dos backends de amostragem")
+    parser.add_argument("--pids", type=int, default=200)
+    parser.add_argument("--rodadas", type=int, default=50)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    procs = [subprocess.Popen(["sleep", "3600"]) for _ in range(args.pids)]
+    pids = [p.pid for p in procs]
+    try:
+        results = {}
+        for sampler in (PsutilSampler(), ProcSampler()):
+            results[sampler.name] = bench(sampler, pids, args.rodadas)
+    finally:
+        for p in procs:
+            p.kill()
+            p.wait()
+
+    speedup = results["psutil"] / results["proc"]
+    if args.json:
+        print(json.dumps({
+            "pids": args.pids,
+            "psutil_us_por_pid": 1e6 * results["psutil"],
+            "proc_us_por_pid": 1e6 * results["proc"],
+            "ganho": speedup,
+        }))
+    else:
+        for name, cost in results.items():
+            print(f"{name:>7}: {1e6 * cost:8.2f} µs por pid")
+        print(f"ganho do ProcSampler: {speedup:.1f}x")
@@ -0,0 +1,105 @@
+# Benchmark do monitoramento dividido entre processos (--monitores, sharded.py)
+# --jobs jobs ociosos, cada um um sh com --filhos sleeps (--filhos + 1 pids por job), amostrados com intervalo fixo
+# de 1 ms, bem abaixo do que o motor consegue atender: o motor fica saturado e a vazão medida é a máxima
+# Modos: "motor" (a árvore é percorrida na thread do motor, como sem --monitores) e "N monitor(es)" para cada --monitores
+# Mede-se a vazão de amostragem em pids/s, a CPU da thread do motor (cobrança e limites) e a dos monitores (/proc)
+# Os filhos vêm sempre do rastreador (ver proc_connector.py), no motor e nos monitores, como exige --monitores > 1: com a
+# varredura de ppid cada monitor repetiria a leitura do /proc do host inteiro
+# A vazão só cresce com os monitores enquanto houver núcleos livres: num host de um núcleo os processos dividem o mesmo
+# núcleo e a vazão fica parada. Para separar isso de trabalho repetido, a coluna "pids/s por CPU" divide a vazão pela
+# CPU gasta nos monitores: se ela se mantém com N monitores, o trabalho está sendo dividido e não duplicado, e a vazão
+# cresce com os núcleos livres
+# Uso: python benchmarks/bench_sharded.py [--jobs 200] [--filhos 9] [--monitores 1 2 4] [--duracao 5]
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from main import FMS, SamplerEngine
+from proc_connector import children_tracker
+from sampling import ProcSampler
+from sharded import ShardPool
+
+
+def make_jobs(n, children, sampler):
+    jobs = []
+    script = f"for i in $(seq {children}); do sleep 3600 & done; wait"
+    for _ in range(n):
+        fms = FMS(pre_pago=False, sampler=sampler)
+        fms.limit_cpu = fms.limit_mem = fms.limit_time = 1e9
+        fms.adaptive_interval = False
+        fms.interval = 0.001
+        fms.launch_process(["sh", "-c", script])
+        fms.start_monitoring()
+        jobs.append(fms)
+    return jobs
+
+
+def run(n, children, duration, monitors):
+    tracker = ProcSampler.tracker.name if ProcSampler.tracker is not None else None
+    shards = ShardPool(monitors, tracker) if monitors else None
+    engine = SamplerEngine(shards=shards)
+    jobs = make_jobs(n, children, engine.sampler)
+    # Espera os sleeps de todos os jobs nascerem antes de medir
+    time.sleep(0.5)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for fms in jobs:
+            engine.add(fms)
+        time.sleep(1.0)
+        before = engine.stats()
+        start = time.monotonic()
+        time.sleep(duration)
+        elapsed = time.monotonic() - start
+        after = engine.stats()
+        processes = sum(fms.series.values("children")[-1] for fms in jobs if len(fms.series)) / n
+        for fms in jobs:
+            fms.signal_tree(9)
+        while engine.active_jobs():
+            time.sleep(0.05)
+    if shards is not None:
+        shards.close()
+    samples = (after["samples"] - before["samples"]) / elapsed
+    monitor_cpu = (after["monitor_cpu_time"] - before["monitor_cpu_time"]) / elapsed
+    return {
+        "modo": f"{monitors} monitor(es)" if monitors else "motor",
+        "rastreador": tracker or "ppid",
+        "jobs": n,
+        "pids_por_job": processes,
+        "amostras_s": samples,
+        "pids_s": samples * processes,
+        "cpu_motor_pct": 100.0 * (after["cpu_time"] - before["cpu_time"]) / elapsed,
+        "cpu_monitores_pct": 100.0 * monitor_cpu,
+        "pids_por_cpu_monitor": samples * processes / monitor_cpu if monitor_cpu else None,
+        "jitter_p99_ms": 1000 * after["jitter_p99"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vazão de amostragem com o /proc lido em vários processos")
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--filhos", type=int, default=9, help="sleeps por job")
+    parser.add_argument("--monitores", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duracao", type=float, default=5.0)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    ProcSampler.tracker = children_tracker()
+
+    print(f"Núcleos disponíveis: {len(os.sched_getaffinity(0))}", file=sys.stderr)
+    for monitors in [0] + args.monitores:
+        result = run(args.jobs, args.filhos, args.duracao, monitors)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(
+                f"{result['modo']:>13} | {result['rastreador']:>7} | {result['jobs']} jobs x {result['pids_por_job']:.0f} pids | "
+                f"{result['pids_s']:9.0f} pids/s | motor {result['cpu_motor_pct']:5.1f}% CPU | "
+                f"monitores {result['cpu_monitores_pct']:5.1f}% CPU | "
+                + (f"{result['pids_por_cpu_monitor']:9.0f} pids/s por CPU | " if result["pids_por_cpu_monitor"] else " " * 23 + "| ")
+                + f"jitter p99 {result['jitter_p99_ms']:7.1f} ms"
+            )
@@ -0,0 +1,204 @@
+# Suíte de benchmark e precisão do FMS
+# Roda cargas sintéticas sob o FMS (no SamplerEngine) e mede, por carga:
+# - custo do próprio FMS: CPU da thread do motor e do processo inteiro, por amostra e por job
+# - latência de detecção de término: do instante em que o processo sai até o FMS fechar o job
+# - overshoot de CPU e memória além de limit_cpu e limit_mem no fechamento do job (inclui o tempo até a saída)
+# - erro da contabilidade de CPU (última amostra da árvore e valor final) em relação ao rusage do wait4
+# Cada carga gera uma linha JSON; com --comparar as métricas são checadas contra uma execução anterior e o script
+# sai com código 1 se alguma piorou além da tolerância
+# Uso: python benchmarks/suite.py [--repeticoes 3] [--cargas cpu memoria] [--json] [--comparar base.jsonl]
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from main import FMS, SamplerEngine
+
+PYTHON = sys.executable
+
+# Ao sair normalmente, cada carga grava time.monotonic() (relógio comum a todos os processos) em FMS_BENCH_EXIT
+# e sai com os._exit, para que o encerramento do interpretador não conte como latência do FMS
+EXIT_STAMP = """
+fd = os.open(os.environ["FMS_BENCH_EXIT"], os.O_WRONLY | os.O_CREAT)
+os.write(fd, repr(time.monotonic()).encode())
+os._exit(0)
+"""
+
+BURN = """
+def burn(seconds):
+    end = time.process_time() + seconds
+    while time.process_time() < end:
+        pass
+"""
+
+# Cargas: nome -> (script, limit_cpu (s), limit_mem (MB), limit_time (s))
+WORKLOADS = {
+    # Queima CPU até ser morto por limit_cpu
+    "cpu": ("while True: pass", 1.5, 1e6, 60.0),
+    # Aloca 10 MB a cada 20 ms até ser morto por limit_mem
+    "memoria": (
+        "x = []\nwhile True:\n    x.append(bytearray(10 * 2**20))\n    time.sleep(0.02)",
+        60.0, 150.0, 60.0,
+    ),
+    # Árvore de 3 níveis (1 + 3 + 9 processos), cada um queimando 0.1 s de CPU e esperando os filhos
+    "arvore": (
+        BURN + "def tree(depth):\n"
+        "    pids = []\n"
+        "    for _ in range(3 if depth else 0):\n"
+        "        pid = os.fork()\n"
+        "        if pid == 0:\n"
+        "            tree(depth - 1)\n"
+        "            os._exit(0)\n"
+        "        pids.append(pid)\n"
+        "    burn(0.1)\n"
+        "    for pid in pids:\n"
+        "        os.waitpid(pid, 0)\n"
+        "tree(2)",
+        60.0, 1e6, 60.0,
+    ),
+    # Rajada de 300 processos curtos (2 ms de CPU cada), criados e recolhidos entre as amostras
+    "rajada": (
+        BURN + "for _ in range(300):\n"
+        "    pid = os.fork()\n"
+        "    if pid == 0:\n"
+        "        burn(0.002)\n"
+        "        os._exit(0)\n"
+        "    os.waitpid(pid, 0)",
+        60.0, 1e6, 60.0,
+    ),
+    # Processo ocioso que só dorme e sai
+    "ocioso": ("time.sleep(2)", 60.0, 1e6, 60.0),
+}
+
+# Métricas comparadas com --comparar (todas: menor é melhor) e piso absoluto abaixo do qual a variação é ruído
+REGRESSION_FLOORS = {
+    "cpu_motor_por_amostra_us": 50.0,
+    "latencia_saida_max_ms": 5.0,
+    "overshoot_cpu_s": 0.05,
+    "overshoot_mem_mb": 10.0,
+    "erro_amostra_ms": 20.0,
+    "erro_final_ms": 1.0,
+}
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def run_workload(name, repetitions, directory):
+    script, limit_cpu, limit_mem, limit_time = WORKLOADS[name]
+    engine = SamplerEngine()
+    jobs = []
+    self_start = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.monotonic()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for index in range(repetitions):
+            stamp = os.path.join(directory, f"{name}-{index}")
+            os.environ["FMS_BENCH_EXIT"] = stamp
+            fms = FMS(pre_pago=False)
+            fms.limit_cpu, fms.limit_mem, fms.limit_time = limit_cpu, limit_mem, limit_time
+            fms.start_process([PYTHON, "-c", "import os, time\n" + script + EXIT_STAMP], engine=engine)
+            jobs.append((fms, stamp))
+        while engine.active_jobs():
+            time.sleep(0.01)
+    elapsed = time.monotonic() - start
+    self_end = resource.getrusage(resource.RUSAGE_SELF)
+    self_cpu = (self_end.ru_utime + self_end.ru_stime) - (self_start.ru_utime + self_start.ru_stime)
+
+    latencies, cpu_overshoot, mem_overshoot, sample_error, final_error = [], [], [], [], []
+    for fms, stamp in jobs:
+        if os.path.exists(stamp):
+            with open(stamp) as f:
+                latencies.append(fms.end_time - float(f.read()))
+        if fms.reason == "cpu":
+            cpu_overshoot.append(fms.cpu_total - limit_cpu)
+        if fms.reason == "memoria":
+            mem_overshoot.append(fms.mem_peak_mb - limit_mem)
+        # O rusage do wait4 inclui todos os descendentes recolhidos dentro da árvore: é a referência do kernel
+        # O erro da última amostra inclui a CPU gasta depois dela; o final deve ser zero para árvores que recolhem
+        # os próprios filhos
+        if fms.rusage is not None and fms.reason is None:
+            kernel = fms.rusage.ru_utime + fms.rusage.ru_stime
+            sampled = fms.series.values("cpu")
+            if sampled:
+                sample_error.append(1000 * abs(sampled[-1] - kernel))
+                final_error.append(1000 * abs(fms.cpu_total - kernel))
+
+    samples = sum(fms.samples for fms, _ in jobs)
+    result = {
+        "carga": name,
+        "jobs": len(jobs),
+        "motivos": sorted({fms.reason or "saida" for fms, _ in jobs}),
+        "tempo_s": round(elapsed, 3),
+        "amostras": samples,
+        "cpu_motor_ms": round(1000 * engine.cpu_time, 3),
+        "cpu_motor_por_amostra_us": round(1e6 * engine.cpu_time / max(samples, 1), 1),
+        "cpu_fms_pct": round(100 * self_cpu / elapsed, 2),
+        "latencia_saida_p50_ms": round(1000 * percentile(latencies, 0.5), 3) if latencies else None,
+        "latencia_saida_max_ms": round(1000 * max(latencies), 3) if latencies else None,
+        "overshoot_cpu_s": round(max(cpu_overshoot), 4) if cpu_overshoot else None,
+        "overshoot_mem_mb": round(max(mem_overshoot), 2) if mem_overshoot else None,
+        "erro_amostra_ms": round(max(sample_error), 3) if sample_error else None,
+        "erro_final_ms": round(max(final_error), 3) if final_error else None,
+    }
+    return result
+
+
+def regressions(results, baseline_path, tolerance):
+    # Métricas que pioraram mais que a tolerância relativa e que o piso absoluto em relação à base
+    with open(baseline_path) as f:
+        baseline = {record["carga"]: record for record in map(json.loads, f) if "carga" in record}
+    found = []
+    for result in results:
+        base = baseline.get(result["carga"])
+        if base is None:
+            continue
+        for key, floor in REGRESSION_FLOORS.items():
+            new, old = result.get(key), base.get(key)
+            if new is None or old is None:
+                continue
+            if new > old * (1 + tolerance) and new - old > floor:
+                found.append(f"{result['carga']}: {key} {old} -> {new}")
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Suíte de benchmark e precisão do FMS")
+    parser.add_argument("--repeticoes", type=int, default=3, help="jobs simultâneos por carga")
+    parser.add_argument("--cargas", nargs="+", choices=list(WORKLOADS), default=list(WORKLOADS))
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--comparar", metavar="BASE.jsonl", help="saída --json de uma execução anterior")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="piora relativa aceita no --comparar")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.cargas:
+            result = run_workload(name, args.repeticoes, directory)
+            results.append(result)
+            if args.json:
+                print(json.dumps(result), flush=True)
+            else:
+                print(
+                    f"{name:>8} | {result['jobs']} jobs {'/'.join(result['motivos']):>12} | "
+                    f"motor {result['cpu_motor_por_amostra_us']:7.1f} us/amostra, FMS {result['cpu_fms_pct']:5.2f}% CPU | "
+                    f"saída p50 {result['latencia_saida_p50_ms']} ms max {result['latencia_saida_max_ms']} ms | "
+                    f"overshoot cpu {result['overshoot_cpu_s']} s mem {result['overshoot_mem_mb']} MB | "
+                    f"erro amostra {result['erro_amostra_ms']} ms final {result['erro_final_ms']} ms",
+                    flush=True,
+                )
+
+    if args.comparar:
+        found = regressions(results, args.comparar, args.tolerancia)
+        for line in found:
+            print(f"REGRESSÃO {line}", file=sys.stderr)
+        sys.exit(1 if found else 0)
@@ -0,0 +1,155 @@
+# Backend de execução em cgroup v2
+# Cada job recebe o seu próprio cgroup dentro de uma subárvore delegada ao FMS:
+# - o kernel aplica o limite de memória (memory.max) e, opcionalmente, um teto de uso de CPU (cpu.max)
+# - a contabilidade lê cpu.stat (usage_usec) e memory.peak uma vez por job, qualquer que seja o tamanho da árvore
+# A subárvore delegada é indicada por FMS_CGROUP_ROOT (ou passada explicitamente); sem ela o FMS usa o caminho psutil/proc
+
+import itertools
+import os
+import signal
+
+# Período padrão do cpu.max, em microssegundos
+CPU_MAX_PERIOD = 100000
+
+
+def read_keyed(path):
+    # Lê arquivos no formato "chave valor" por linha (cpu.stat, memory.events, cgroup.events)
+    values = {}
+    with open(path) as f:
+        for line in f:
+            key, _, value = line.partition(" ")
+            values[key] = int(value)
+    return values
+
+
+class CgroupV2:
+    # Subárvore cgroup v2 delegada ao FMS, onde os cgroups dos jobs são criados
+    # Pela regra de "sem processos internos" do cgroup v2, a raiz delegada não deve conter processos
+
+    def __init__(self, root):
+        self.root = root
+        self.counter = itertools.count()
+        # Cgroups cujo rmdir falhou porque ainda tinham processos saindo; nova tentativa a cada criação
+        self.stale = []
+
+    @classmethod
+    def detect(cls, root=None):
+        # Retorna a subárvore delegada pronta para uso ou None quando o cgroup v2 não está disponível
+        root = root or os.environ.get("FMS_CGROUP_ROOT")
+        if not root or not os.path.exists(os.path.join(root, "cgroup.controllers")):
+            return None
+        if not os.access(root, os.W_OK) or not os.access(os.path.join(root, "cgroup.subtree_control"), os.W_OK):
+            return None
+        with open(os.path.join(root, "cgroup.controllers")) as f:
+            available = f.read().split()
+        if "memory" not in available or "cpu" not in available:
+            return None
+        try:
+            with open(os.path.join(root, "cgroup.subtree_control")) as f:
+                enabled = f.read().split()
+            if "memory" not in enabled or "cpu" not in enabled:
+                with open(os.path.join(root, "cgroup.subtree_control"), "w") as f:
+                    f.write("+memory +cpu")
+        except OSError:
+            return None
+        return cls(root)
+
+    def create(self, limit_mem_mb=None, cpu_max=None):
+        # Cria o cgroup de um job e grava os limites antes do processo entrar nele
+        self.cleanup()
+        path = os.path.join(self.root, f"fms-{os.getpid()}-{next(self.counter)}")
+        os.mkdir(path)
+        job = CgroupJob(path)
+        try:
+            job.set_limits(limit_mem_mb, cpu_max)
+        except OSError:
+            job.remove()
+            raise
+        return job
+
+    def cleanup(self):
+        self.stale = [job for job in self.stale if not job.remove()]
+
+
+class CgroupJob:
+    # Cgroup de um único job
+
+    def __init__(self, path):
+        self.path = path
+        self.oom_kills = 0
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def set_limits(self, limit_mem_mb=None, cpu_max=None):
+        # memory.max em bytes; cpu.max como fração de CPUs (por exemplo 0.5 = meio núcleo)
+        if limit_mem_mb:
+            with open(self.file("memory.max"), "w") as f:
+                f.write(str(int(limit_mem_mb * 1024 * 1024)))
+            # Sem swap o limite vale para a memória realmente usada pelo job
+            if os.path.exists(self.file("memory.swap.max")):
+                with open(self.file("memory.swap.max"), "w") as f:
+                    f.write("0")
+        if cpu_max:
+            with open(self.file("cpu.max"), "w") as f:
+                f.write(f"{int(cpu_max * CPU_MAX_PERIOD)} {CPU_MAX_PERIOD}")
+
+    def attach_self(self):
+        # Executado no processo filho antes do exec (preexec_fn): "0" move o próprio processo para o cgroup,
+        # então nenhum descendente nasce fora dele
+        with open(self.file("cgroup.procs"), "w") as f:
+            f.write("0")
+
+    def cpu_time(self):
+        # Tempo de CPU (usuário + sistema) de todos os processos que já passaram pelo cgroup, em segundos
+        return read_keyed(self.file("cpu.stat"))["usage_usec"] / 1e6
+
+    def memory(self):
+        # Memória atual do cgroup em bytes
+        with open(self.file("memory.current")) as f:
+            return int(f.read())
+
+    def memory_peak(self):
+        # Pico de memória do cgroup (memory.peak, kernel 5.19+); sem ele, o valor atual
+        try:
+            with open(self.file("memory.peak")) as f:
+                return int(f.read())
+        except FileNotFoundError:
+            return self.memory()
+
+    def oom_killed(self):
+        # Indica se o kernel matou algum processo do job por estourar memory.max
+        try:
+            self.oom_kills = read_keyed(self.file("memory.events")).get("oom_kill", 0)
+        except (FileNotFoundError, ValueError):
+            pass
+        return self.oom_kills > 0
+
+    def pids(self):
+        with open(self.file("cgroup.procs")) as f:
+            return [int(pid) for pid in f.read().split() if int(pid) > 0]
+
+    def kill(self):
+        # Mata todos os processos do cgroup de uma vez (cgroup.kill, kernel 5.14+); sem ele, SIGKILL pid a pid
+        if os.path.exists(self.file("cgroup.kill")):
+            try:
+                with open(self.file("cgroup.kill"), "w") as f:
+                    f.write("1")
+                return
+            except OSError:
+                pass
+        for pid in self.pids():
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def remove(self):
+        # Remove o cgroup; retorna False se ainda houver processos nele
+        try:
+            os.rmdir(self.path)
+        except FileNotFoundError:
+            return True
+        except OSError:
+            return False
+        return True
@@ -0,0 +1,565 @@
+# Execução em vários nós: um coordenador central e agentes locais ligados por TCP
+# - Agente (python main.py --agente HOST:PORTA): lança e monitora os jobs recebidos com o FMS e o SamplerEngine de
+#   sempre. No agente, FMS.ledger é um UsageStream: cada débito pré-pago e acúmulo pós-pago que o FMS registraria
+#   no ledger é somado localmente e enviado ao coordenador em lotes (a cada flush_interval)
+# - Coordenador (python main.py --coordenador PORTA --batch JOBS.jsonl): dono do saldo pré-pago, da CPU pós-paga e
+#   do ledger em disco. Cada job vai para o agente menos carregado (jobs em execução por vaga) que tenha memória
+#   livre para o limite do job; sem vaga em nenhum agente, o job espera
+# Créditos: ao despachar um job pré-pago o coordenador reserva até limit_cpu do saldo numa lease do agente
+# (CreditManagerPrePago.reserve) e os envia junto com o job; o agente os deposita no saldo local, de onde os jobs
+# debitam como num FMS sozinho, e devolve a sobra quando não tem mais jobs pré-pagos. O saldo do coordenador (com
+# o que está nas leases dos agentes) só baixa quando os débitos chegam, com atraso de até flush_interval mais a rede
+# Se a conexão cai, o agente mata os próprios jobs (o uso deles não poderia mais ser cobrado) e o coordenador
+# devolve ao saldo o que ainda estava na lease do agente e marca os jobs dele como "perdido"
+#
+# Protocolo: uma mensagem JSON por linha, nos dois sentidos
+#     agente -> coordenador: hello (name, slots, mem_total_mb, mem_available_mb), started (job, pid),
+#         failed (job, error), usage (debit, accrual, first, mem_available_mb), finished (job, result),
+#         return (amount)
+#     coordenador -> agente: run (job, command, limit_cpu, limit_mem, limit_time, mode, cores, credits),
+#         cancel (job)
+
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from collections import deque
+
+import psutil
+
+from main import FMS, CreditManagerPrePago, PostpaidAccrual, SamplerEngine
+from metrics import Histogram
+
+# Buckets do atraso do ledger central em relação ao uso registrado nos agentes, em segundos
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def parse_address(text, default_host="127.0.0.1"):
+    # "host:porta" ou só "porta"
+    host, _, port = text.rpartition(":")
+    return host or default_host, int(port)
+
+
+class LineChannel:
+    # Mensagens JSON por linha sobre um socket TCP; send() pode ser chamado por várias threads
+    def __init__(self, sock):
+        self.sock = sock
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = sock.makefile("rb")
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        data = json.dumps(message, ensure_ascii=False).encode() + b"\n"
+        with self.lock:
+            self.sock.sendall(data)
+
+    def receive(self):
+        # Próxima mensagem ou None quando a conexão fechou
+        line = self.file.readline()
+        if not line:
+            return None
+        return json.loads(line)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.file.close()
+        self.sock.close()
+
+
+class UsageStream:
+    # Substitui o ledger no agente: append() só soma (é chamado no tick dos jobs) e flush() envia o lote
+    flush_interval = 0.1
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.lock = threading.Lock()
+        self.debit = 0.0
+        self.accrual = 0.0
+        # Instante (relógio de parede) do registro mais antigo ainda não enviado, para medir o atraso do ledger
+        self.first = None
+        self.closing = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="FMS-UsageStream", daemon=True)
+        self.thread.start()
+
+    def append(self, op, amount):
+        # Só o consumo interessa ao coordenador; "set" e "deposit" locais são os créditos que ele mesmo enviou
+        with self.lock:
+            if op == "debit":
+                self.debit += amount
+            elif op == "accrual":
+                self.accrual += amount
+            else:
+                return
+            if self.first is None:
+                self.first = time.time()
+
+    def flush(self):
+        # O lote sai sob o lock, então nenhuma mensagem enviada depois (finished, return) chega antes dele
+        with self.lock:
+            if self.first is None:
+                return
+            message = {
+                "op": "usage",
+                "debit": self.debit,
+                "accrual": self.accrual,
+                "first": self.first,
+                "mem_available_mb": psutil.virtual_memory().available / (1024 * 1024),
+            }
+            self.debit = self.accrual = 0.0
+            self.first = None
+            self.channel.send(message)
+
+    def run(self):
+        while not self.closing.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError:
+                return
+
+    def close(self):
+        self.closing.set()
+
+
+class Agent:
+    def __init__(self, address, slots=None, name=None, engine=None):
+        self.address = address
+        self.slots = slots or os.cpu_count() or 1
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.engine = engine or SamplerEngine.default()
+        self.channel = None
+        self.usage = None
+        # job -> FMS dos jobs recebidos e ainda não terminados
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def connect(self):
+        self.channel = LineChannel(socket.create_connection(self.address))
+        self.usage = UsageStream(self.channel)
+        FMS.ledger = self.usage
+        memory = psutil.virtual_memory()
+        self.channel.send({
+            "op": "hello",
+            "name": self.name,
+            "slots": self.slots,
+            "mem_total_mb": memory.total / (1024 * 1024),
+            "mem_available_mb": memory.available / (1024 * 1024),
+        })
+        return self
+
+    def serve(self):
+        # Atende o coordenador até a conexão cair; então mata os jobs que restaram
+        try:
+            while True:
+                message = self.channel.receive()
+                if message is None:
+                    break
+                if message["op"] == "run":
+                    self.launch(message)
+                elif message["op"] == "cancel":
+                    with self.lock:
+                        fms = self.jobs.get(message["job"])
+                    if fms is not None:
+                        self.engine.cancel(fms)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.usage.close()
+            with self.lock:
+                jobs = list(self.jobs.values())
+            for fms in jobs:
+                if fms.process is not None:
+                    fms.signal_tree(signal.SIGKILL)
+
+    def launch(self, message):
+        job_id = message["job"]
+        fms = FMS(pre_pago=message["mode"] == "pre-pago")
+        fms.verbose = False
+        fms.limit_cpu = message["limit_cpu"]
+        fms.limit_mem = message["limit_mem"]
+        fms.limit_time = message["limit_time"]
+        fms.cores = message.get("cores")
+        fms.on_finish.append(lambda fms: self.finished(job_id, fms))
+        # Os créditos entram no saldo local junto com o registro do job, sob o mesmo lock da devolução
+        with self.lock:
+            if message.get("credits"):
+                CreditManagerPrePago.deposit(message["credits"])
+            self.jobs[job_id] = fms
+        try:
+            fms.start_process(message["command"], engine=self.engine)
+        except OSError as e:
+            with self.lock:
+                del self.jobs[job_id]
+                amount = self.spare_credits()
+            self.channel.send({"op": "failed", "job": job_id, "error": f"falha ao lançar: {e}"})
+            self.give_back(amount)
+            return
+        self.channel.send({"op": "started", "job": job_id, "pid": fms.process.pid})
+
+    def spare_credits(self):
+        # Chamado com o lock: sem jobs pré-pagos no agente, todo o saldo local volta ao coordenador
+        if any(fms.pre_pago for fms in self.jobs.values()):
+            return 0.0
+        with CreditManagerPrePago.lock:
+            amount = CreditManagerPrePago.total_credits
+            CreditManagerPrePago.total_credits = 0.0
+        return amount
+
+    def give_back(self, amount):
+        if amount > 0:
+            self.channel.send({"op": "return", "amount": amount})
+
+    def finished(self, job_id, fms):
+        # Chamado na thread do motor, depois do acerto final: o uso do job sai antes do aviso de término
+        with self.lock:
+            self.jobs.pop(job_id, None)
+            amount = self.spare_credits()
+        try:
+            self.usage.flush()
+            self.channel.send({"op": "finished", "job": job_id, "result": fms.result()})
+            self.give_back(amount)
+        except OSError:
+            pass
+
+
+class AgentLease:
+    # Créditos reservados no coordenador para os jobs pré-pagos de um agente (ver CreditManagerPrePago.reserve)
+    def __init__(self):
+        self.available = 0.0
+
+
+class AgentLink:
+    # Estado de um agente no coordenador
+    def __init__(self, channel, hello):
+        self.channel = channel
+        self.name = hello["name"]
+        self.slots = int(hello["slots"])
+        self.mem_total_mb = float(hello["mem_total_mb"])
+        self.mem_available_mb = float(hello["mem_available_mb"])
+        self.running = {}
+        self.lease = AgentLease()
+        self.connected = True
+
+    def load(self):
+        return len(self.running) / self.slots
+
+
+class ClusterJob:
+    def __init__(self, job_id, spec):
+        self.id = job_id
+        self.spec = spec
+        self.agent = None
+        self.state = "fila"
+        self.pid = None
+        self.result = None
+        self.error = None
+        self.submitted_at = time.monotonic()
+        self.dispatched_at = None
+        self.on_finish = []
+
+
+class Coordinator:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.listener = socket.create_server((host, port))
+        self.address = self.listener.getsockname()[:2]
+        self.agents = []
+        self.jobs = {}
+        self.pending = deque()
+        self.next_id = 1
+        self.condition = threading.Condition()
+        # Estatísticas: despachos, terminados, atraso do ledger e espera até o despacho
+        self.dispatched = 0
+        self.completed = 0
+        self.started_at = time.monotonic()
+        self.ledger_lag = Histogram(LAG_BUCKETS)
+        self.dispatch_wait = Histogram(LAG_BUCKETS)
+
+    def start(self):
+        threading.Thread(target=self.accept_loop, name="FMS-Coordinator-accept", daemon=True).start()
+        threading.Thread(target=self.dispatch_loop, name="FMS-Coordinator-dispatch", daemon=True).start()
+        return self
+
+    def accept_loop(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.agent_loop, args=(sock,), name="FMS-Coordinator-agent", daemon=True).start()
+
+    def agent_loop(self, sock):
+        channel = LineChannel(sock)
+        link = None
+        try:
+            hello = channel.receive()
+            if hello is None or hello.get("op") != "hello":
+                return
+            link = AgentLink(channel, hello)
+            with self.condition:
+                self.agents.append(link)
+                self.condition.notify_all()
+            print(f"Agente {link.name} conectado ({link.slots} vagas)", file=sys.stderr)
+            while True:
+                message = channel.receive()
+                if message is None:
+                    break
+                self.handle(link, message)
+        except (OSError, ValueError, KeyError):
+            pass
+        finally:
+            channel.close()
+            if link is not None:
+                self.agent_lost(link)
+
+    def handle(self, link, message):
+        op = message["op"]
+        if op == "usage":
+            self.usage(link, message)
+            return
+        if op == "return":
+            CreditManagerPrePago.release(link.lease, float(message["amount"]))
+            return
+        with self.condition:
+            job = link.running.get(message["job"])
+            if job is None:
+                return
+            if op == "started":
+                job.state = "executando"
+                job.pid = message["pid"]
+                return
+            del link.running[job.id]
+            if op == "finished":
+                job.state = "encerrado"
+                job.result = {**message["result"], "agent": link.name}
+            else:
+                job.state = "recusado"
+                job.error = message["error"]
+            self.completed += 1
+            self.condition.notify_all()
+        for callback in job.on_finish:
+            callback(job)
+
+    def usage(self, link, message):
+        # Aplica o lote do agente: débitos saem da lease dele, acúmulos entram na CPU pós-paga
+        debit = float(message["debit"])
+        accrual = float(message["accrual"])
+        if debit:
+            with CreditManagerPrePago.lock:
+                link.lease.available -= debit
+            if FMS.ledger is not None:
+                FMS.ledger.append("debit", debit)
+        if accrual:
+            with FMS.total_cpu_lock:
+                FMS.total_cpu_used += accrual
+            if FMS.ledger is not None:
+                FMS.ledger.append("accrual", accrual)
+        with self.condition:
+            link.mem_available_mb = float(message["mem_available_mb"])
+            self.ledger_lag.observe(max(0.0, time.time() - float(message["first"])))
+            self.condition.notify_all()
+
+    def agent_lost(self, link):
+        # Os jobs do agente morreram com a conexão; o que não foi cobrado volta ao saldo
+        CreditManagerPrePago.release(link.lease)
+        with self.condition:
+            link.connected = False
+            self.agents.remove(link)
+            lost = list(link.running.values())
+            link.running.clear()
+            for job in lost:
+                job.state = "perdido"
+                job.error = f"conexão com o agente {link.name} perdida"
+                self.completed += 1
+            self.condition.notify_all()
+        print(f"Agente {link.name} desconectado; {len(lost)} job(s) perdido(s)", file=sys.stderr)
+        for job in lost:
+            for callback in job.on_finish:
+                callback(job)
+
+    def submit(self, spec, on_finish=None):
+        # spec no formato de batch.parse_job; on_finish(job) é chamado quando o job termina, falha ou se perde
+        with self.condition:
+            job = ClusterJob(self.next_id, spec)
+            self.next_id += 1
+            if on_finish is not None:
+                job.on_finish.append(on_finish)
+            self.jobs[job.id] = job
+            self.pending.append(job)
+            self.condition.notify_all()
+        return job
+
+    def choose(self, job):
+        # Chamado com o condition: agente menos carregado com vaga e memória livre para o job, ou None
+        best = None
+        for link in self.agents:
+            if len(link.running) >= link.slots or link.mem_available_mb < job.spec["limit_mem"]:
+                continue
+            if best is None or (link.load(), -link.mem_available_mb) < (best.load(), -best.mem_available_mb):
+                best = link
+        return best
+
+    def dispatch_loop(self):
+        while True:
+            with self.condition:
+                while True:
+                    job = self.pending[0] if self.pending else None
+                    if job is not None and self.agents and not any(
+                        job.spec["limit_mem"] <= link.mem_total_mb for link in self.agents
+                    ):
+                        # Maior que a memória de qualquer agente conectado: não adianta esperar
+                        self.pending.popleft()
+                        link = None
+                        break
+                    link = self.choose(job) if job is not None else None
+                    if link is not None:
+                        self.pending.popleft()
+                        break
+                    self.condition.wait()
+                if link is None:
+                    job.state = "recusado"
+                    job.error = "não cabe em nenhum agente (memoria_total)"
+                    self.completed += 1
+                    callbacks = job.on_finish
+                else:
+                    job.agent = link
+                    job.state = "despachado"
+                    job.dispatched_at = time.monotonic()
+                    link.running[job.id] = job
+                    # Vaga ocupada até a próxima amostra de memória do agente
+                    link.mem_available_mb -= job.spec["limit_mem"]
+                    callbacks = None
+            if callbacks is not None:
+                for callback in callbacks:
+                    callback(job)
+                continue
+            self.send_job(link, job)
+
+    def send_job(self, link, job):
+        spec = job.spec
+        credits = 0.0
+        if spec["pre_pago"]:
+            credits = CreditManagerPrePago.reserve(link.lease, spec["limit_cpu"])
+            if credits <= 0:
+                self.handle(link, {"op": "failed", "job": job.id, "error": "créditos insuficientes"})
+                return
+        self.dispatch_wait.observe(job.dispatched_at - job.submitted_at)
+        self.dispatched += 1
+        try:
+            link.channel.send({
+                "op": "run",
+                "job": job.id,
+                "command": spec["command"],
+                "limit_cpu": spec["limit_cpu"],
+                "limit_mem": spec["limit_mem"],
+                "limit_time": spec["limit_time"],
+                "mode": "pre-pago" if spec["pre_pago"] else "pos-pago",
+                "cores": spec["cores"],
+                "credits": credits,
+            })
+        except OSError:
+            # A conexão caiu: agent_lost devolve a lease e marca o job como perdido
+            pass
+
+    def cancel(self, job):
+        with self.condition:
+            if job.state == "fila" and job in self.pending:
+                self.pending.remove(job)
+                job.state = "cancelado"
+                self.completed += 1
+                callbacks = job.on_finish
+            elif job.agent is not None and job.id in job.agent.running:
+                job.agent.channel.send({"op": "cancel", "job": job.id})
+                return True
+            else:
+                return False
+        for callback in callbacks:
+            callback(job)
+        return True
+
+    def wait_agents(self, count, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: len(self.agents) >= count, timeout)
+
+    def wait(self, timeout=None):
+        # Espera todos os jobs submetidos terminarem
+        with self.condition:
+            return self.condition.wait_for(lambda: self.completed >= len(self.jobs), timeout)
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started_at
+        with self.condition:
+            return {
+                "agents": len(self.agents),
+                "queued": len(self.pending),
+                "running": sum(len(link.running) for link in self.agents),
+                "dispatched": self.dispatched,
+                "completed": self.completed,
+                "throughput": self.completed / elapsed if elapsed > 0 else 0.0,
+            }
+
+    def close(self):
+        self.listener.close()
+        with self.condition:
+            links = list(self.agents)
+        for link in links:
+            link.channel.close()
+
+
+def run_agent(address, slots=None):
+    # Modo agente do main.py: conecta ao coordenador e atende até a conexão cair
+    agent = Agent(address, slots).connect()
+    print(f"Agente {agent.name} conectado a {address[0]}:{address[1]} ({agent.slots} vagas)", file=sys.stderr)
+    agent.serve()
+    print("Conexão com o coordenador encerrada", file=sys.stderr)
+
+
+def run_cluster_batch(path, coordinator, output_path=None, credits=None, agents=1):
+    # Executa o manifesto (ver batch.py) nos agentes; resultados vão para output_path ou para a saída padrão
+    from batch import read_manifest
+    if credits is not None:
+        CreditManagerPrePago.set_total(credits)
+    output = open(output_path, "w", buffering=1) if output_path else sys.stdout
+    lock = threading.Lock()
+
+    def write(record):
+        with lock:
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def job_finished(job, number):
+        record = job.result or {"command": job.spec["command"], "error": job.error, "state": job.state}
+        record["line"] = number
+        write(record)
+
+    print(f"Coordenador em {coordinator.address[0]}:{coordinator.address[1]}; esperando {agents} agente(s)",
+          file=sys.stderr)
+    coordinator.wait_agents(agents)
+    start = time.monotonic()
+    failed = 0
+    for number, spec in read_manifest(path):
+        if "error" in spec:
+            write({"line": number, "error": spec["error"]})
+            failed += 1
+            continue
+        coordinator.submit(spec, lambda job, number=number: job_finished(job, number))
+    coordinator.wait()
+    elapsed = time.monotonic() - start
+    if output_path:
+        output.close()
+    jobs = list(coordinator.jobs.values())
+    completed = sum(1 for job in jobs if job.state == "encerrado")
+    failed += len(jobs) - completed
+    lag = coordinator.ledger_lag
+    print(
+        f"{completed} job(s) em {elapsed:.2f}s ({completed / elapsed if elapsed > 0 else 0.0:.1f} jobs/s) em "
+        f"{len(coordinator.agents)} agente(s), {failed} falha(s); atraso médio do ledger "
+        f"{1000 * lag.sum / lag.count if lag.count else 0.0:.1f} ms",
+        file=sys.stderr,
+    )
+    print(f"CPU pós-paga acumulada: {PostpaidAccrual.total():.2f}s", file=sys.stderr)
+    if credits is not None or FMS.ledger is not None:
+        print(f"Créditos restantes: R${CreditManagerPrePago.get_balance():.2f}", file=sys.stderr)
@@ -0,0 +1,357 @@
+# Modo daemon: FMS residente com uma API local por socket Unix (python main.py --daemon)
+# O motor de amostragem, os créditos, o ledger e a fila (--fila) ficam carregados num processo longo; clientes leves
+# (fmsctl.py, ou qualquer programa que fale o protocolo) enviam jobs e consultam o estado sem pagar o início do FMS
+# O socket é criado com permissão 0600: só o dono do daemon pode usá-lo
+#
+# Protocolo: uma requisição JSON por linha e uma resposta JSON por linha, várias requisições por conexão
+#     {"op": "submit", "command": [...], "limit_cpu": s, "limit_mem": mb, "limit_time": s, "mode": "pre-pago",
+#      "priority": 0, "submitter": "ana", "cores": 1}       -> {"ok": true, "job": {...}}
+#     {"op": "status", "job": 3}                           -> {"ok": true, "job": {...}}
+#     {"op": "jobs"}                                       -> {"ok": true, "jobs": [{...}, ...]}
+#     {"op": "watch", "job": 3, "interval": 1.0}           -> {"ok": true, "job": {...}} a cada intervalo, até a
+#                                                             resposta com "final": true quando o job termina
+#     {"op": "cancel", "job": 3}                           -> {"ok": true, "job": {...}}
+#     {"op": "tail", "job": 3, "bytes": 4096}              -> {"ok": true, "output": "..."}
+#     {"op": "balance"}                                    -> {"ok": true, "credits": R$, "postpaid_cpu": s}
+#     {"op": "deposit", "amount": 10}                      -> créditos pré-pagos acrescentados; responde o saldo
+#     {"op": "pay", "amount": 3.5}                         -> CPU pós-paga quitada; responde o saldo
+#     {"op": "stats"}                                      -> {"ok": true, "engine": {...}, "queue": {...}}
+# Erros: {"ok": false, "error": "..."}
+# Estados de um job: "fila", "executando", "encerrado", "cancelado" (antes de ser lançado) e "recusado"
+
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from batch import parse_job
+from fmsctl import socket_path
+from main import FMS, CreditManagerPrePago, PostpaidAccrual, SamplerEngine
+
+# Maior linha de requisição aceita
+MAX_REQUEST = 1024 * 1024
+
+
+class DaemonJob:
+    def __init__(self, job_id, fms, command):
+        self.id = job_id
+        self.fms = fms
+        self.command = command
+        self.queued = None
+        self.state = "executando"
+        self.error = None
+        self.result = None
+
+
+class Daemon:
+    # Guarda os jobs enviados pelos clientes; os terminados ficam disponíveis para consulta até serem os mais
+    # antigos além de history
+    history = 1000
+
+    def __init__(self, engine=None, queue=None):
+        self.engine = engine or SamplerEngine.default()
+        self.queue = queue
+        self.jobs = OrderedDict()
+        self.finished = 0
+        self.next_id = 1
+        # Acordado a cada término, para as conexões que acompanham um job
+        self.condition = threading.Condition()
+
+    def submit(self, request):
+        job = parse_job(request)
+        fms = FMS(pre_pago=job["pre_pago"])
+        fms.verbose = False
+        fms.limit_cpu = job["limit_cpu"]
+        fms.limit_mem = job["limit_mem"]
+        fms.limit_time = job["limit_time"]
+        fms.cores = job["cores"]
+        fms.command = job["command"]
+        with self.condition:
+            entry = DaemonJob(self.next_id, fms, job["command"])
+            self.next_id += 1
+            self.jobs[entry.id] = entry
+        fms.on_finish.append(lambda fms: self.job_finished(entry))
+        if self.queue is not None:
+            entry.state = "fila"
+            entry.queued = self.queue.submit(
+                fms, job["command"], job["priority"], job["submitter"],
+                on_reject=lambda fms, reason: self.job_rejected(entry, reason),
+            )
+            return entry
+        try:
+            fms.start_process(job["command"], engine=self.engine)
+        except OSError as e:
+            self.job_rejected(entry, f"falha ao lançar: {e}")
+        return entry
+
+    def job_finished(self, entry):
+        # Chamado na thread do motor
+        result = entry.fms.result()
+        with self.condition:
+            entry.result = result
+            entry.state = "encerrado"
+            self.retire(entry)
+        print(
+            f"[job {entry.id}] pid {result['pid']} encerrado: CPU {result['cpu_time']:.2f}s"
+            + (f", {result['kill_reason']}" if result["kill_reason"] else ""),
+            file=sys.stderr,
+        )
+
+    def job_rejected(self, entry, reason):
+        with self.condition:
+            entry.state = "recusado"
+            entry.error = reason
+            self.retire(entry)
+
+    def retire(self, entry):
+        # Chamado com o condition: acorda quem acompanha e descarta os terminados mais antigos além de history
+        self.finished += 1
+        self.condition.notify_all()
+        if self.finished > self.history:
+            for job_id, other in list(self.jobs.items()):
+                if self.finished <= self.history:
+                    break
+                if other.state in ("encerrado", "cancelado", "recusado"):
+                    del self.jobs[job_id]
+                    self.finished -= 1
+
+    def state(self, entry):
+        # Chamado com o condition: um job da fila passa a "executando" quando a fila o lança
+        if entry.state == "fila" and entry.fms.process is not None:
+            entry.state = "executando"
+        return entry.state
+
+    def cancel(self, entry):
+        with self.condition:
+            state = self.state(entry)
+        if state == "fila" and self.queue.cancel(entry.queued):
+            with self.condition:
+                entry.state = "cancelado"
+                self.retire(entry)
+            return None
+        if state in ("fila", "executando"):
+            if self.engine.cancel(entry.fms):
+                return None
+            if entry.fms.process is None:
+                return "o job está sendo lançado; tente de novo"
+        return f"o job já está {entry.state}"
+
+    def describe(self, entry):
+        fms = entry.fms
+        with self.condition:
+            state, error, result = self.state(entry), entry.error, entry.result
+        record = {
+            "job": entry.id,
+            "state": state,
+            "command": entry.command,
+            "pid": fms.process.pid if fms.process is not None else None,
+            "limit_cpu": fms.limit_cpu,
+            "limit_mem": fms.limit_mem,
+            "limit_time": fms.limit_time,
+            "mode": "pre-pago" if fms.pre_pago else "pos-pago",
+            "wall_time": round(getattr(fms, "wall_clock", 0.0), 4),
+            "cpu_time": round(getattr(fms, "cpu_total", 0.0), 4),
+            "rss_mb": round(getattr(fms, "mem_rss_mb", 0.0), 2),
+            "peak_rss_mb": round(fms.mem_peak_mb, 2),
+        }
+        if state == "fila" and self.queue is not None:
+            record["position"] = self.queue.position(entry.queued)
+        if state == "executando" and getattr(fms, "start_time", None) is not None:
+            # Entre duas amostras o tempo de relógio avança sem esperar o motor
+            record["wall_time"] = round(time.monotonic() - fms.start_time, 4)
+        if result is not None:
+            record.update(result)
+        if error is not None:
+            record["error"] = error
+        return record
+
+    def watch(self, entry, interval):
+        # Gera o estado do job já e depois a cada intervalo; o último é o estado final, logo após o término
+        while True:
+            record = self.describe(entry)
+            done = record["state"] not in ("fila", "executando")
+            yield record, done
+            if done:
+                return
+            with self.condition:
+                self.condition.wait_for(lambda: entry.state not in ("fila", "executando"), timeout=interval)
+
+    def balance(self):
+        return {
+            "ok": True,
+            "credits": CreditManagerPrePago.get_balance(),
+            "postpaid_cpu": PostpaidAccrual.total(),
+        }
+
+    def pay(self, amount):
+        # Quita CPU pós-paga até o total devido; o excedente não vira crédito
+        paid = PostpaidAccrual.pay(amount)
+        if FMS.ledger is not None and paid:
+            FMS.ledger.append("payment", paid)
+        return {**self.balance(), "paid": paid}
+
+    def job(self, request):
+        try:
+            return self.jobs[int(request["job"])]
+        except (KeyError, ValueError, TypeError):
+            raise LookupError(f"job desconhecido: {request.get('job')}") from None
+
+    def handle(self, request):
+        # Atende uma requisição e devolve a resposta; watch é tratado pela conexão
+        op = request.get("op")
+        if op == "submit":
+            entry = self.submit(request)
+            if entry.error is not None:
+                return {"ok": False, "job": self.describe(entry), "error": entry.error}
+            return {"ok": True, "job": self.describe(entry)}
+        if op == "status":
+            return {"ok": True, "job": self.describe(self.job(request))}
+        if op == "jobs":
+            with self.condition:
+                entries = list(self.jobs.values())
+            return {"ok": True, "jobs": [self.describe(entry) for entry in entries]}
+        if op == "cancel":
+            entry = self.job(request)
+            error = self.cancel(entry)
+            if error is not None:
+                return {"ok": False, "error": error}
+            return {"ok": True, "job": self.describe(entry)}
+        if op == "tail":
+            entry = self.job(request)
+            if entry.fms.output is None:
+                return {"ok": False, "error": "saída do job não está sendo capturada (use --logs)"}
+            data = entry.fms.output.tail(int(request.get("bytes", 4096)))
+            return {"ok": True, "output": data.decode(errors="replace")}
+        if op == "balance":
+            return self.balance()
+        if op == "deposit":
+            amount = float(request["amount"])
+            if amount <= 0:
+                raise ValueError("o valor deve ser positivo")
+            CreditManagerPrePago.deposit(amount)
+            return self.balance()
+        if op == "pay":
+            amount = float(request["amount"])
+            if amount <= 0:
+                raise ValueError("o valor deve ser positivo")
+            return self.pay(amount)
+        if op == "stats":
+            return {
+                "ok": True,
+                "engine": self.engine.stats(),
+                "queue": self.queue.stats() if self.queue is not None else None,
+            }
+        return {"ok": False, "error": f"operação desconhecida: {op}"}
+
+    def shutdown(self, timeout=None):
+        # Encerra os jobs em execução como nos limites e espera o acerto final de cada um
+        with self.condition:
+            entries = [entry for entry in self.jobs.values() if entry.state in ("fila", "executando")]
+        for entry in entries:
+            self.cancel(entry)
+        deadline = time.monotonic() + (FMS.kill_grace + 5.0 if timeout is None else timeout)
+        while self.engine.active_jobs() and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+
+class Connection(socketserver.StreamRequestHandler):
+    def write(self, response):
+        self.wfile.write(json.dumps(response, ensure_ascii=False).encode() + b"\n")
+        self.wfile.flush()
+
+    def handle(self):
+        try:
+            while self.serve_one():
+                pass
+        except OSError:
+            # Cliente desconectado (inclusive no meio de um watch)
+            pass
+
+    def serve_one(self):
+        # Atende uma requisição da conexão; False quando ela terminou
+        daemon = self.server.daemon
+        line = self.rfile.readline(MAX_REQUEST + 1)
+        if not line:
+            return False
+        if len(line) > MAX_REQUEST:
+            self.write({"ok": False, "error": "requisição grande demais"})
+            return False
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("a requisição deve ser um objeto JSON")
+            if request.get("op") == "watch":
+                entry = daemon.job(request)
+                interval = max(0.05, float(request.get("interval", 1.0)))
+                for record, done in daemon.watch(entry, interval):
+                    self.write({"ok": True, "job": record, "final": done})
+                return True
+            response = daemon.handle(request)
+        except (ValueError, KeyError, TypeError, LookupError) as e:
+            response = {"ok": False, "error": str(e)}
+        self.write(response)
+        return True
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, daemon):
+        self.daemon = daemon
+        self.path = path
+        self.claim(path)
+        # O socket nasce com 0600: o umask vale para o bind
+        umask = os.umask(0o177)
+        try:
+            super().__init__(path, Connection)
+        finally:
+            os.umask(umask)
+
+    @staticmethod
+    def claim(path):
+        # Remove um socket abandonado por um daemon que morreu; recusa se outro daemon ainda atende nele
+        if not os.path.exists(path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(path)
+        else:
+            raise OSError(f"já existe um daemon do FMS em {path}")
+        finally:
+            probe.close()
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def serve(path=None, queue=None, engine=None):
+    # Atende até SIGTERM ou SIGINT; então encerra os jobs em execução e fecha o socket
+    path = path or socket_path()
+    daemon = Daemon(engine, queue)
+    server = DaemonServer(path, daemon)
+
+    def stop(signum, frame):
+        # shutdown() espera o serve_forever sair, por isso roda fora da thread que o executa
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"FMS em modo daemon em {path} (pid {os.getpid()})", file=sys.stderr)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        print("Encerrando os jobs em execução...", file=sys.stderr)
+        daemon.shutdown()
+    return daemon
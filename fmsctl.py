@@ -0,0 +1,168 @@
+# Cliente do FMS em modo daemon (python main.py --daemon): envia jobs e consulta o daemon pelo socket Unix
+# Só usa a biblioteca padrão e não importa o FMS, então cada chamada custa o início do interpretador e um ida e volta
+# no socket; o protocolo (uma requisição JSON por linha, ver daemon.py) também pode ser usado direto por scripts
+#
+# Exemplos:
+#     python fmsctl.py enviar --cpu 10 --mem 256 --tempo 60 -- ./prog arg
+#     python fmsctl.py acompanhar 3
+#     python fmsctl.py cancelar 3
+#     python fmsctl.py saldo
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+
+def socket_path():
+    # FMS_SOCKET, senão o diretório de runtime do usuário, senão /tmp com o uid no nome
+    if os.environ.get("FMS_SOCKET"):
+        return os.environ["FMS_SOCKET"]
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return os.path.join(runtime, "fms.sock")
+    return f"/tmp/fms-{os.getuid()}.sock"
+
+
+class Client:
+    def __init__(self, path=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path or socket_path())
+        self.file = self.sock.makefile("rb")
+
+    def send(self, request):
+        self.sock.sendall(json.dumps(request).encode() + b"\n")
+
+    def receive(self):
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("o daemon fechou a conexão")
+        return json.loads(line)
+
+    def request(self, op, **fields):
+        self.send({"op": op, **fields})
+        return self.receive()
+
+    def stream(self, op, **fields):
+        # Respostas até a marcada com "final"
+        self.send({"op": op, **fields})
+        while True:
+            response = self.receive()
+            yield response
+            if response.get("final") or not response.get("ok"):
+                return
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+def show_job(job):
+    line = f"job {job['job']} [{job['state']}]"
+    if job.get("pid"):
+        line += f" pid {job['pid']}"
+    if job.get("position"):
+        line += f" posição {job['position']}"
+    line += f" | T: {job['wall_time']:.1f}s | CPU: {job['cpu_time']:.2f}s | RAM: {job['rss_mb']:.2f} MB"
+    if job.get("peak_rss_mb") is not None:
+        line += f" (pico {job['peak_rss_mb']:.2f} MB)"
+    elif job.get("peak_rss_bound_mb") is not None:
+        line += f" (pico <= {job['peak_rss_bound_mb']:.2f} MB, não medido)"
+    if job.get("exit_status") is not None:
+        line += f" | saída {job['exit_status']}"
+    if job.get("kill_reason"):
+        line += f" | encerrado por {job['kill_reason']}"
+    if job.get("error"):
+        line += f" | {job['error']}"
+    print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cliente do FMS em modo daemon")
+    parser.add_argument("--socket", help=f"socket do daemon (padrão {socket_path()})")
+    parser.add_argument("--json", action="store_true", help="imprime as respostas do daemon sem formatação")
+    commands = parser.add_subparsers(dest="cmd", required=True)
+    submit = commands.add_parser("enviar", help="envia um job")
+    submit.add_argument("--cpu", type=float, required=True, help="limite de CPU (s)")
+    submit.add_argument("--mem", type=float, required=True, help="limite de memória (MB)")
+    submit.add_argument("--tempo", type=float, required=True, help="limite de tempo (s)")
+    submit.add_argument("--pre-pago", action="store_true", help="cobra dos créditos pré-pagos (padrão: pós-pago)")
+    submit.add_argument("--prioridade", type=int, default=0)
+    submit.add_argument("--submissor", default=os.environ.get("USER", "padrao"))
+    submit.add_argument("--nucleos", type=int, help="núcleos do job (com --afinidade no daemon)")
+    submit.add_argument("--acompanhar", action="store_true", help="acompanha o job até o fim")
+    submit.add_argument("comando", nargs=argparse.REMAINDER)
+    for name, text in (("status", "estado de um job"), ("cancelar", "cancela um job"), ("acompanhar", "progresso até o fim")):
+        command = commands.add_parser(name, help=text)
+        command.add_argument("job", type=int)
+        if name == "acompanhar":
+            command.add_argument("--intervalo", type=float, default=1.0)
+    tail = commands.add_parser("tail", help="últimas linhas da saída de um job (com --logs no daemon)")
+    tail.add_argument("job", type=int)
+    tail.add_argument("--bytes", type=int, default=4096)
+    commands.add_parser("jobs", help="lista os jobs")
+    commands.add_parser("saldo", help="créditos pré-pagos e CPU pós-paga")
+    commands.add_parser("stats", help="estatísticas do motor e da fila")
+    deposit = commands.add_parser("creditos", help="acrescenta créditos pré-pagos")
+    deposit.add_argument("valor", type=float)
+    pay = commands.add_parser("pagar", help="quita CPU pós-paga")
+    pay.add_argument("valor", type=float)
+    args = parser.parse_args(argv)
+
+    try:
+        client = Client(args.socket)
+    except OSError as e:
+        print(f"Daemon indisponível em {args.socket or socket_path()}: {e}", file=sys.stderr)
+        return 2
+    try:
+        if args.cmd == "enviar":
+            command = args.comando[1:] if args.comando[:1] == ["--"] else args.comando
+            responses = [client.request(
+                "submit", command=command, limit_cpu=args.cpu, limit_mem=args.mem, limit_time=args.tempo,
+                mode="pre-pago" if args.pre_pago else "pos-pago", priority=args.prioridade,
+                submitter=args.submissor, cores=args.nucleos,
+            )]
+            if args.acompanhar and responses[0].get("ok"):
+                responses = client.stream("watch", job=responses[0]["job"]["job"])
+        elif args.cmd == "acompanhar":
+            responses = client.stream("watch", job=args.job, interval=args.intervalo)
+        elif args.cmd in ("status", "cancelar"):
+            responses = [client.request("status" if args.cmd == "status" else "cancel", job=args.job)]
+        elif args.cmd == "tail":
+            responses = [client.request("tail", job=args.job, bytes=args.bytes)]
+        elif args.cmd == "creditos":
+            responses = [client.request("deposit", amount=args.valor)]
+        elif args.cmd == "pagar":
+            responses = [client.request("pay", amount=args.valor)]
+        else:
+            responses = [client.request({"saldo": "balance"}.get(args.cmd, args.cmd))]
+        status = 0
+        for response in responses:
+            if args.json:
+                print(json.dumps(response, ensure_ascii=False))
+            elif not response.get("ok"):
+                print(f"Erro: {response.get('error')}", file=sys.stderr)
+            elif "job" in response:
+                show_job(response["job"])
+            elif "jobs" in response:
+                for job in response["jobs"]:
+                    show_job(job)
+            elif "output" in response:
+                sys.stdout.write(response["output"])
+            elif "credits" in response:
+                print(f"Créditos: R${response['credits']:.2f} | CPU pós-paga: {response['postpaid_cpu']:.2f}s")
+            else:
+                print(json.dumps(response, ensure_ascii=False, indent=2))
+            if not response.get("ok"):
+                status = 1
+        return status
+    except (OSError, ConnectionError) as e:
+        print(f"Erro de comunicação com o daemon: {e}", file=sys.stderr)
+        return 2
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
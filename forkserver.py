@@ -0,0 +1,495 @@
+# Fork server: lançamento dos jobs a partir de um processo auxiliar pequeno (--fork-server)
+# Com child_setup (cgroup, rlimits, afinidade) o Popen precisa de um fork completo do FMS, que custa caro quando ele já
+# tem muita memória e threads (o kernel copia as tabelas de páginas do pai inteiro); o servidor é um interpretador
+# mínimo iniciado junto com o FMS que recebe os pedidos por um socket Unix, faz o fork e o exec e devolve o pid para o
+# FMS monitorar. Jobs sem nada a aplicar no filho saem por posix_spawn
+# - o que o child_setup faria no filho (sessão própria, cgroup, rlimits, afinidade) vai no pedido e é aplicado pelo
+#   servidor
+# - os pipes de saída do job (ver output.py) vão junto no pedido, por SCM_RIGHTS
+# - o servidor é o pai dos jobs: ele os recolhe com wait4 e envia o status e o rusage; o FMS é avisado do término
+#   por um pipe do ForkServerProcess no lugar do pidfd
+# - o ru_maxrss de um job inclui a imagem de quem fez o fork antes do exec; junto com o pid o servidor envia o pico
+#   da própria memória (image_peak()), bem menor que o do FMS, para o FMS saber que valores vêm com certeza do job
+#   (ver FMS.finish())
+# - como no Popen, um job que termina fica zumbi até o FMS liberá-lo (release(), depois de se ligar ao pid), então
+#   um job curtíssimo não some antes de o FMS começar a monitorá-lo
+# Com pool_size, o servidor mantém processos Python ociosos já inicializados (e com os módulos de preload
+# importados); um job "python script.py", "python -c ..." ou "python -m mod" do mesmo interpretador roda num deles
+# sem a inicialização do interpretador. Esses jobs compartilham o estado inicial do servidor (sys.modules, flags),
+# então jobs que dependem de um interpretador limpo devem rodar com o pool desativado
+#
+# Uso no FMS:
+#     FMS.forkserver = ForkServer(pool_size=4, preload=["json"])
+# O servidor é executado como: python forkserver.py FD [--pool N] [--preload MOD ...]
+
+import argparse
+import atexit
+import itertools
+import json
+import os
+import resource
+import selectors
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+from types import SimpleNamespace
+
+# Tamanho máximo de uma mensagem do protocolo (o ambiente do job vai em cada pedido)
+MAX_MESSAGE = 1 << 20
+STREAMS = ("stdout", "stderr")
+
+
+def image_peak():
+    # Pico de RSS (KB) da memória atual do processo (VmHWM), que é o que um filho leva para o ru_maxrss dele no exec;
+    # o ru_maxrss do próprio processo não serve, pois inclui a imagem de quem o lançou (herdada no exec dele)
+    try:
+        with open("/proc/self/status", "rb") as f:
+            for line in f:
+                if line.startswith(b"VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def send(sock, message, fds=()):
+    data = json.dumps(message).encode()
+    if fds:
+        socket.send_fds(sock, [data], list(fds))
+    else:
+        sock.send(data)
+
+
+def receive(sock):
+    # Retorna (mensagem, fds) ou (None, []) quando o outro lado fechou o socket
+    data, fds, _, _ = socket.recv_fds(sock, MAX_MESSAGE, len(STREAMS))
+    if not data:
+        return None, fds
+    return json.loads(data), fds
+
+
+class ForkServerProcess:
+    # Parte da interface do Popen usada pelo FMS para um processo lançado pelo fork server
+
+    def __init__(self, pid, server, launcher_maxrss=0):
+        self.pid = pid
+        self.server = server
+        self.returncode = None
+        self.rusage = None
+        # Pico de RSS (KB) do servidor depois do lançamento; 0 para um membro do pool, que é o próprio job
+        self.launcher_maxrss = launcher_maxrss
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        # Fica legível quando o servidor informa o término (ver exit_fd())
+        self.exit_r, self.exit_w = os.pipe()
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise subprocess.TimeoutExpired(self.pid, timeout)
+        return self.returncode
+
+    def release(self):
+        # Permite ao servidor recolher o processo quando ele terminar
+        self.server.request({"op": "release", "pid": self.pid})
+
+    def exit_fd(self):
+        # Descritor que fica legível no término; passa a ser de quem chamou, que deve fechá-lo
+        with self.lock:
+            fd, self.exit_r = self.exit_r, None
+        return fd
+
+    def exited(self, returncode, rusage):
+        # Executado na thread de leitura do cliente; o rusage é gravado antes do returncode, que sinaliza o término
+        self.rusage = rusage
+        self.returncode = returncode
+        self.done.set()
+        # O EOF deixa a ponta de leitura legível, mesmo que ela só seja entregue depois
+        os.close(self.exit_w)
+
+    def __del__(self):
+        # Ponta de leitura nunca entregue (motor sem pidfd)
+        if self.exit_r is not None:
+            os.close(self.exit_r)
+
+
+class ForkServer:
+    # Cliente do fork server no FMS; spawn() pode ser chamado por várias threads
+
+    def __init__(self, pool_size=0, preload=()):
+        parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        command = [sys.executable]
+        # Sem pool o servidor não precisa do site (sys.path do usuário, .pth): inicia mais rápido e fica menor
+        if not pool_size and not preload:
+            command.append("-S")
+        command += [os.path.abspath(__file__), str(child.fileno()), "--pool", str(pool_size)]
+        if preload:
+            command += ["--preload", *preload]
+        self.process = subprocess.Popen(command, pass_fds=[child.fileno()])
+        child.close()
+        self.sock = parent
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+        self.waiting = {}
+        self.handles = {}
+        self.closed = False
+        self.thread = threading.Thread(target=self.read_loop, name="FMS-ForkServer", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def spawn(self, argv, spec=None, stdout=None, stderr=None):
+        # Lança argv pelo servidor; spec: {"cgroup": caminho, "rlimits": [[recurso, soft, hard]], "cpus": [...]}
+        # Levanta OSError como o Popen quando o exec falha
+        fds = {name: fd for name, fd in zip(STREAMS, (stdout, stderr)) if fd is not None}
+        waiter = [threading.Event(), None]
+        with self.lock:
+            request_id = next(self.ids)
+            self.waiting[request_id] = waiter
+        self.request({
+            "op": "spawn", "id": request_id, "argv": list(argv), "env": dict(os.environ), "cwd": os.getcwd(),
+            "spec": spec or {}, "fds": list(fds),
+        }, fds.values())
+        waiter[0].wait()
+        reply = waiter[1]
+        if "error" in reply:
+            raise OSError(reply["error"], reply["message"], argv[0])
+        return reply["handle"]
+
+    def request(self, message, fds=()):
+        with self.lock:
+            if self.closed:
+                raise OSError("fork server encerrado")
+            send(self.sock, message, fds)
+
+    def read_loop(self):
+        while True:
+            try:
+                message, _ = receive(self.sock)
+            except OSError:
+                message = None
+            if message is None:
+                break
+            if message.get("op") == "exit":
+                rusage = message["rusage"]
+                handle = self.handles.pop(message["pid"], None)
+                if handle is not None:
+                    handle.exited(message["status"], SimpleNamespace(
+                        ru_utime=rusage[0], ru_stime=rusage[1], ru_maxrss=rusage[2],
+                    ))
+                continue
+            if "pid" in message:
+                # Registrado antes de qualquer aviso de término do mesmo pid, que chega depois pelo socket
+                message["handle"] = self.handles[message["pid"]] = ForkServerProcess(
+                    message["pid"], self, message.get("maxrss", 0),
+                )
+            waiter = self.waiting.pop(message["id"])
+            waiter[1] = message
+            waiter[0].set()
+        self.lost()
+
+    def lost(self):
+        # Sem o servidor o término dos jobs não pode mais ser observado: eles são mortos e dados como encerrados
+        # (a não ser no close() da saída do programa, em que os jobs continuam)
+        with self.lock:
+            closing, self.closed = self.closed, True
+            waiting, self.waiting = self.waiting, {}
+        for waiter in waiting.values():
+            waiter[1] = {"error": 0, "message": "fork server encerrado"}
+            waiter[0].set()
+        if closing:
+            return
+        for pid, handle in list(self.handles.items()):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+            handle.exited(-signal.SIGKILL, None)
+        self.handles.clear()
+
+    def close(self):
+        # Fechar o socket encerra o servidor; os jobs ainda em execução continuam (como os filhos de um Popen)
+        with self.lock:
+            self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+# Servidor
+
+def python_entry(argv, env, executable=sys.executable):
+    # (modo, alvo, sys.argv) quando argv roda este mesmo interpretador com um script, -c ou -m; senão None
+    if len(argv) < 2:
+        return None
+    path = shutil.which(argv[0], path=env.get("PATH"))
+    if path is None or os.path.realpath(path) != os.path.realpath(executable):
+        return None
+    if argv[1] in ("-c", "-m"):
+        if len(argv) < 3:
+            return None
+        return ("code" if argv[1] == "-c" else "module"), argv[2], [argv[1]] + argv[3:]
+    if argv[1].startswith("-"):
+        return None
+    return "script", argv[1], argv[1:]
+
+
+def apply_spec(spec, fds, cwd):
+    # Executado no filho: o equivalente declarativo do FMS.child_setup, mais os pipes de saída e o diretório
+    if spec.get("session"):
+        os.setsid()
+    if spec.get("cgroup"):
+        with open(os.path.join(spec["cgroup"], "cgroup.procs"), "w") as f:
+            f.write("0")
+    for which, soft, hard in spec.get("rlimits", ()):
+        resource.setrlimit(which, (soft, hard))
+    if spec.get("cpus"):
+        os.sched_setaffinity(0, spec["cpus"])
+    for name, fd in fds.items():
+        os.dup2(fd, STREAMS.index(name) + 1)
+        os.close(fd)
+    os.chdir(cwd)
+
+
+def restore_signals():
+    # Como o Popen(restore_signals=True): o Python ignora SIGPIPE e SIGXFSZ e o servidor ignora SIGINT, o que não
+    # deve passar para o job
+    signal.set_wakeup_fd(-1)
+    for signum in (signal.SIGPIPE, signal.SIGXFSZ, signal.SIGCHLD, signal.SIGINT):
+        signal.signal(signum, signal.SIG_DFL)
+
+
+class PoolMember:
+    # Processo Python ocioso do pool: espera um único job e o executa no próprio interpretador
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def serve(self):
+        code = 1
+        try:
+            request, fds = receive(self.sock)
+            self.sock.close()
+            if request is None:
+                os._exit(0)
+            mode, target, args = python_entry(request["argv"], request["env"])
+            os.environ.clear()
+            os.environ.update(request["env"])
+            apply_spec(request["spec"], dict(zip(request["fds"], fds)), request["cwd"])
+            code = self.run(mode, target, args)
+        finally:
+            os._exit(code)
+
+    @staticmethod
+    def run(mode, target, args):
+        import runpy
+        import traceback
+        import types
+
+        sys.argv = args
+        sys.path[0] = os.path.dirname(os.path.abspath(target)) if mode == "script" else ""
+        code = 0
+        try:
+            if mode == "script":
+                runpy.run_path(target, run_name="__main__")
+            elif mode == "module":
+                runpy.run_module(target, run_name="__main__", alter_sys=True)
+            else:
+                main = types.ModuleType("__main__")
+                sys.modules["__main__"] = main
+                exec(compile(target, "<string>", "exec"), main.__dict__)
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                code = e.code or 0
+            else:
+                print(e.code, file=sys.stderr)
+                code = 1
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        # O encerramento normal do interpretador: threads não daemon, atexit e buffers de saída
+        for thread in threading.enumerate():
+            if thread is not threading.main_thread() and not thread.daemon:
+                thread.join()
+        atexit._run_exitfuncs()
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+        return code
+
+
+class Server:
+
+    def __init__(self, sock, pool_size=0):
+        self.sock = sock
+        self.pool_size = pool_size
+        # Membros ociosos do pool: (pid, socket)
+        self.pool = []
+        # Jobs que o FMS já liberou para serem recolhidos
+        self.released = set()
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        os.set_blocking(self.wake_w, False)
+        self.selector = selectors.DefaultSelector()
+
+    def run(self):
+        # SIGCHLD só acorda o laço (pelo wakeup fd); os filhos são recolhidos fora do handler
+        signal.set_wakeup_fd(self.wake_w)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+        self.fill_pool()
+        while True:
+            for key, _ in self.selector.select():
+                if key.fileobj is self.sock:
+                    request, fds = receive(self.sock)
+                    if request is None:
+                        return
+                    if request["op"] == "release":
+                        self.released.add(request["pid"])
+                    else:
+                        self.handle(request, fds)
+                else:
+                    try:
+                        while os.read(self.wake_r, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+            self.reap()
+            self.fill_pool()
+
+    def handle(self, request, fds):
+        fds_by_name = dict(zip(request["fds"], fds))
+        try:
+            # O membro do pool roda o job sem exec, então a imagem dele já é do job; nos outros casos o que o job herda
+            # do servidor no exec é no máximo o pico da memória do servidor lido depois do lançamento
+            if self.pool and python_entry(request["argv"], request["env"]) is not None:
+                pid = self.run_in_pool(request, fds)
+                maxrss = 0
+            else:
+                if not any(request["spec"].get(key) for key in ("cgroup", "rlimits", "cpus")) \
+                        and request["cwd"] == os.getcwd():
+                    pid = self.posix_spawn(request, fds_by_name)
+                else:
+                    pid = self.fork_exec(request, fds_by_name)
+                maxrss = image_peak()
+        except OSError as e:
+            send(self.sock, {"id": request["id"], "error": e.errno or 0, "message": e.strerror or str(e)})
+        else:
+            send(self.sock, {"id": request["id"], "pid": pid, "maxrss": maxrss})
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def posix_spawn(self, request, fds):
+        # Sem nada a aplicar no filho, o posix_spawn (vfork + exec na glibc) evita até a cópia do servidor
+        # Os fds recebidos por SCM_RIGHTS são herdáveis: depois do dup2 os originais são fechados no filho
+        argv = request["argv"]
+        path = shutil.which(argv[0], path=request["env"].get("PATH")) if os.sep not in argv[0] else argv[0]
+        if path is None:
+            raise FileNotFoundError(2, "No such file or directory")
+        return os.posix_spawn(
+            path, argv, request["env"],
+            file_actions=[(os.POSIX_SPAWN_DUP2, fd, STREAMS.index(name) + 1) for name, fd in fds.items()]
+            + [(os.POSIX_SPAWN_CLOSE, fd) for fd in fds.values()],
+            setsigdef=(signal.SIGPIPE, signal.SIGXFSZ, signal.SIGCHLD, signal.SIGINT),
+            setsigmask=(),
+            setsid=bool(request["spec"].get("session")),
+        )
+
+    def fork_exec(self, request, fds):
+        # Fork e exec com um pipe de erro (CLOEXEC): EOF sem dados significa que o exec deu certo
+        err_r, err_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(err_r)
+                restore_signals()
+                apply_spec(request["spec"], fds, request["cwd"])
+                os.execvpe(request["argv"][0], request["argv"], request["env"])
+            except OSError as e:
+                os.write(err_w, f"{e.errno or 0}:{e.strerror or e}".encode())
+            except BaseException as e:
+                os.write(err_w, f"0:{e}".encode())
+            finally:
+                os._exit(127)
+        os.close(err_w)
+        chunks = []
+        while True:
+            chunk = os.read(err_r, 4096)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        os.close(err_r)
+        if chunks:
+            os.waitpid(pid, 0)
+            number, _, message = b"".join(chunks).decode(errors="replace").partition(":")
+            raise OSError(int(number), message)
+        return pid
+
+    def run_in_pool(self, request, fds):
+        pid, member = self.pool.pop(0)
+        send(member, request, fds)
+        member.close()
+        return pid
+
+    def fill_pool(self):
+        while len(self.pool) < self.pool_size:
+            parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            pid = os.fork()
+            if pid == 0:
+                # O membro não fica com nada do servidor além do próprio socket
+                parent.close()
+                self.selector.close()
+                self.sock.close()
+                os.close(self.wake_r)
+                os.close(self.wake_w)
+                for _, other in self.pool:
+                    other.close()
+                restore_signals()
+                PoolMember(child).serve()
+            child.close()
+            self.pool.append((pid, parent))
+
+    def reap(self):
+        # Só os jobs liberados e os membros ociosos são recolhidos; os demais continuam zumbis até a liberação
+        for member in list(self.pool):
+            if os.waitpid(member[0], os.WNOHANG)[0]:
+                # Membro ocioso que morreu: é só substituído
+                self.pool.remove(member)
+                member[1].close()
+        for pid in list(self.released):
+            try:
+                pid, status, rusage = os.wait4(pid, os.WNOHANG)
+            except ChildProcessError:
+                self.released.discard(pid)
+                continue
+            if pid == 0:
+                continue
+            self.released.discard(pid)
+            send(self.sock, {
+                "op": "exit", "pid": pid, "status": os.waitstatus_to_exitcode(status),
+                "rusage": [rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss],
+            })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fork server do FMS")
+    parser.add_argument("fd", type=int)
+    parser.add_argument("--pool", type=int, default=0)
+    parser.add_argument("--preload", nargs="*", default=[])
+    args = parser.parse_args()
+    # Os módulos usados pelos membros do pool para rodar o job também são importados antes do fork
+    for module in args.preload + (["runpy", "traceback"] if args.pool else []):
+        __import__(module)
+    os.set_inheritable(args.fd, False)
+    # O servidor ignora o Ctrl+C do terminal: ele termina quando o FMS fecha o socket
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    Server(socket.socket(fileno=args.fd), args.pool).run()
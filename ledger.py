@@ -0,0 +1,151 @@
+# Ledger persistente de créditos e uso (write-ahead log)
+# Cada débito, devolução e acúmulo pós-pago vira um registro JSON por linha num arquivo só de acréscimo:
+# - append() apenas enfileira o registro na memória, então o tick de um job nunca espera pelo disco
+# - uma thread de escrita grava os registros pendentes em lote e faz um único fsync por lote (group commit)
+# - a cada snapshot_every registros o estado é gravado em <ledger>.snapshot e o log é truncado (compactação)
+# Na abertura, o snapshot é lido e os registros posteriores a ele são reaplicados; uma última linha incompleta
+# (queda no meio de uma escrita) é descartada
+#
+# Registros: {"seq": n, "op": op, "amount": valor}
+#     set      saldo pré-pago definido para o valor (CreditManagerPrePago.set_total)
+#     debit    créditos pré-pagos consumidos
+#     refund   créditos pré-pagos devolvidos ao saldo
+#     deposit  créditos pré-pagos acrescentados ao saldo (CreditManagerPrePago.deposit)
+#     accrual  CPU pós-paga acumulada (FMS.total_cpu_used)
+#     payment  CPU pós-paga quitada
+
+import json
+import os
+import threading
+from collections import deque
+
+
+class Ledger:
+    # Intervalo máximo entre dois commits; um débito fica durável em até commit_interval + tempo do fsync
+    commit_interval = 0.005
+    snapshot_every = 10000
+
+    def __init__(self, path):
+        self.path = path
+        self.snapshot_path = path + ".snapshot"
+        self.credits = 0.0
+        self.cpu_used = 0.0
+        self.seq = 0
+        self.since_snapshot = 0
+        # Estatísticas de escrita (usadas pelo benchmark)
+        self.commits = 0
+        self.records = 0
+        # deque.append e popleft são atômicos, então quem debita não disputa lock com a thread de escrita
+        self.pending = deque()
+        self.commit_lock = threading.Lock()
+        self.replay()
+        self.file = open(path, "ab")
+        self.closing = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="fms-ledger", daemon=True)
+        self.thread.start()
+
+    def apply(self, op, amount):
+        if op == "set":
+            self.credits = amount
+        elif op == "debit":
+            self.credits -= amount
+        elif op in ("refund", "deposit"):
+            self.credits += amount
+        elif op == "accrual":
+            self.cpu_used += amount
+        elif op == "payment":
+            self.cpu_used -= amount
+
+    def replay(self):
+        # Reconstrói o estado a partir do snapshot e dos registros gravados depois dele
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            self.seq = snapshot["seq"]
+            self.credits = snapshot["credits"]
+            self.cpu_used = snapshot["cpu_used"]
+        except FileNotFoundError:
+            pass
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            valid = 0
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                valid += len(line)
+                # Registros já incluídos no snapshot (queda entre o snapshot e o truncamento do log)
+                if record["seq"] <= self.seq:
+                    continue
+                self.seq = record["seq"]
+                self.apply(record["op"], record["amount"])
+                self.since_snapshot += 1
+        # Descarta a cauda incompleta para que os próximos registros comecem numa linha nova
+        if valid != os.path.getsize(self.path):
+            os.truncate(self.path, valid)
+
+    def append(self, op, amount):
+        # Chamado no caminho do tick: só enfileira, a gravação e o fsync ficam com a thread de escrita
+        self.pending.append((op, amount))
+
+    def run(self):
+        while not self.closing.wait(self.commit_interval):
+            self.commit()
+
+    def commit(self):
+        # Grava todos os registros pendentes com um único fsync
+        with self.commit_lock:
+            lines = []
+            pending = self.pending
+            while pending:
+                op, amount = pending.popleft()
+                self.seq += 1
+                self.apply(op, amount)
+                lines.append(json.dumps({"seq": self.seq, "op": op, "amount": amount}))
+            if not lines:
+                return
+            self.file.write(("\n".join(lines) + "\n").encode())
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.commits += 1
+            self.records += len(lines)
+            self.since_snapshot += len(lines)
+            if self.since_snapshot >= self.snapshot_every:
+                self.snapshot()
+
+    def sync(self):
+        # Bloqueia até que tudo o que foi enfileirado antes da chamada esteja em disco
+        self.commit()
+
+    def snapshot(self):
+        # Grava o estado atual de forma atômica (arquivo temporário + rename) e então trunca o log
+        temp = self.snapshot_path + ".tmp"
+        with open(temp, "w") as f:
+            json.dump({"seq": self.seq, "credits": self.credits, "cpu_used": self.cpu_used}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.snapshot_path)
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        os.ftruncate(self.file.fileno(), 0)
+        os.fsync(self.file.fileno())
+        self.since_snapshot = 0
+
+    def close(self):
+        if self.closing.is_set():
+            return
+        self.closing.set()
+        self.thread.join()
+        self.commit()
+        with self.commit_lock:
+            self.snapshot()
+        self.file.close()
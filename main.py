@@ -2,14 +2,34 @@
 #Instruções:
 # 1. Instale as dependências necessárias: `pip install psutil prompt_toolkit`
 # 2. Execute o script: `python main.py`
+# 3. Modo batch (sem prompt): `python main.py --batch jobs.jsonl --concorrencia 8 --saida resultados.jsonl`
 
+import argparse
+import atexit
+import math
+import resource
+import signal
 import subprocess
+import sys
 import psutil
 import time
 import threading
+import heapq
+import itertools
+import os
+import selectors
+from collections import deque
 from prompt_toolkit import PromptSession
 from prompt_toolkit.patch_stdout import patch_stdout
 
+from cgroup import CgroupV2
+from forkserver import image_peak
+from ledger import Ledger
+from metrics import LATENCY_BUCKETS, Histogram
+from output import JobOutput
+from sampling import ProcessTree, ProcSampler, default_sampler
+from timeseries import SampleSeries
+
 # class CreditManager: responsavel por gerenciar os créditos de CPU
 class CreditManagerPrePago:
     total_credits = 0
@@ -22,6 +42,8 @@ class CreditManagerPrePago:
     def set_total(cls, value):
         with cls.lock:
             cls.total_credits = value
+            if FMS.ledger is not None:
+                FMS.ledger.append("set", value)
 
     # Método de classe para debitar créditos
     # Verifica se há créditos suficientes antes de debitar
@@ -30,30 +52,284 @@ class CreditManagerPrePago:
         with cls.lock:
             if cls.total_credits >= amount:
                 cls.total_credits -= amount
+                if FMS.ledger is not None:
+                    FMS.ledger.append("debit", amount)
                 return True
             return False
 
+    # Método de classe para debitar o que houver de crédito, até o valor pedido
+    # Usado no acerto final de um job que já terminou, quando não há mais como interromper o consumo
+    @classmethod
+    def drain(cls, amount):
+        with cls.lock:
+            debited = min(amount, cls.total_credits)
+            cls.total_credits -= debited
+            if debited and FMS.ledger is not None:
+                FMS.ledger.append("debit", debited)
+            return debited
+
+    # Método de classe para acrescentar créditos ao saldo (recarga), sem mexer no que está reservado nas leases
+    @classmethod
+    def deposit(cls, amount):
+        with cls.lock:
+            cls.total_credits += amount
+            if FMS.ledger is not None:
+                FMS.ledger.append("deposit", amount)
+
     # Método de classe para pegar o total de créditos disponíveis
+    # Inclui o que está reservado nas leases abertas e ainda não foi gasto
     @classmethod
     def get_balance(cls):
         with cls.lock:
-            return cls.total_credits
+            return cls.total_credits + sum(lease.available for lease in cls.leases)
+
+    # Leasing de créditos: cada job reserva um bloco do saldo e gasta localmente, sem pegar o lock a cada tick
+    # O lock só é usado para abrir, renovar e devolver blocos; o total gasto nunca passa do que foi reservado
+    lease_chunk = 1.0
+    leases = set()
+
+    # Método de classe para reservar créditos para uma lease
+    # O bloco é limitado a uma fração do saldo livre, para que perto do fim os jobs dividam o que sobra
+    # Sem partial, nada é reservado quando o saldo livre não cobre need: um débito que vai falhar não pode prender na
+    # lease de um job que será encerrado o saldo de que as outras leases precisam
+    @classmethod
+    def reserve(cls, lease, need, partial=True):
+        with cls.lock:
+            cls.leases.add(lease)
+            if not partial and cls.total_credits < need:
+                return 0.0
+            amount = max(need, min(cls.lease_chunk, cls.total_credits / 4))
+            granted = min(amount, cls.total_credits)
+            cls.total_credits -= granted
+            lease.available += granted
+            return granted
+
+    # Método de classe para devolver o que sobrou de uma lease encerrada
+    # Com amount, só essa parte volta ao saldo e a lease continua aberta (agentes remotos, ver cluster.py)
+    @classmethod
+    def release(cls, lease, amount=None):
+        with cls.lock:
+            if amount is not None:
+                amount = min(amount, lease.available)
+                cls.total_credits += amount
+                lease.available -= amount
+                return
+            cls.total_credits += lease.available
+            lease.available = 0.0
+            cls.leases.discard(lease)
+
+
+class CreditLease:
+    # Cobrança pré-paga de um job: os débitos saem de um bloco reservado no CreditManagerPrePago
+    # Quando o bloco acaba, um novo é pedido; se o saldo não cobre o débito, nada é gasto e o débito falha
+
+    def __init__(self):
+        self.available = 0.0
+        self.spent = 0.0
+
+    def debit(self, amount):
+        if amount > self.available:
+            CreditManagerPrePago.reserve(self, amount - self.available, partial=False)
+            if amount > self.available:
+                return False
+        self.available -= amount
+        self.spent += amount
+        if FMS.ledger is not None:
+            FMS.ledger.append("debit", amount)
+        return True
+
+    def drain(self, amount):
+        # Acerto final: gasta o que houver na lease e o restante direto do saldo, até o valor pedido
+        from_lease = min(amount, self.available)
+        self.available -= from_lease
+        self.spent += from_lease
+        if from_lease and FMS.ledger is not None:
+            FMS.ledger.append("debit", from_lease)
+        if amount > from_lease:
+            self.spent += CreditManagerPrePago.drain(amount - from_lease)
+
+    def headroom(self):
+        # Créditos que o job ainda pode gastar, lido sem lock (usado só como estimativa no intervalo adaptativo)
+        return self.available + CreditManagerPrePago.total_credits
+
+    def close(self):
+        CreditManagerPrePago.release(self)
+
+
+class PostpaidAccrual:
+    # Cobrança pós-paga de um job: a CPU é acumulada localmente e somada ao FMS.total_cpu_used em lotes
+    # Os acúmulos abertos ficam em accruals, e a conta (total(), pay()) soma o que os jobs em execução ainda não
+    # passaram para o total; o pendente de outro job é só lido, como o saldo das leases em get_balance()
+    flush_threshold = 1.0
+    accruals = set()
+
+    def __init__(self):
+        self.pending = 0.0
+        with FMS.total_cpu_lock:
+            self.accruals.add(self)
+
+    @classmethod
+    def owed(cls):
+        # CPU pós-paga devida; chamado com FMS.total_cpu_lock já adquirido
+        return FMS.total_cpu_used + sum(accrual.pending for accrual in cls.accruals)
+
+    @classmethod
+    def total(cls):
+        with FMS.total_cpu_lock:
+            return cls.owed()
+
+    @classmethod
+    def pay(cls, amount):
+        # Quita CPU pós-paga até o total devido e retorna o valor quitado; o excedente não vira crédito
+        # Com acúmulos pendentes o FMS.total_cpu_used pode ficar negativo até eles serem somados
+        with FMS.total_cpu_lock:
+            paid = min(amount, cls.owed())
+            FMS.total_cpu_used -= paid
+        return paid
+
+    def debit(self, amount):
+        self.pending += amount
+        if FMS.ledger is not None:
+            FMS.ledger.append("accrual", amount)
+        if self.pending >= self.flush_threshold:
+            self.flush()
+        return True
+
+    def drain(self, amount):
+        self.pending += amount
+        if FMS.ledger is not None:
+            FMS.ledger.append("accrual", amount)
+
+    def headroom(self):
+        return float("inf")
+
+    def flush(self):
+        with FMS.total_cpu_lock:
+            FMS.total_cpu_used += self.pending
+            self.pending = 0.0
+
+    def close(self):
+        self.flush()
+        with FMS.total_cpu_lock:
+            self.accruals.discard(self)
+
 
 class FMS:
     total_cpu_used = 0
+    # Intervalo entre amostras de cada job e intervalo de verificação enquanto um processo encerra
+    interval = 0.5
+    terminate_poll_interval = 0.05
+    # Intervalo adaptativo: calculado a cada amostra pela taxa de crescimento de CPU e memória e pela folga até
+    # limit_cpu, limit_mem, limit_time e o saldo pré-pago; adaptive_interval = False volta ao intervalo fixo
+    adaptive_interval = True
+    min_interval = 0.05
+    max_interval = 5.0
+    # Fração do tempo previsto até o limite usada como próximo intervalo e crescimento máximo por amostra
+    interval_safety = 0.5
+    interval_backoff = 1.5
+    # Com verbose = False o FMS não imprime os relatórios de cada job (usado no modo batch)
+    verbose = True
+    # Subárvore cgroup v2 delegada (ver cgroup.py); quando definida, cada job roda no seu próprio cgroup
+    # cgroup_cpu_max limita opcionalmente a taxa de uso de CPU do job (fração de CPUs, via cpu.max)
+    cgroups = None
+    cgroup_cpu_max = None
+    # Com use_rlimits, RLIMIT_CPU, RLIMIT_AS e RLIMIT_DATA são aplicados no filho antes do exec e o próprio kernel
+    # faz valer os limites; a amostragem fica apenas para relatório e créditos
+    use_rlimits = False
+    # Série de amostras de cada job (ver timeseries.py); com series_downsample a série cobre o job inteiro com
+    # resolução decrescente em vez de guardar só as últimas amostras
+    series_capacity = SampleSeries.capacity
+    series_downsample = False
+    # Captura da saída (ver output.py): com log_dir, stdout e stderr de cada job vão para arquivos de log em vez do
+    # terminal do FMS; log_max_bytes ativa a rotação e log_compress grava os logs com gzip
+    log_dir = None
+    log_max_bytes = None
+    log_backups = 3
+    log_compress = False
+    log_tail_bytes = 64 * 1024
+    # Afinidade de CPU (ver placement.py): com placement, cada job é fixado nos núcleos escolhidos por ele
+    placement = None
+    # Fork server (ver forkserver.py): quando definido, os jobs são lançados por ele em vez do Popen
+    forkserver = None
+    # Com process_groups cada job roda na própria sessão (e no próprio grupo de processos), e o encerramento sinaliza
+    # o grupo inteiro com um único killpg; kill_grace segundos depois do SIGTERM o grupo recebe SIGKILL
+    process_groups = True
+    kill_grace = 5.0
+    # Leitura detalhada da memória (ver memory_detail()), no máximo a cada memory_detail_interval segundos por job:
+    # o VmHWM de cada processo dá o pico exato de RSS por processo, inclusive entre duas amostras; com pss, o
+    # smaps_rollup dá PSS e USS da árvore, e o limite de memória passa a usar a PSS (páginas compartilhadas entre os
+    # processos de um servidor que faz fork não são cobradas uma vez por processo)
+    memory_detail_interval = 2.0
+    pss = False
     # Usando um lock para garantir que o acesso ao total de CPU usada seja thread-safe
     # Isso é importante para evitar condições de corrida quando múltiplas threads tentam acessar ou modificar o total da cpu ao mesmo tempo.
     total_cpu_lock = threading.Lock()
+    # Ledger persistente (ver ledger.py); quando definido, débitos e acúmulos pós-pagos são registrados nele
+    ledger = None
+
+    @classmethod
+    def open_ledger(cls, path):
+        # Abre o ledger, restaura o saldo pré-pago e a CPU pós-paga a partir dele e o fecha na saída do programa
+        cls.ledger = Ledger(path)
+        CreditManagerPrePago.total_credits = cls.ledger.credits
+        cls.total_cpu_used = cls.ledger.cpu_used
+        atexit.register(cls.ledger.close)
+        return cls.ledger
 
-    def __init__(self, pre_pago=True):
+    def __init__(self, pre_pago=True, sampler=None):
         self.limit_cpu = 0
         self.limit_mem = 0
         self.limit_time = 0
         self.process = None
+        self.popen = None
+        self.rusage = None
+        self.cgroup = None
+        self.rlimit_values = {}
+        # Motivo do encerramento forçado ("tempo", "cpu", "memoria", "creditos") e quanto o job passou do limite
+        # no momento da decisão, usado para comparar o intervalo adaptativo com o fixo
+        self.reason = None
+        self.overshoot = 0.0
+        self.samples = 0
+        self.command = None
+        self.mem_peak_mb = 0.0
+        # Maior pico de RSS de um único processo do job (VmHWM e ru_maxrss) e, com pss, PSS e USS da árvore
+        self.mem_hwm_mb = 0.0
+        # Pico de RSS (KB) do processo que fez o fork do job, lido depois do exec (ver finish()); quando o ru_maxrss
+        # não passa dele, o pico do job não é conhecido e maxrss_bound_mb guarda o limite superior
+        self.launcher_maxrss = 0
+        self.maxrss_bound_mb = None
+        self.mem_pss_mb = None
+        self.mem_uss_mb = None
+        self.mem_peak_pss_mb = None
+        self.pss_base_rss_mb = 0.0
+        self.next_memory_detail = 0.0
+        # Funções chamadas (na thread do motor) com o próprio FMS quando o job termina
+        self.on_finish = []
+        self.done = False
         self.proc_cpu_time = 0
         self.pre_pago = pre_pago
-        self.tree_process = {}
-
+        # Árvore de processos do job (ver ProcessTree), criada no lançamento
+        self.tree_process = None
+        # Com --monitores (ver sharded.py): última amostra (cpu, rss, processos, leitura detalhada ou None) enviada
+        # pelo processo monitor e os pids da árvore dele, reenviados quando mudam
+        self.shard_usage = None
+        self.shard_pids = ()
+        # Série temporal das amostras do job, criada no início do monitoramento
+        self.series = None
+        # Saída capturada do job (JobOutput), quando log_dir está definido
+        self.output = None
+        # Núcleos pedidos pelo job (None: o padrão do placement) e os núcleos e nós NUMA recebidos no lançamento
+        self.cores = None
+        self.cpus = None
+        self.numa_nodes = None
+        self.held_cpus = None
+        # Grupo de processos do job e instantes do encerramento forçado (SIGTERM e, se preciso, SIGKILL)
+        self.pgid = None
+        self.term_time = None
+        self.kill_time = None
+        self.kill_latency = None
+        # Backend de amostragem (ver sampling.py); quando o job entra no SamplerEngine usa o backend do motor
+        self.sampler = sampler
 
     def get_params(self, session):
         # O método session.prompt é utilizado para coletar entradas do usuário de forma interativa
@@ -66,122 +342,1108 @@ class FMS:
         # O método subprocess.Popen é utilizado para iniciar um novo processo
         # O método Popen é uma maneira de executar um comando no sistema operacional
         # psutil.Process é utilizado para obter informações sobre o processo
-        process = subprocess.Popen(command)
-        self.process = psutil.Process(process.pid)
-        self.tree_process[self.process.pid] = {}
+        # O objeto Popen é mantido para recolher o processo sem bloquear (ver reap())
+        self.prepare_launch(command)
+        try:
+            if self.forkserver is not None:
+                streams = self.output.child_options() if self.output is not None else {}
+                self.popen = self.forkserver.spawn(command, self.child_spec(), **streams)
+                self.launcher_maxrss = self.popen.launcher_maxrss
+            else:
+                self.popen = subprocess.Popen(command, **self.popen_options())
+                # O Popen só retorna depois do exec: o que o job herdou do FMS não passa do pico lido agora
+                self.launcher_maxrss = image_peak()
+        except OSError:
+            self.launch_failed()
+            raise
+        self.attach_process(self.popen.pid)
+        if self.forkserver is not None:
+            self.popen.release()
+
+    def prepare_launch(self, command):
+        # Preparação comum a todas as formas de lançamento: backend, cgroup e rlimits
+        if self.sampler is None:
+            self.sampler = default_sampler()
+        # Funções executadas no processo filho entre o fork e o exec
+        self.command = command
+        self.child_setup = []
+        if self.cgroups is not None:
+            # O filho entra no cgroup antes do exec, então toda a árvore do job nasce dentro dele
+            try:
+                self.cgroup = self.cgroups.create(self.limit_mem, self.cgroup_cpu_max)
+                self.child_setup.append(self.cgroup.attach_self)
+            except OSError as e:
+                self.log(f"cgroup indisponível ({e}), usando a amostragem por processo.")
+                self.cgroup = None
+        if self.use_rlimits:
+            self.child_setup.append(self.rlimits())
+        if self.placement is not None:
+            self.cpus, self.numa_nodes = self.placement.place(self.cores)
+            self.held_cpus = self.cpus
+            self.child_setup.append(self.affinity(self.cpus))
+        if self.log_dir:
+            self.output = JobOutput(
+                self.log_dir, self.log_tail_bytes, self.log_max_bytes, self.log_backups, self.log_compress,
+            )
+
+    def popen_options(self):
+        # Argumentos extras do Popen (também aceitos pelo asyncio.create_subprocess_exec)
+        options = {"preexec_fn": self.run_child_setup if self.child_setup else None}
+        if self.process_groups:
+            options["start_new_session"] = True
+        if self.output is not None:
+            options.update(self.output.child_options())
+        return options
+
+    def child_spec(self):
+        # O child_setup em forma de dados, para o filho criado por outro processo (o fork server)
+        return {
+            "session": self.process_groups,
+            "cgroup": self.cgroup.path if self.cgroup is not None else None,
+            "rlimits": [[which, soft, hard] for which, (soft, hard) in self.rlimit_values.items()],
+            "cpus": self.cpus,
+        }
+
+    def exit_fd(self):
+        # Descritor que fica legível no término do job: o pidfd do processo ou, para um processo lançado pelo
+        # fork server (que é quem o recolhe), o aviso do próprio servidor
+        if hasattr(self.popen, "exit_fd"):
+            return self.popen.exit_fd()
+        return os.pidfd_open(self.process.pid)
+
+    def launch_failed(self):
+        # Desfaz o que foi preparado para um lançamento que falhou
+        if self.cgroup is not None:
+            self.cgroup.remove()
+            self.cgroup = None
+        if self.output is not None:
+            self.output.close()
+            self.output = None
+        self.release_cpus()
+
+    def attach_process(self, pid):
+        self.process = psutil.Process(pid)
+        self.tree_process = ProcessTree(pid)
+        # Com rastreador de eventos, os forks do job passam a ser seguidos desde o lançamento
+        self.sampler.watch(pid)
+        if self.process_groups:
+            self.pgid = pid
+        if self.output is not None:
+            self.output.started(pid)
+
+    def run_child_setup(self):
+        for setup in self.child_setup:
+            setup()
+
+    def rlimits(self):
+        # Calcula os limites no processo pai e devolve a função que os aplica no filho
+        # No limite "soft" de CPU o kernel envia SIGXCPU; um segundo depois, no "hard", envia SIGKILL
+        # RLIMIT_AS e RLIMIT_DATA fazem as alocações acima de limit_mem falharem com ENOMEM
+        limits = []
+        if self.limit_cpu:
+            cpu = max(1, math.ceil(self.limit_cpu))
+            limits.append((resource.RLIMIT_CPU, (cpu, cpu + 1)))
+        if self.limit_mem:
+            mem = int(self.limit_mem * 1024 * 1024)
+            limits.append((resource.RLIMIT_AS, (mem, mem)))
+            limits.append((resource.RLIMIT_DATA, (mem, mem)))
+        self.rlimit_values = dict(limits)
+
+        def apply():
+            for which, value in limits:
+                resource.setrlimit(which, value)
+        return apply
+
+    @staticmethod
+    def affinity(cpus):
+        # Função que fixa o filho (e, por herança, toda a árvore do job) nos núcleos escolhidos
+        def apply():
+            os.sched_setaffinity(0, cpus)
+        return apply
+
+    def release_cpus(self):
+        # Devolve os núcleos ao placement uma única vez; self.cpus continua no resultado do job
+        if self.held_cpus is not None:
+            self.placement.release(self.held_cpus)
+            self.held_cpus = None
+
+    def kernel_exit_reason(self):
+        # Traduz a saída de um processo barrado pelo kernel nas mensagens usuais do FMS
+        # Só entram causas que o kernel deixa registradas: o OOM kill do cgroup (memory.events) e, com rlimits, o
+        # SIGXCPU do limite "soft" de CPU ou o SIGKILL do "hard" quando a CPU da própria raiz chegou a ele (RLIMIT_CPU
+        # vale por processo, não para a árvore). Uma alocação negada por RLIMIT_AS não deixa marca no status de saída
+        # (o programa sai com o código que quiser), então não é adivinhada
+        # Chamado antes do acerto final, enquanto a última amostra da raiz ainda está na árvore
+        if self.terminating:
+            return None
+        if self.cgroup is not None and self.cgroup.oom_killed():
+            return "Memória excedida.", "memoria"
+        if not self.use_rlimits:
+            return None
+        returncode = self.popen.returncode
+        if returncode == -signal.SIGXCPU:
+            return "CPU individual excedida.", "cpu"
+        cpu_limit = self.rlimit_values.get(resource.RLIMIT_CPU)
+        if returncode == -signal.SIGKILL and cpu_limit and self.rusage is not None:
+            # O rusage do wait4 inclui os filhos que a raiz recolheu, descontados pelo cutime/cstime da última amostra
+            root = self.tree_process.nodes.get(self.process.pid)
+            own_cpu = self.rusage.ru_utime + self.rusage.ru_stime - (root.children_cpu if root is not None else 0.0)
+            if own_cpu >= cpu_limit[1]:
+                return "CPU individual excedida.", "cpu"
+        return None
+
+    def sample(self):
+        # Uma única leitura do backend: CPU, memória e estado vêm do mesmo Sample
+        sample = self.sampler.sample(self.process.pid)
+        if sample is None:
+            raise psutil.NoSuchProcess(self.process.pid)
+        return sample
 
     def get_cpu_time(self):
-        # O método cpu_times() retorna o tempo de CPU utilizado pelo processo
-        cpu_times = self.process.cpu_times()
-        return cpu_times.user + cpu_times.system
+        # Tempo de CPU (usuário + sistema) utilizado pelo processo
+        return self.sample().cpu
 
     def get_childrens(self, process: psutil.Process):
-        # O método get_childrens() cria a arvore de processos com os filhos dos processos pai
-        try:
-            childrens = process.children(recursive=False) 
-            active_childrens = {}
-            if childrens:
-                for child in childrens:
-                    cpu_times = child.cpu_times()
-                    cpu_time = cpu_times.user + cpu_times.system
-                    ram_usage = child.memory_info().rss     
-                    active_childrens[child.pid] = {
-                        "status": child.status(),
-                        "cpu_time": cpu_time,  
-                        "ram": ram_usage / (1024 * 1024)  
-                    }
-                self.tree_process[process.pid] = active_childrens
-            else:
-                return 
-        except:
-            pass
-        
-            
+        # O método get_childrens() atualiza a árvore inteira de descendentes do job (filhos, netos, ...)
+        # A atualização é incremental: só os pids novos são adicionados e os que terminaram são finalizados
+        if self.tree_process.update(self.sampler) is None:
+            raise psutil.NoSuchProcess(process.pid)
+        return self.tree_process
 
     def get_memory_usage(self):
-        # O método memory_info() retorna informações sobre o uso de memória do processo
-        return self.process.memory_info().rss / (1024 * 1024)
+        # Memória residente (RSS) do processo em MB
+        return self.sample().rss / (1024 * 1024)
 
-    def monitor_loop(self):
-        # O método time.time() retorna o tempo atual em segundos desde a época (epoch)
-        start_time = time.time()
-        self.proc_cpu_time = self.get_cpu_time()
+    def measure(self):
+        # CPU total (s) e memória (bytes) do job inteiro
+        # Com cgroup são duas leituras por job; sem cgroup a árvore de processos é percorrida
+        # Com --monitores a árvore é percorrida no processo monitor, e o tick usa a amostra que ele enviou
+        if self.cgroup is not None:
+            return self.cgroup.cpu_time(), self.cgroup.memory()
+        if self.shard_usage is not None:
+            return self.shard_usage[:2]
+        tree = self.get_childrens(self.process)
+        return tree.cpu, tree.rss
+
+    def start_monitoring(self):
+        # Prepara o estado de monitoramento antes do primeiro tick
+        # O time.monotonic() é utilizado porque não sofre ajustes do relógio do sistema
+        # A CPU gasta desde o lançamento entra no primeiro débito, e o backend só é usado pela thread que amostra
+        self.start_time = time.monotonic()
+        self.proc_cpu_time = 0.0
+        self.wall_clock = 0.0
+        self.cpu_total = self.proc_cpu_time
+        self.mem_rss_mb = 0.0
+        self.terminating = False
+        self.last_sample_time = self.start_time
+        self.current_interval = self.interval
+        # Cobrança do job: lease de créditos no pré-pago, acumulador em lotes no pós-pago
+        self.billing = self.make_billing()
+        self.series = SampleSeries(self.series_capacity, self.series_downsample)
+
+    def make_billing(self):
+        return CreditLease() if self.pre_pago else PostpaidAccrual()
 
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    def terminate(self, message, reason=None, overshoot=0.0):
+        # Envia o sinal de término e marca o job como encerrando
+        # O motor continua verificando o processo até ele sair de fato, sem bloquear nenhuma thread
+        self.log(f"\n[{self.process.pid}] {message}")
+        self.terminating = True
+        self.reason = reason
+        self.overshoot = overshoot
+        self.term_time = time.monotonic()
+        self.signal_tree(signal.SIGTERM)
+
+    def signal_tree(self, signum):
+        # Sinaliza o grupo do job numa única chamada; descendentes que saíram do grupo (com o próprio setsid) e,
+        # sem grupo, a raiz e os descendentes da última amostra são sinalizados um a um
+        if self.pgid is not None:
+            try:
+                os.killpg(self.pgid, signum)
+            except ProcessLookupError:
+                pass
+        else:
+            try:
+                self.process.send_signal(signum)
+            except psutil.NoSuchProcess:
+                pass
+        # Com --monitores a árvore é a do processo monitor (ver shard_pids)
+        pids = self.shard_pids if self.shard_usage is not None else list(self.tree_process.nodes)
+        for pid in pids:
+            if pid == self.process.pid:
+                continue
+            try:
+                if self.pgid is None or os.getpgid(pid) != self.pgid:
+                    os.kill(pid, signum)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+    def reap(self):
+        # Recolhe o processo sem bloquear usando wait4, que também devolve o rusage medido pelo kernel
+        # Retorna True quando o processo já terminou
+        if self.popen.returncode is not None:
+            # Lançado pelo fork server: o status e o rusage do wait4 vêm dele
+            if self.rusage is None:
+                self.rusage = getattr(self.popen, "rusage", None)
+            return True
         try:
-            while self.process.is_running():
-                wall_clock = time.time() - start_time
-                cpu_total = self.get_cpu_time()
-                cpu_time_calc = cpu_total - self.proc_cpu_time
-                self.proc_cpu_time = cpu_total
-                # O método memory_info() retorna informações sobre o uso de memória do processo
-                mem_rss_mb = self.get_memory_usage()
-                self.get_childrens(self.process)
-
-                if self.pre_pago:
-                    # Débito direto no saldo pré-pago
-                    if not CreditManagerPrePago.debit(cpu_time_calc):
-                        print(
-                            f"\n[{self.process.pid}] Créditos esgotados. Encerrando processo."
-                        )
-                        self.process.terminate()
-                        break
-                else:
-                    # Pós-pago acumula cpu usada
-                    with FMS.total_cpu_lock:
-                        FMS.total_cpu_used += cpu_time_calc
-
-                # Verifica se o tempo de execução, uso de CPU ou memória excedeu os limites
-                if wall_clock > self.limit_time:
-                    print(f"\n[{self.process.pid}] Tempo excedido.")
-                    self.process.terminate()
-                    break
+            pid, status, rusage = os.wait4(self.popen.pid, os.WNOHANG)
+        except ChildProcessError:
+            # Já foi recolhido por outro caminho (por exemplo, popen.wait())
+            return self.popen.poll() is not None
+        if pid == 0:
+            return False
+        self.popen.returncode = os.waitstatus_to_exitcode(status)
+        self.rusage = rusage
+        return True
 
-                # Verifica se o tempo de CPU individual excedeu o limite
-                if cpu_total > self.limit_cpu:
-                    print(f"\n[{self.process.pid}] CPU individual excedida.")
-                    self.process.terminate()
-                    break
+    def tick(self):
+        # O método tick() executa uma única verificação do processo
+        # Retorna o intervalo até a próxima amostra ou None quando o processo terminou
+        if self.reap():
+            self.finish()
+            return None
+        if self.terminating:
+            # Processo já recebeu o SIGTERM; passado kill_grace, o grupo inteiro recebe SIGKILL
+            # Nenhuma espera bloqueia o motor, mesmo que o processo ignore o SIGTERM
+            remaining = self.term_time + self.kill_grace - time.monotonic()
+            if remaining > 0:
+                return min(self.terminate_poll_interval, remaining)
+            if self.kill_time is None:
+                self.kill_time = time.monotonic()
+                self.log(f"[{self.process.pid}] Sem resposta ao SIGTERM em {self.kill_grace:g}s, enviando SIGKILL.")
+                self.signal_tree(signal.SIGKILL)
+            return self.terminate_poll_interval
 
-                # Verifica se o total de RAM do processo excedeu o limite
-                if mem_rss_mb > self.limit_mem:
-                    print(f"\n[{self.process.pid}] Memória excedida.")
-                    self.process.terminate()
-                    break
+        try:
+            now = time.monotonic()
+            self.wall_clock = now - self.start_time
+            # CPU e memória são somadas na árvore inteira, então netos e processos já encerrados também contam
+            cpu_total, rss = self.measure()
+            cpu_time_calc = cpu_total - self.proc_cpu_time
+            self.proc_cpu_time = cpu_total
+            self.cpu_total = cpu_total
+            mem_growth = rss / (1024 * 1024) - self.mem_rss_mb
+            self.mem_rss_mb = rss / (1024 * 1024)
+            self.mem_peak_mb = max(self.mem_peak_mb, self.mem_rss_mb)
+            if self.shard_usage is not None:
+                # O monitor faz a leitura detalhada no mesmo ritmo (memory_detail_interval) e a envia com a amostra
+                if self.shard_usage[3] is not None:
+                    self.apply_memory_detail(*self.shard_usage[3])
+            elif now >= self.next_memory_detail and self.tree_process.nodes:
+                self.memory_detail()
+            # No cgroup a árvore não é percorrida e a contagem de processos fica em zero
+            processes = self.shard_usage[2] if self.shard_usage is not None else len(self.tree_process)
+            self.series.append(self.wall_clock, cpu_total, rss, processes)
+        except psutil.NoSuchProcess:
+            # O processo terminou entre a verificação e a leitura, o próximo tick faz o fechamento
+            return self.terminate_poll_interval
+        elapsed = now - self.last_sample_time
+        self.last_sample_time = now
+        self.samples += 1
+
+        # Pré-pago debita da lease do job; pós-pago acumula a cpu usada
+        if not self.billing.debit(cpu_time_calc):
+            overshoot = cpu_time_calc - self.billing.headroom()
+            # A CPU já foi gasta: o que restar do saldo é cobrado antes do encerramento, e o saldo termina em zero
+            self.billing.drain(cpu_time_calc)
+            self.terminate("Créditos esgotados. Encerrando processo.", "creditos", overshoot)
+            return self.terminate_poll_interval
 
-                # Sleep para fazer a verificação a cada 0.5 segundos
-                time.sleep(0.5)
+        # Verifica se o tempo de execução, uso de CPU ou memória excedeu os limites
+        if self.wall_clock > self.limit_time:
+            self.terminate("Tempo excedido.", "tempo", self.wall_clock - self.limit_time)
+            return self.terminate_poll_interval
 
+        # Verifica se o tempo de CPU individual excedeu o limite
+        if cpu_total > self.limit_cpu:
+            self.terminate("CPU individual excedida.", "cpu", cpu_total - self.limit_cpu)
+            return self.terminate_poll_interval
+
+        # Verifica se o total de RAM do processo excedeu o limite
+        # Com cgroup o kernel já barrou a memória em memory.max; o OOM kill aparece em memory.events
+        mem_used = self.charged_memory_mb()
+        if mem_used > self.limit_mem or (self.cgroup is not None and self.cgroup.oom_killed()):
+            self.terminate("Memória excedida.", "memoria", max(0.0, mem_used - self.limit_mem))
+            return self.terminate_poll_interval
+
+        return self.next_interval(cpu_time_calc, mem_growth, elapsed)
+
+    def memory_detail(self):
+        # Leitura limitada por tempo, feita no tick: pico de cada processo e, com pss, PSS e USS da árvore
+        self.next_memory_detail = time.monotonic() + self.memory_detail_interval
+        self.apply_memory_detail(*self.tree_process.memory_detail(self.sampler, self.pss))
+
+    def apply_memory_detail(self, hwm, pss, uss):
+        # Resultado da leitura detalhada, feita aqui ou no processo monitor (com --monitores)
+        # O pico da árvore nunca é menor que o pico de um único processo, então o VmHWM também corrige mem_peak_mb
+        self.mem_hwm_mb = max(self.mem_hwm_mb, hwm / (1024 * 1024))
+        self.mem_peak_mb = max(self.mem_peak_mb, self.mem_hwm_mb)
+        if self.pss:
+            self.mem_pss_mb = pss / (1024 * 1024)
+            self.mem_uss_mb = uss / (1024 * 1024)
+            self.mem_peak_pss_mb = max(self.mem_peak_pss_mb or 0.0, self.mem_pss_mb)
+            self.pss_base_rss_mb = self.mem_rss_mb
+
+    def charged_memory_mb(self):
+        # Memória comparada com limit_mem: a RSS da árvore ou, com pss, a PSS da última leitura mais o que a RSS
+        # cresceu desde então (o crescimento entre duas leituras não fica sem controle)
+        if self.mem_pss_mb is None:
+            return self.mem_rss_mb
+        return self.mem_pss_mb + max(0.0, self.mem_rss_mb - self.pss_base_rss_mb)
+
+    def next_interval(self, cpu_delta, mem_growth, elapsed):
+        # Calcula o intervalo até a próxima amostra a partir do ritmo observado desde a última
+        # Quando algum limite é previsto para dentro do intervalo atual, amostra mais rápido;
+        # jobs ociosos recuam gradualmente até max_interval
+        if not self.adaptive_interval:
+            return self.interval
+        if self.samples <= 1:
+            # A primeira amostra é feita no registro, logo depois do lançamento: uma janela de milissegundos não diz
+            # nada sobre o ritmo do job, e recuar a partir dela deixaria um job ocupado sem amostra por um intervalo
+            # e meio
+            return self.current_interval
+        elapsed = max(elapsed, 1e-3)
+        cpu_rate = cpu_delta / elapsed
+        mem_rate = mem_growth / elapsed
+
+        # Tempo previsto até cada limite (o de relógio é exato)
+        time_left = self.limit_time - self.wall_clock
+        horizons = [time_left]
+        if cpu_rate > 0:
+            horizons.append((self.limit_cpu - self.cpu_total) / cpu_rate)
+            if self.pre_pago:
+                horizons.append(self.billing.headroom() / cpu_rate)
+        if mem_rate > 0:
+            horizons.append((self.limit_mem - self.charged_memory_mb()) / mem_rate)
+        horizon = min(horizons)
+
+        if cpu_rate < 0.01 and mem_rate <= 0:
+            # Job ocioso: recua a partir do intervalo atual
+            interval = self.current_interval * self.interval_backoff
+        else:
+            interval = min(horizon * self.interval_safety, self.current_interval * self.interval_backoff)
+        # O limite de relógio é conhecido com exatidão: a amostra cai logo depois dele
+        if 0 < time_left < interval:
+            interval = time_left + self.min_interval
+        interval = min(self.max_interval, max(self.min_interval, interval))
+        self.current_interval = interval
+        return interval
+
+    def finish(self):
         # Printa as informações do processo após o término
-        finally:
-            self.process.wait()
+        # O reap() já recolheu o processo, então nenhuma espera bloqueante é necessária
+        self.end_time = time.monotonic()
+        self.wall_clock = self.end_time - self.start_time
+        if self.terminating:
+            # A raiz saiu; o que restou do grupo é morto sem esperar o prazo, para liberar memória e CPU já
+            self.signal_tree(signal.SIGKILL)
+            self.kill_latency = self.end_time - self.term_time
+        kernel_reason = self.kernel_exit_reason()
+        self.settle()
+        self.billing.close()
+        self.release_cpus()
+        # O ru_maxrss do wait4 (em KB no Linux) é o pico da raiz e dos descendentes que ela recolheu, mas inclui a
+        # imagem de quem lançou o job antes do exec (o kernel guarda o pico da memória do fork/vfork); só um valor
+        # acima do pico do próprio lançador vem com certeza do job. Com o fork server o lançador é pequeno; lançado
+        # pelo FMS, um job curto fica só com as amostras e o limite superior (peak_rss_bound_mb no resultado)
+        maxrss = getattr(self.rusage, "ru_maxrss", None)
+        if maxrss and maxrss > self.launcher_maxrss:
+            self.mem_hwm_mb = max(self.mem_hwm_mb, maxrss / 1024)
+            self.mem_peak_mb = max(self.mem_peak_mb, self.mem_hwm_mb)
+        elif maxrss:
+            self.maxrss_bound_mb = maxrss / 1024
+            self.log(
+                f"[{self.process.pid}] Pico do kernel descartado: inclui a imagem do lançador "
+                f"({self.launcher_maxrss / 1024:.2f} MB); pico do job <= {self.maxrss_bound_mb:.2f} MB."
+            )
+        if kernel_reason:
+            message, self.reason = kernel_reason
+            self.log(f"\n[{self.process.pid}] {message}")
+        if self.verbose:
             print(f"\n[{self.process.pid}] Processo encerrado.")
+            summary = self.series.summary()
             print(
-                f"[{self.process.pid}] T: {wall_clock:.1f}s | CPU: {cpu_total:.2f}s | "
-                f"RAM: {mem_rss_mb:.2f} MB"
+                f"[{self.process.pid}] T: {self.wall_clock:.1f}s | CPU: {self.cpu_total:.2f}s | "
+                f"RAM: {self.mem_rss_mb:.2f} MB (pico {self.peak_label()}, "
+                f"média {summary['rss_mean'] / (1024 * 1024):.2f} MB, p95 {summary['rss_p95'] / (1024 * 1024):.2f} MB)"
             )
-            for key in self.tree_process:
-                for element in self.tree_process[key]:
-                    print(f"  ﹂[{element}] T: {wall_clock:.1f}s | CPU: {self.tree_process[key][element]['cpu_time']:.2f}s |"
-                          f" RAM: {self.tree_process[key][element]['ram']:.2f} MB"                         
-                          )
+            if self.mem_pss_mb is not None:
+                print(
+                    f"[{self.process.pid}] PSS: {self.mem_pss_mb:.2f} MB (pico {self.mem_peak_pss_mb:.2f} MB) | "
+                    f"USS: {self.mem_uss_mb:.2f} MB"
+                )
+            if self.cpus is not None:
+                print(f"[{self.process.pid}] Núcleos: {self.cpus} (nó NUMA {', '.join(map(str, self.numa_nodes))})")
+            # Descendentes que ainda estavam vivos na última amostra
+            for pid, sample in self.tree_process.nodes.items():
+                print(f"  ﹂[{pid}] T: {self.wall_clock:.1f}s | CPU: {sample.cpu + sample.children_cpu:.2f}s |"
+                      f" RAM: {sample.rss / (1024 * 1024):.2f} MB"
+                      )
+            if self.tree_process.exited:
+                print(f"  ﹂{self.tree_process.exited} processo(s) da árvore já encerrado(s)")
             if self.pre_pago:
                 print(f"Créditos restantes: R${CreditManagerPrePago.get_balance():.2f}")
+        # Libera os recursos do backend (descritores abertos) de todos os pids do job
+        self.tree_process.forget(self.sampler)
+        for callback in self.on_finish:
+            callback(self)
+
+    def peak_known(self):
+        # Sem amostra útil (nenhuma, ou só a de um processo já saindo) e com o ru_maxrss descartado, o pico do job não
+        # foi medido, e não é zero
+        return round(self.mem_peak_mb, 2) > 0 or self.maxrss_bound_mb is None
+
+    def peak_label(self):
+        if self.peak_known():
+            return f"{self.mem_peak_mb:.2f} MB"
+        return f"<= {self.maxrss_bound_mb:.2f} MB"
+
+    def result(self):
+        # Registro final do job, no formato gravado pelo modo batch (uma linha JSON por job)
+        summary = self.series.summary() if self.series is not None else {"rss_mean": 0.0, "rss_p95": 0.0}
+        hwm = round(self.mem_hwm_mb, 2)
+        return {
+            "pid": self.process.pid,
+            "command": self.command,
+            "wall_time": round(self.wall_clock, 4),
+            "cpu_time": round(self.cpu_total, 4),
+            "peak_rss_mb": round(self.mem_peak_mb, 2) if self.peak_known() else None,
+            "peak_rss_bound_mb": round(self.maxrss_bound_mb, 2) if self.maxrss_bound_mb is not None else None,
+            "mean_rss_mb": round(summary["rss_mean"] / (1024 * 1024), 2),
+            "p95_rss_mb": round(summary["rss_p95"] / (1024 * 1024), 2),
+            "hwm_rss_mb": hwm if hwm or self.maxrss_bound_mb is None else None,
+            "pss_mb": round(self.mem_pss_mb, 2) if self.mem_pss_mb is not None else None,
+            "peak_pss_mb": round(self.mem_peak_pss_mb, 2) if self.mem_peak_pss_mb is not None else None,
+            "uss_mb": round(self.mem_uss_mb, 2) if self.mem_uss_mb is not None else None,
+            "exit_status": self.popen.returncode,
+            "kill_reason": self.reason,
+            "placement": {"cpus": self.cpus, "numa_nodes": self.numa_nodes} if self.cpus is not None else None,
+            "kill_latency_s": round(self.kill_latency, 4) if self.kill_latency is not None else None,
+        }
+
+    def final_cpu(self):
+        # CPU total do job depois do término, ou None quando não há medida melhor que a última amostra
+        if self.cgroup is not None:
+            # O cgroup contabiliza também os descendentes órfãos; os que sobraram são mortos junto com o cgroup
+            cpu_total = self.cgroup.cpu_time()
+            self.mem_peak_mb = max(self.mem_peak_mb, self.cgroup.memory_peak() / (1024 * 1024))
+            self.cgroup.kill()
+            if not self.cgroup.remove():
+                self.cgroups.stale.append(self.cgroup)
+            return cpu_total
+        if self.rusage is None:
+            return None
+        cpu_total = self.tree_process.close(self.rusage.ru_utime + self.rusage.ru_stime, self.sampler)
+        # Com --monitores a árvore local fica vazia: o que o monitor já mediu dos órfãos não é devolvido
+        return max(cpu_total, self.proc_cpu_time) if self.shard_usage is not None else cpu_total
+
+    def settle(self):
+        # Acerto final: a CPU da raiz vem do rusage do wait4 (exato, inclui os descendentes recolhidos por ela)
+        # e a diferença desde a última amostra é cobrada no modo pré-pago ou pós-pago
+        cpu_total = self.final_cpu()
+        if cpu_total is None:
+            return
+        cpu_time_calc = cpu_total - self.proc_cpu_time
+        self.proc_cpu_time = self.cpu_total = cpu_total
+        self.billing.drain(cpu_time_calc)
+
+    def abort(self, reason="erro"):
+        # Encerra um job cujo monitoramento falhou: mata o processo, fecha a cobrança e avisa os interessados
+        self.reason = self.reason or reason
+        try:
+            self.signal_tree(signal.SIGKILL)
+        except psutil.Error:
+            pass
+        # A raiz é recolhida para não ficar zumbi e o resultado trazer o status de saída
+        self.reap_killed()
+        self.billing.close()
+        self.release_cpus()
+        if self.tree_process is not None:
+            self.tree_process.forget(self.sampler)
+        for callback in self.on_finish:
+            callback(self)
+
+    def reap_killed(self, timeout=1.0):
+        # Espera a raiz que recebeu SIGKILL ser recolhida, no máximo timeout segundos
+        deadline = time.monotonic() + timeout
+        while not self.reap():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def monitor_loop(self):
+        # Laço bloqueante de monitoramento de um único processo
+        # Mantido para uso isolado (por exemplo, comparação nos benchmarks); o FMS interativo usa o SamplerEngine
+        # Como no motor, cada tick começa uma varredura nova, senão o mapa de ppid do backend não seria mais relido e os
+        # descendentes criados depois da primeira amostra ficariam de fora
+        self.start_monitoring()
+        while True:
+            self.sampler.begin_sweep()
+            interval = self.tick()
+            if interval is None:
+                break
+            time.sleep(interval)
 
-    # Inicia o processo e a thread de monitoramento
-    # O método threading.Thread é utilizado para criar uma nova thread
-    # O parâmetro daemon=True indica que a thread deve ser encerrada quando o programa principal terminar e rodar em segundo plano
-    def start_process_in_thread(self, command):
+    # Inicia o processo e registra o job no motor de amostragem compartilhado
+    # Antes cada job tinha a sua própria thread de monitoramento; agora uma única thread amostra todos
+    def start_process(self, command, engine=None):
+        engine = engine or SamplerEngine.default()
+        if self.sampler is None:
+            self.sampler = engine.sampler
         self.launch_process(command)
-        thread = threading.Thread(target=self.monitor_loop, daemon=True)
-        thread.start()
+        self.start_monitoring()
+        engine.add(self)
+
+    # Nome antigo mantido para compatibilidade
+    start_process_in_thread = start_process
+
+
+class SamplerEngine:
+    # O SamplerEngine é o motor único de amostragem: uma thread é dona de todos os jobs em execução
+    # Os jobs ficam em um heap ordenado pelo prazo da próxima amostra, e cada varredura atende todos os jobs vencidos
+    # O término dos processos é notificado por pidfd (os.pidfd_open) em um selector, sem esperar o próximo tick;
+    # onde pidfd não existe, o término é percebido pelo próprio tick (polling)
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, jitter_window=10000, sampler=None, use_pidfd=True, shards=None):
+        # Backend de amostragem compartilhado por todos os jobs do motor (usado só pela thread do motor)
+        self.sampler = sampler or default_sampler()
+        # Com um ShardPool (ver sharded.py) as amostras vêm dos processos monitores e o heap fica vazio
+        self.shards = shards
+        self.use_pidfd = use_pidfd and hasattr(os, "pidfd_open")
+        self.heap = []
+        self.jobs = {}
+        self.pending = []
+        # Jobs com cancelamento pedido por outra thread; o SIGTERM é enviado pela thread do motor
+        self.cancels = []
+        self.seq = itertools.count()
+        self.lock = threading.Lock()
+        # O selector espera ao mesmo tempo pelo prazo da próxima amostra, pelo término dos processos (pidfd)
+        # e pelo pipe de despertar, usado quando um job novo é registrado por outra thread
+        self.selector = selectors.DefaultSelector()
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        os.set_blocking(self.wake_w, False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ, None)
+        self.shard_fds = {}
+        for shard in shards.shards if shards is not None else ():
+            self.shard_fds[shard.fileno()] = shard
+            self.selector.register(shard.fileno(), selectors.EVENT_READ, shard)
+        self.pidfds = {}
+        self.thread = None
+        # Estatísticas do próprio FMS: amostras feitas, atraso (jitter) e tempo de CPU da thread do motor
+        self.samples = 0
+        self.sweeps = 0
+        self.exit_events = 0
+        self.jitters = deque(maxlen=jitter_window)
+        self.cpu_time = 0.0
+        # Histogramas e contadores lidos pelo endpoint de métricas (ver metrics.py); só a thread do motor escreve
+        self.tick_latency = Histogram()
+        self.delay_latency = Histogram()
+        self.kills = {}
+        # Do SIGTERM até a raiz ser recolhida e o resto do grupo receber SIGKILL (inclui o kill_grace)
+        self.kill_latency = Histogram(LATENCY_BUCKETS + (2.5, 5.0, 10.0, 30.0))
+        # Bytes de saída capturada lidos por stream a cada volta do laço (ver output.py)
+        self.output_budget = 2 ** 20
+        self.output_bytes = 0
+        # Pipes fora do selector enquanto a fila do LogWriter está cheia
+        self.paused_output = []
+        # Núcleos em que a thread do motor roda (ver pin()); None deixa a afinidade do processo
+        self.cpus = None
+
+    @classmethod
+    def default(cls):
+        # Motor compartilhado por todos os FMS do programa, criado na primeira utilização
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    def add(self, fms):
+        # Registra um job já lançado; a primeira amostra é feita logo no registro, antes que um job curto termine
+        with self.lock:
+            self.jobs[fms.process.pid] = fms
+            self.pending.append(fms)
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="FMS-SamplerEngine", daemon=True
+                )
+                self.thread.start()
+        self.wake()
+
+    def cancel(self, fms):
+        # Pede o encerramento de um job em execução; o motor o encerra como nos limites (SIGTERM e, passado
+        # kill_grace, SIGKILL) e o job termina com reason "cancelado"
+        with self.lock:
+            if fms.process is None or fms.process.pid not in self.jobs:
+                return False
+            self.cancels.append(fms)
+        self.wake()
+        return True
+
+    def pin(self, cpus):
+        # Fixa a thread do motor nos núcleos dados, já em execução ou quando ela for criada
+        with self.lock:
+            self.cpus = set(cpus)
+            if self.thread is not None:
+                os.sched_setaffinity(self.thread.native_id, self.cpus)
+
+    def wake(self):
+        try:
+            os.write(self.wake_w, b"\0")
+        except BlockingIOError:
+            # O pipe já está cheio, então a thread do motor já vai acordar
+            pass
+
+    def active_jobs(self):
+        with self.lock:
+            return len(self.jobs)
+
+    def job(self, pid):
+        # Job em execução com a raiz pid, ou None; para consultas de outras threads (o dicionário é da thread do motor)
+        with self.lock:
+            return self.jobs.get(pid)
+
+    def watch_exit(self, fms):
+        # Abre o pidfd do processo (ver FMS.exit_fd()) e o registra no selector; sem suporte, o job segue só com o
+        # polling do tick
+        if not self.use_pidfd:
+            return
+        try:
+            pidfd = fms.exit_fd()
+        except OSError:
+            return
+        self.pidfds[fms.process.pid] = pidfd
+        self.selector.register(pidfd, selectors.EVENT_READ, fms)
+
+    def unwatch_exit(self, fms):
+        pidfd = self.pidfds.pop(fms.process.pid, None)
+        if pidfd is not None:
+            self.selector.unregister(pidfd)
+            os.close(pidfd)
+
+    def watch_output(self, fms):
+        # Os pipes de saída do job entram no mesmo selector das notificações de término
+        if fms.output is None:
+            return
+        for stream in fms.output.open_streams():
+            self.selector.register(stream.fd, selectors.EVENT_READ, (fms, stream))
+
+    def drain_output(self, fms, stream):
+        if stream.closed:
+            return
+        before = fms.output.total
+        if not fms.output.drain(stream, self.output_budget):
+            self.selector.unregister(stream.fd)
+            fms.output.close_stream(stream)
+        elif fms.output.paused():
+            # Fila de gravação cheia: o pipe sai do selector até a fila baixar, e o job espera com o pipe cheio
+            self.selector.unregister(stream.fd)
+            self.paused_output.append((fms, stream))
+        self.output_bytes += fms.output.total - before
+
+    def resume_output(self):
+        paused, self.paused_output = self.paused_output, []
+        for fms, stream in paused:
+            if not stream.closed:
+                self.selector.register(stream.fd, selectors.EVENT_READ, (fms, stream))
+
+    def unwatch_output(self, fms):
+        if fms.output is None:
+            return
+        paused = [stream for job, stream in self.paused_output if job is fms]
+        if paused:
+            self.paused_output = [(job, stream) for job, stream in self.paused_output if job is not fms]
+        for stream in fms.output.open_streams():
+            if stream not in paused:
+                self.selector.unregister(stream.fd)
+        before = fms.output.total
+        fms.output.close()
+        self.output_bytes += fms.output.total - before
+
+    def run(self):
+        # Laço principal: espera pelo prazo mais próximo ou por um evento, e então atende os jobs vencidos ou encerrados
+        with self.lock:
+            if self.cpus is not None:
+                os.sched_setaffinity(0, self.cpus)
+        while True:
+            with self.lock:
+                timeout = self.heap[0][0] - time.monotonic() if self.heap else None
+            # Com pipes pausados o laço acorda a cada 10 ms para ver se a fila de gravação já baixou
+            if self.paused_output:
+                timeout = 0.01 if timeout is None else min(timeout, 0.01)
+            exited = []
+            readable = []
+            reports = []
+            for key, _ in self.selector.select(None if timeout is None else max(timeout, 0)):
+                if key.data is None:
+                    try:
+                        while os.read(self.wake_r, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif key.fd in self.shard_fds:
+                    reports.append(key.data)
+                elif isinstance(key.data, tuple):
+                    readable.append(key.data)
+                else:
+                    exited.append(key.data)
+            now = time.monotonic()
+            with self.lock:
+                pending, self.pending = self.pending, []
+                cancels, self.cancels = self.cancels, []
+                for fms in pending:
+                    # Com cgroup o tick lê os contadores do cgroup, sem percorrer a árvore
+                    sharded = self.shards is not None and fms.cgroup is None and self.shards.add(fms)
+                    if not sharded:
+                        heapq.heappush(self.heap, (now, next(self.seq), fms))
+                due = []
+                while self.heap and self.heap[0][0] <= now:
+                    due.append(heapq.heappop(self.heap))
+            for fms in pending:
+                self.watch_exit(fms)
+                self.watch_output(fms)
+            for fms in cancels:
+                if not fms.done and not fms.terminating:
+                    fms.terminate("Cancelado.", "cancelado")
+            if due or exited:
+                self.sweep(due, exited)
+            for shard in reports:
+                self.sweep_shard(shard)
+            if self.shards is not None:
+                self.shards.flush()
+            # A saída é drenada depois das amostras vencidas, no máximo output_budget bytes por stream
+            for fms, stream in readable:
+                self.drain_output(fms, stream)
+            if self.paused_output and self.paused_output[0][0].output.ready():
+                self.resume_output()
+
+    def sweep(self, due, exited=()):
+        cpu_start = time.thread_time()
+        self.sampler.begin_sweep()
+        reschedule = []
+        finished = []
+        # Jobs cujo pidfd sinalizou o término são fechados imediatamente; a entrada deles no heap é descartada depois
+        for fms in exited:
+            self.exit_events += 1
+            self.run_tick(fms, finished)
+        for deadline, _, fms in due:
+            if fms.done:
+                continue
+            # O atraso é medido no momento em que o job é de fato amostrado, não no início da varredura
+            now = time.monotonic()
+            self.jitters.append(now - deadline)
+            self.delay_latency.observe(now - deadline)
+            interval = self.run_tick(fms, finished)
+            self.samples += 1
+            if interval is None:
+                continue
+            # Mantém a cadência pelo prazo; se o motor atrasou mais que um intervalo, reagenda a partir de agora
+            next_deadline = deadline + interval
+            if next_deadline <= now:
+                next_deadline = now + interval
+            reschedule.append((next_deadline, fms))
+        self.retire(finished)
+        with self.lock:
+            for next_deadline, fms in reschedule:
+                heapq.heappush(self.heap, (next_deadline, next(self.seq), fms))
+            for fms in finished:
+                self.jobs.pop(fms.process.pid, None)
+            self.sweeps += 1
+        self.cpu_time += time.thread_time() - cpu_start
+
+    def sweep_shard(self, shard):
+        # Relatório de um processo monitor: o tick de cada job usa a CPU e a RSS medidas lá (ver FMS.measure()),
+        # e o próximo intervalo volta para o monitor no flush do fim da volta do laço
+        cpu_start = time.thread_time()
+        report = self.shards.receive(shard)
+        if report is None:
+            self.shard_lost(shard)
+            return
+        finished = []
+        for pid, cpu, rss, processes, late, detail, pids in report:
+            with self.lock:
+                fms = self.jobs.get(pid)
+            if fms is None or fms.done:
+                continue
+            fms.shard_usage = (cpu, rss, processes, detail)
+            if pids is not None:
+                fms.shard_pids = pids
+            self.jitters.append(late)
+            self.delay_latency.observe(late)
+            interval = self.run_tick(fms, finished)
+            self.samples += 1
+            if interval is not None:
+                self.shards.schedule(fms, interval)
+        self.retire(finished)
+        with self.lock:
+            for fms in finished:
+                self.jobs.pop(fms.process.pid, None)
+            self.sweeps += 1
+        self.cpu_time += time.thread_time() - cpu_start
+
+    def shard_lost(self, shard):
+        # Monitor morto: os jobs dele passam a ser amostrados aqui, a partir da CPU já cobrada (a árvore local não
+        # conhece os descendentes que já saíram)
+        self.selector.unregister(shard.fileno())
+        del self.shard_fds[shard.fileno()]
+        now = time.monotonic()
+        with self.lock:
+            for pid in self.shards.drop(shard):
+                fms = self.jobs.get(pid)
+                if fms is None or fms.done:
+                    continue
+                fms.tree_process.cpu = fms.proc_cpu_time
+                fms.shard_usage = None
+                fms.shard_pids = ()
+                heapq.heappush(self.heap, (now, next(self.seq), fms))
+
+    def retire(self, finished):
+        # Libera o que o motor mantinha para os jobs encerrados numa varredura
+        for fms in finished:
+            self.unwatch_exit(fms)
+            self.unwatch_output(fms)
+            if self.shards is not None:
+                self.shards.remove(fms)
+            if fms.reason:
+                self.kills[fms.reason] = self.kills.get(fms.reason, 0) + 1
+            if fms.kill_latency is not None:
+                self.kill_latency.observe(fms.kill_latency)
+
+    def run_tick(self, fms, finished):
+        start = time.perf_counter()
+        try:
+            interval = fms.tick()
+        except Exception as e:
+            # Um erro em um job não pode derrubar o motor dos demais; o processo é morto para não ficar sem controle
+            print(f"\n[{fms.process.pid}] Erro no monitoramento: {e}")
+            interval = None
+            fms.abort()
+        self.tick_latency.observe(time.perf_counter() - start)
+        if interval is None:
+            fms.done = True
+            finished.append(fms)
+        return interval
+
+    def stats(self):
+        # Resumo das estatísticas do motor: CPU própria e atraso das amostras em relação ao prazo
+        jitters = sorted(self.jitters)
+        def pct(p):
+            if not jitters:
+                return 0.0
+            return jitters[min(len(jitters) - 1, int(p * len(jitters)))]
+        return {
+            "jobs": self.active_jobs(),
+            "samples": self.samples,
+            "sweeps": self.sweeps,
+            "exit_events": self.exit_events,
+            "cpu_time": self.cpu_time,
+            "jitter_p50": pct(0.50),
+            "jitter_p99": pct(0.99),
+            "jitter_max": jitters[-1] if jitters else 0.0,
+            "monitors": len(self.shards) if self.shards is not None else 0,
+            "monitor_cpu_time": self.shards.worker_cpu if self.shards is not None else 0.0,
+        }
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FMS - lança e monitora programas com limites de CPU, memória e tempo")
+    parser.add_argument(
+        "--rlimit", action="store_true",
+        help="aplica RLIMIT_CPU/RLIMIT_AS/RLIMIT_DATA no filho para o kernel fazer valer os limites",
+    )
+    parser.add_argument("--batch", metavar="JOBS.jsonl", help="executa os jobs do manifesto JSONL sem prompt")
+    parser.add_argument("--concorrencia", type=int, help="máximo de jobs simultâneos nos modos batch e daemon com --fila (padrão: núcleos)")
+    parser.add_argument("--saida", metavar="RESULTADOS.jsonl", help="arquivo de resultados do modo batch")
+    parser.add_argument("--creditos", type=float, help="créditos pré-pagos de CPU para os modos batch e daemon")
+    parser.add_argument(
+        "--ledger", metavar="ARQUIVO",
+        help="registra créditos e uso em disco e restaura o saldo e a CPU pós-paga ao iniciar",
+    )
+    parser.add_argument(
+        "--metricas", type=int, metavar="PORTA",
+        help="expõe as métricas do FMS no formato Prometheus em http://127.0.0.1:PORTA/metrics",
+    )
+    parser.add_argument("--logs", metavar="DIR", help="grava stdout e stderr de cada job em DIR/<pid>.out.log e .err.log")
+    parser.add_argument("--logs-rotacao", type=float, metavar="MB", help="rotaciona cada log ao passar de MB")
+    parser.add_argument("--logs-gzip", action="store_true", help="grava os logs comprimidos com gzip")
+    parser.add_argument(
+        "--fila", action="store_true",
+        help="põe os jobs numa fila que só os lança quando cabem na memória livre, nos créditos e nos núcleos",
+    )
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="cronometra os caminhos quentes do FMS e imprime o resumo ao sair e a cada SIGUSR1",
+    )
+    parser.add_argument(
+        "--afinidade", type=int, nargs="?", const=1, metavar="NUCLEOS",
+        help="fixa cada job em NUCLEOS núcleos (padrão 1), distribuindo os jobs entre núcleos e nós NUMA",
+    )
+    parser.add_argument(
+        "--nucleo-fms", action="store_true",
+        help="reserva um núcleo só para o motor do FMS; nenhum job roda nele",
+    )
+    parser.add_argument(
+        "--fork-server", action="store_true",
+        help="lança os jobs a partir de um processo auxiliar pequeno em vez do próprio FMS",
+    )
+    parser.add_argument(
+        "--pool-python", type=int, default=0, metavar="N",
+        help="com --fork-server, mantém N interpretadores Python prontos para jobs 'python script.py'",
+    )
+    parser.add_argument(
+        "--precarregar", nargs="+", default=[], metavar="MODULO",
+        help="módulos importados pelos interpretadores do --pool-python",
+    )
+    parser.add_argument(
+        "--prazo-sigkill", type=float, metavar="S",
+        help=f"segundos entre o SIGTERM e o SIGKILL do grupo do job (padrão {FMS.kill_grace:g})",
+    )
+    parser.add_argument(
+        "--pss", action="store_true",
+        help="mede PSS e USS (smaps_rollup) e aplica o limite de memória sobre a PSS, justo com servidores que fazem fork",
+    )
+    parser.add_argument(
+        "--intervalo-memoria", type=float, metavar="S",
+        help=f"intervalo mínimo entre leituras de pico/PSS de cada job (padrão {FMS.memory_detail_interval:g})",
+    )
+    parser.add_argument(
+        "--daemon", nargs="?", const="", metavar="SOCKET",
+        help="fica residente e recebe jobs pelo socket Unix SOCKET (padrão: FMS_SOCKET ou o runtime do usuário); "
+        "use fmsctl.py como cliente",
+    )
+    parser.add_argument(
+        "--coordenador", metavar="[HOST:]PORTA",
+        help="com --batch, distribui os jobs entre agentes conectados nesta porta e mantém o ledger central",
+    )
+    parser.add_argument("--agentes", type=int, default=1, help="agentes esperados pelo coordenador antes de começar")
+    parser.add_argument(
+        "--agente", metavar="HOST:PORTA",
+        help="roda como agente de um coordenador; --concorrencia define as vagas (padrão: núcleos)",
+    )
+    parser.add_argument(
+        "--eventos-processos", action="store_true",
+        help="descobre os descendentes pelos eventos de fork/exit do kernel em vez de varrer todos os processos",
+    )
+    parser.add_argument(
+        "--monitores", type=int, metavar="N",
+        help="divide a leitura do /proc dos jobs entre N processos monitores; cobrança e limites seguem neste processo "
+        "(com N > 1, use junto com --eventos-processos)",
+    )
+    args = parser.parse_args()
+    # O fork server é iniciado antes das demais threads do FMS
+    if args.fork_server:
+        from forkserver import ForkServer
+        FMS.forkserver = ForkServer(args.pool_python, args.precarregar)
+    if args.eventos_processos:
+        from proc_connector import children_tracker
+        ProcSampler.tracker = children_tracker()
+        name = ProcSampler.tracker.name if ProcSampler.tracker is not None else "varredura de ppid"
+        print(f"Rastreamento de processos: {name}", file=sys.stderr)
+    if args.monitores:
+        from sharded import ShardPool
+        tracker = ProcSampler.tracker.name if ProcSampler.tracker is not None else None
+        try:
+            SamplerEngine._default = SamplerEngine(shards=ShardPool(args.monitores, tracker))
+        except ValueError as e:
+            parser.error(str(e))
+    FMS.use_rlimits = args.rlimit
+    if args.prazo_sigkill is not None:
+        FMS.kill_grace = args.prazo_sigkill
+    FMS.pss = args.pss
+    if args.intervalo_memoria is not None:
+        FMS.memory_detail_interval = args.intervalo_memoria
+    FMS.cgroups = CgroupV2.detect()
+    if args.ledger:
+        FMS.open_ledger(args.ledger)
+    if args.logs:
+        FMS.log_dir = args.logs
+        FMS.log_compress = args.logs_gzip
+        if args.logs_rotacao:
+            FMS.log_max_bytes = int(args.logs_rotacao * 1024 * 1024)
+
+    if args.afinidade is not None or args.nucleo_fms:
+        from placement import CpuPlacement
+        try:
+            FMS.placement = CpuPlacement(args.afinidade, reserve=args.nucleo_fms)
+        except ValueError as e:
+            print(f"Afinidade desativada: {e}", file=sys.stderr)
+        else:
+            FMS.placement.pin_engine(SamplerEngine.default())
+            if FMS.placement.reserved is not None:
+                print(f"Núcleo {FMS.placement.reserved} reservado para o FMS", file=sys.stderr)
+
+    # Os módulos auxiliares fazem "import main"; o alias garante que usem as mesmas classes deste script
+    sys.modules.setdefault("main", sys.modules[__name__])
+
+    if args.profile:
+        from profiler import Profiler
+        Profiler().install(SamplerEngine.default()).enable_dump()
+
+    queue = None
+    if args.fila:
+        from scheduler import JobQueue
+        queue = JobQueue().start()
+
+    if args.metricas is not None:
+        from metrics import MetricsServer
+        metrics = MetricsServer(SamplerEngine.default(), args.metricas, queue=queue).start()
+        print(f"Métricas em http://127.0.0.1:{metrics.port}/metrics", file=sys.stderr)
+
+    if args.agente:
+        from cluster import parse_address, run_agent
+        if args.ledger:
+            print("O ledger fica no coordenador; --ledger ignorado no agente", file=sys.stderr)
+        try:
+            run_agent(parse_address(args.agente), args.concorrencia)
+        except OSError as e:
+            print(f"Coordenador indisponível: {e}", file=sys.stderr)
+            sys.exit(1)
+        sys.exit(0)
+
+    if args.coordenador:
+        from cluster import Coordinator, parse_address, run_cluster_batch
+        if not args.batch:
+            parser.error("--coordenador precisa de --batch")
+        coordinator = Coordinator(*parse_address(args.coordenador)).start()
+        run_cluster_batch(args.batch, coordinator, args.saida, args.creditos, args.agentes)
+        coordinator.close()
+        sys.exit(0)
+
+    if args.batch:
+        from batch import run_batch
+        run_batch(args.batch, args.saida, args.concorrencia, args.creditos, queue)
+        sys.exit(0)
+
+    if args.daemon is not None:
+        from daemon import serve
+        if args.creditos is not None:
+            CreditManagerPrePago.set_total(args.creditos)
+        if queue is not None and args.concorrencia:
+            queue.max_running = args.concorrencia
+        try:
+            serve(args.daemon or None, queue)
+        except OSError as e:
+            print(f"Daemon não iniciado: {e}", file=sys.stderr)
+            sys.exit(1)
+        sys.exit(0)
+
     print("=== FMS MULTI ===")
     # Instancia o PromptSession para coletar entradas do usuário
     # O PromptSession é uma classe do prompt_toolkit que fornece uma interface para criar sessões de prompt interativas
     session = PromptSession()
 
+    # Execução em cgroup v2 quando há uma subárvore delegada em FMS_CGROUP_ROOT
+    if FMS.cgroups is not None:
+        print(f"cgroup v2 ativo em {FMS.cgroups.root}")
+
     # O método patch_stdout() é utilizado para garantir que a saída padrão seja exibida corretamente
     # Isso é importante para evitar que a saída do programa seja misturada com o prompt
     with patch_stdout():
@@ -191,11 +1453,19 @@ if __name__ == "__main__":
             exit()
 
         # Se o modo for pré-pago, solicita o valor inicial de créditos
+        # Com o ledger, Enter mantém o saldo restaurado
         if modo == "pre-pago":
             try:
-                CreditManagerPrePago.set_total(
-                    float(session.prompt("Créditos de CPU disponíveis (s): R$"))
-                )
+                if FMS.ledger is not None:
+                    saldo = session.prompt(
+                        f"Créditos de CPU disponíveis (s, Enter mantém R${CreditManagerPrePago.get_balance():.2f}): R$"
+                    ).strip()
+                    if saldo:
+                        CreditManagerPrePago.set_total(float(saldo))
+                else:
+                    CreditManagerPrePago.set_total(
+                        float(session.prompt("Créditos de CPU disponíveis (s): R$"))
+                    )
             except ValueError:
                 print("Valor inválido. Encerrando.")
                 exit()
@@ -204,14 +1474,32 @@ if __name__ == "__main__":
         # O loop while True é utilizado para manter o programa em execução até que o usuário decida sair
         while True:
             try:
-                caminho = session.prompt("\nCaminho do binário (ou 'sair'): ").strip()
+                caminho = session.prompt("\nCaminho do binário (ou 'sair', 'tail <pid>'): ").strip()
                 if caminho.lower() == "sair":
                     break
+                # Mostra as últimas linhas da saída capturada de um job em execução (com --logs)
+                if caminho.startswith("tail "):
+                    job = SamplerEngine.default().job(int(caminho.split()[1]))
+                    if job is None:
+                        print("Job não está em execução.")
+                    elif job.output is None:
+                        print("Saída do job não está sendo capturada (use --logs).")
+                    else:
+                        print(job.output.tail(4096).decode(errors="replace"))
+                    continue
 
                 fms = FMS(pre_pago=(modo == "pre-pago"))
                 fms.get_params(session)
                 command = caminho.split()
-                fms.start_process_in_thread(command)
+                if queue is not None:
+                    fms.command = command
+                    job = queue.submit(
+                        fms, command, submitter="interativo",
+                        on_reject=lambda fms, motivo: print(f"\nJob {' '.join(fms.command)} recusado: {motivo}"),
+                    )
+                    print(f"Job na fila (posição {queue.position(job)}).")
+                else:
+                    fms.start_process(command)
 
             except ValueError:
                 print("Entrada inválida. Tente novamente.")
@@ -221,8 +1509,8 @@ if __name__ == "__main__":
         
         # Se o modo for pós-pago, cobra o total de CPU usado
         if modo == "pos-pago":
-            # Ao sair, cobrar o total de CPU usado
-            total_usado = FMS.total_cpu_used
+            # Ao sair, cobrar o total de CPU usado, incluindo o que os jobs ainda em execução não somaram ao total
+            total_usado = PostpaidAccrual.total()
             print(f"\nTotal de CPU usado: {total_usado:.2f} segundos.")
 
             while True:
@@ -238,3 +1526,6 @@ if __name__ == "__main__":
                         break
                 except ValueError:
                     print("Valor inválido, tente novamente.")
+            # A conta quitada sai do ledger, para não ser cobrada de novo no próximo início
+            if FMS.ledger is not None:
+                FMS.ledger.append("payment", total_usado)
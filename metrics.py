@@ -0,0 +1,211 @@
+# Endpoint HTTP local com as métricas do FMS no formato texto do Prometheus
+# Os valores vêm do estado que o SamplerEngine e os jobs já mantêm (última amostra de cada job, contadores e
+# histogramas do motor), então um scrape nunca provoca leituras de /proc ou do psutil
+# A resposta renderizada fica em cache por cache_ttl segundos: scrapes frequentes reaproveitam o mesmo texto e o
+# lock do motor só é usado para copiar a lista de jobs
+#
+# Uso:
+#     python main.py --metricas 9464
+#     curl http://127.0.0.1:9464/metrics
+
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Limites dos buckets dos histogramas de latência, em segundos
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Histogram:
+    # Histograma cumulativo no estilo Prometheus com um único escritor (a thread do motor)
+    # observe() é uma busca binária e dois incrementos; quem lê copia as contagens
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, help_text):
+        counts = list(self.counts)
+        yield f"# HELP {name} {help_text}"
+        yield f"# TYPE {name} histogram"
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            yield f'{name}_bucket{{le="{bound}"}} {cumulative}'
+        cumulative += counts[-1]
+        yield f'{name}_bucket{{le="+Inf"}} {cumulative}'
+        yield f"{name}_sum {self.sum}"
+        yield f"{name}_count {cumulative}"
+
+
+def label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def metric(name, kind, help_text, samples):
+    # samples: lista de (rótulos, valor), com rótulos como texto já formatado ("" para sem rótulos)
+    yield f"# HELP {name} {help_text}"
+    yield f"# TYPE {name} {kind}"
+    for labels, value in samples:
+        yield f"{name}{{{labels}}} {value}" if labels else f"{name} {value}"
+
+
+class MetricsServer:
+    cache_ttl = 0.5
+
+    def __init__(self, engine, port=9464, host="127.0.0.1", queue=None):
+        self.engine = engine
+        # Fila de admissão (ver scheduler.py), quando usada
+        self.queue = queue
+        self.cache = b""
+        self.cache_time = 0.0
+        self.cache_lock = threading.Lock()
+        self.scrapes = 0
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = metrics.body()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="FMS-Metrics", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def body(self):
+        # Um único scrape renderiza por vez; os demais dentro de cache_ttl recebem o mesmo texto
+        with self.cache_lock:
+            now = time.monotonic()
+            if now - self.cache_time >= self.cache_ttl:
+                self.cache = ("\n".join(self.render()) + "\n").encode()
+                self.cache_time = now
+            self.scrapes += 1
+            return self.cache
+
+    def render(self):
+        from main import CreditManagerPrePago, PostpaidAccrual
+
+        engine = self.engine
+        with engine.lock:
+            jobs = list(engine.jobs.values())
+        yield from metric("fms_active_jobs", "gauge", "Jobs em execução no motor", [("", len(jobs))])
+        yield from metric(
+            "fms_prepaid_credits", "gauge", "Créditos pré-pagos restantes (inclui leases abertas)",
+            [("", CreditManagerPrePago.get_balance())],
+        )
+        yield from metric(
+            "fms_postpaid_cpu_seconds_total", "counter", "CPU pós-paga acumulada",
+            [("", PostpaidAccrual.total())],
+        )
+        yield from metric(
+            "fms_kills_total", "counter", "Jobs encerrados pelo FMS ou pelo kernel, por motivo",
+            [(f'reason="{label(reason)}"', count) for reason, count in sorted(engine.kills.items())],
+        )
+        yield from metric("fms_samples_total", "counter", "Amostras feitas pelo motor", [("", engine.samples)])
+        yield from metric("fms_sweeps_total", "counter", "Varreduras do motor", [("", engine.sweeps)])
+        yield from metric(
+            "fms_exit_events_total", "counter", "Términos notificados por pidfd", [("", engine.exit_events)],
+        )
+        yield from metric(
+            "fms_engine_cpu_seconds_total", "counter", "CPU gasta pela thread do motor", [("", engine.cpu_time)],
+        )
+        if engine.shards is not None:
+            yield from metric(
+                "fms_monitor_cpu_seconds_total", "counter", "CPU gasta pelos processos monitores nas varreduras (--monitores)",
+                [("", engine.shards.worker_cpu)],
+            )
+        yield from engine.tick_latency.lines("fms_tick_duration_seconds", "Duração de cada amostra (tick) de um job")
+        yield from engine.delay_latency.lines(
+            "fms_sample_delay_seconds", "Atraso de cada amostra em relação ao prazo agendado",
+        )
+        yield from engine.kill_latency.lines(
+            "fms_kill_reclaim_seconds", "Do SIGTERM de um job encerrado pelo FMS até a raiz sair e o grupo ser morto",
+        )
+
+        if self.queue is not None:
+            yield from self.render_queue(self.queue)
+
+        # Métricas por job, da última amostra de cada um
+        rows = []
+        for fms in jobs:
+            if fms.series is None:
+                continue
+            command = fms.command[0] if fms.command else ""
+            rows.append((f'pid="{fms.process.pid}",command="{label(command)}"', fms))
+        yield from metric(
+            "fms_job_cpu_seconds", "gauge", "CPU da árvore do job", [(l, f.cpu_total) for l, f in rows],
+        )
+        yield from metric(
+            "fms_job_rss_bytes", "gauge", "RSS da árvore do job", [(l, f.mem_rss_mb * 1024 * 1024) for l, f in rows],
+        )
+        yield from metric(
+            "fms_job_peak_rss_bytes", "gauge", "Pico de RSS do job",
+            [(l, f.mem_peak_mb * 1024 * 1024) for l, f in rows],
+        )
+        yield from metric(
+            "fms_job_pss_bytes", "gauge", "PSS da árvore do job na última leitura (com --pss)",
+            [(l, f.mem_pss_mb * 1024 * 1024) for l, f in rows if f.mem_pss_mb is not None],
+        )
+        yield from metric(
+            "fms_job_wall_seconds", "gauge", "Tempo de execução do job", [(l, f.wall_clock) for l, f in rows],
+        )
+        yield from metric(
+            "fms_job_processes", "gauge", "Processos na árvore do job", [(l, len(f.tree_process)) for l, f in rows],
+        )
+        yield from metric(
+            "fms_job_samples_total", "counter", "Amostras do job", [(l, f.samples) for l, f in rows],
+        )
+
+    def render_queue(self, queue):
+        stats = queue.stats()
+        yield from metric("fms_queue_jobs", "gauge", "Jobs esperando na fila de admissão", [("", stats["queued"])])
+        yield from metric(
+            "fms_queue_running", "gauge", "Jobs admitidos pela fila e ainda em execução", [("", stats["running"])],
+        )
+        for name, help_text in (
+            ("submitted", "Jobs submetidos à fila"),
+            ("admitted", "Jobs admitidos e lançados"),
+            ("rejected", "Jobs recusados ou que falharam ao lançar"),
+            ("completed", "Jobs da fila terminados"),
+        ):
+            yield from metric(f"fms_queue_{name}_total", "counter", help_text, [("", stats[name])])
+        yield from metric(
+            "fms_queue_throughput_jobs_per_second", "gauge", "Jobs da fila terminados por segundo desde o início",
+            [("", stats["throughput"])],
+        )
+        yield from metric(
+            "fms_queue_blocked", "gauge", "Recurso que segura o primeiro job da fila (1 = bloqueando)",
+            [(f'resource="{label(stats["blocked_by"])}"', 1)] if stats["blocked_by"] and stats["queued"] else [],
+        )
+        yield from queue.wait_time.lines("fms_queue_wait_seconds", "Tempo de espera na fila até a admissão")
@@ -0,0 +1,262 @@
+# Captura da saída dos jobs (stdout e stderr) em arquivos de log
+# Cada job recebe dois pipes próprios no lugar do terminal do FMS; as pontas de leitura são não bloqueantes e
+# drenadas pelo laço de eventos que já monitora o job (o selector do SamplerEngine ou o laço do asyncio)
+# - cada stream vai para <dir>/<pid>.out.log e <dir>/<pid>.err.log (com gzip: .log.gz)
+# - com max_bytes, o arquivo é rotacionado ao passar do tamanho: <pid>.out.1.log, <pid>.out.2.log, ...
+# - as últimas tail_bytes de saída (stdout e stderr intercalados) ficam em memória para o comando "tail <pid>"
+# A gravação em disco (e a compressão) fica com a thread do LogWriter: com o disco saturado o write() de um arquivo
+# comum bloqueia, e isso não pode acontecer no laço que faz as amostras. A fila do LogWriter tem tamanho limitado;
+# quando enche, o laço para de ler os pipes (paused()) e o pipe cheio freia o próprio job
+# Cada drenagem lê no máximo `budget` bytes por stream, então as amostras vencidas são atendidas entre uma drenagem
+# e outra mesmo com um job escrevendo centenas de MB/s
+# Um erro de gravação (disco cheio, erro de E/S, rotação que falhou) não derruba a thread: o stream com erro para de
+# ser gravado (o que chega depois é descartado e contado em dropped) e a fila continua andando, senão os pipes de
+# todos os jobs ficariam pausados para sempre
+
+import atexit
+import gzip
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+
+class LogWriter:
+    # Thread única que grava os logs de todos os jobs
+    max_pending = 8 * 2 ** 20
+    # Espera máxima pela fila na saída do programa
+    exit_timeout = 5.0
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self):
+        self.queue = deque()
+        self.pending = 0
+        self.condition = threading.Condition()
+        self.errors = 0
+        self.thread = threading.Thread(target=self.run, name="FMS-LogWriter", daemon=True)
+        self.thread.start()
+        # O que ainda está na fila é gravado antes de o programa sair
+        atexit.register(self.flush, self.exit_timeout)
+
+    @classmethod
+    def default(cls):
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    def write(self, output, stream, data):
+        with self.condition:
+            self.queue.append((output, stream, data))
+            self.pending += len(data)
+            self.condition.notify()
+
+    def close(self, output, stream):
+        # O arquivo é fechado depois que tudo o que foi enfileirado antes dele estiver gravado
+        with self.condition:
+            self.queue.append((output, stream, None))
+            self.condition.notify()
+
+    def full(self):
+        return self.pending >= self.max_pending
+
+    def ready(self):
+        # Histerese: a leitura volta quando a fila cai para a metade
+        return self.pending < self.max_pending // 2
+
+    def flush(self, timeout=None):
+        # Espera a fila esvaziar, no máximo timeout segundos; retorna False se ainda sobrou o que gravar
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while self.queue or self.pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                output, stream, data = self.queue.popleft()
+            try:
+                if data is None:
+                    stream.file.close()
+                elif stream.error is None:
+                    output.store(stream, data)
+                else:
+                    stream.dropped += len(data)
+            except Exception as e:
+                self.failed(stream, e)
+            finally:
+                with self.condition:
+                    if data is not None:
+                        self.pending -= len(data)
+                    if not self.queue:
+                        self.condition.notify_all()
+
+    def failed(self, stream, error):
+        self.errors += 1
+        if stream.error is not None:
+            return
+        stream.error = error
+        print(
+            f"\nLog {stream.path}: erro de gravação ({error}); o restante da saída deste stream é descartado",
+            file=sys.stderr,
+        )
+
+
+class OutputStream:
+    # Um pipe de saída do job: a ponta de escrita vai para o filho, a de leitura fica com o FMS
+
+    def __init__(self, name):
+        self.name = name
+        self.fd, self.child_fd = os.pipe()
+        os.set_blocking(self.fd, False)
+        self.file = None
+        self.path = None
+        self.written = 0
+        self.closed = False
+        # Primeiro erro de gravação do log e bytes descartados depois dele (ver LogWriter.failed())
+        self.error = None
+        self.dropped = 0
+
+
+class JobOutput:
+    read_size = 65536
+    # Limite da drenagem final: um descendente que continua escrevendo depois do fim do job não prende o laço
+    close_budget = 16 * 2 ** 20
+
+    def __init__(self, directory, tail_bytes=65536, max_bytes=None, backups=3, compress=False, writer=None):
+        self.directory = directory
+        self.tail_bytes = tail_bytes
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.compress = compress
+        self.writer = writer or LogWriter.default()
+        self.streams = [OutputStream("out"), OutputStream("err")]
+        self.buffer = bytearray(self.read_size)
+        self.tail_buffer = bytearray()
+        self.total = 0
+
+    def child_options(self):
+        # Argumentos do Popen / create_subprocess_exec que ligam stdout e stderr do filho aos pipes
+        return {"stdout": self.streams[0].child_fd, "stderr": self.streams[1].child_fd}
+
+    def started(self, pid):
+        # Depois do lançamento: fecha as pontas do filho no FMS e abre os arquivos de log do job
+        os.makedirs(self.directory, exist_ok=True)
+        for stream in self.streams:
+            os.close(stream.child_fd)
+            stream.child_fd = None
+            stream.path = os.path.join(self.directory, f"{pid}.{stream.name}")
+            stream.file = self.open_log(self.log_path(stream))
+
+    def log_path(self, stream, index=0):
+        suffix = ".log.gz" if self.compress else ".log"
+        return f"{stream.path}.{index}{suffix}" if index else stream.path + suffix
+
+    def open_log(self, path):
+        return gzip.open(path, "wb", compresslevel=1) if self.compress else open(path, "wb")
+
+    def paused(self):
+        # Fila do LogWriter cheia: o laço deve parar de ler os pipes até ready()
+        return self.writer.full()
+
+    def ready(self):
+        return self.writer.ready()
+
+    def drain(self, stream, budget=None):
+        # Lê o que houver no pipe, até budget bytes ou até a fila do LogWriter encher
+        # Retorna False no fim do stream (todos os escritores saíram)
+        read = 0
+        while budget is None or read < budget:
+            if self.writer.full():
+                return True
+            try:
+                n = os.readv(stream.fd, [self.buffer])
+            except BlockingIOError:
+                return True
+            except OSError:
+                return False
+            if n == 0:
+                return False
+            self.received(stream, bytes(self.buffer[:n]))
+            read += n
+        return True
+
+    def received(self, stream, data):
+        self.writer.write(self, stream, data)
+        self.total += len(data)
+        # Cauda limitada: só os últimos tail_bytes ficam em memória
+        tail = self.tail_buffer
+        if len(data) >= self.tail_bytes:
+            tail[:] = data[len(data) - self.tail_bytes:]
+        else:
+            tail += data
+            if len(tail) > self.tail_bytes:
+                del tail[:len(tail) - self.tail_bytes]
+
+    def store(self, stream, data):
+        # Executado na thread do LogWriter; um write que falha conta como descartado, a rotação roda depois dele
+        try:
+            stream.file.write(data)
+        except Exception:
+            stream.dropped += len(data)
+            raise
+        stream.written += len(data)
+        if self.max_bytes and stream.written >= self.max_bytes:
+            self.rotate(stream)
+
+    def rotate(self, stream):
+        stream.file.close()
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(self.log_path(stream, index)):
+                os.replace(self.log_path(stream, index), self.log_path(stream, index + 1))
+        if self.backups:
+            os.replace(self.log_path(stream), self.log_path(stream, 1))
+        stream.file = self.open_log(self.log_path(stream))
+        stream.written = 0
+
+    def tail(self, size=None):
+        data = bytes(self.tail_buffer)
+        return data[-size:] if size else data
+
+    def open_streams(self):
+        return [stream for stream in self.streams if not stream.closed]
+
+    def close_stream(self, stream):
+        if stream.closed:
+            return
+        stream.closed = True
+        os.close(stream.fd)
+        if stream.file is not None:
+            self.writer.close(self, stream)
+
+    def close(self):
+        # Fechamento no término do job: drena o que ficou nos pipes (sem esperar a fila) e fecha os streams
+        for stream in self.streams:
+            if stream.child_fd is not None:
+                os.close(stream.child_fd)
+                stream.child_fd = None
+            if not stream.closed:
+                if stream.file is not None:
+                    self.drain_final(stream)
+                self.close_stream(stream)
+
+    def drain_final(self, stream):
+        # Como drain(), mas sem parar na fila cheia: é a última leitura do pipe
+        read = 0
+        while read < self.close_budget:
+            try:
+                n = os.readv(stream.fd, [self.buffer])
+            except OSError:
+                return
+            if n == 0:
+                return
+            self.received(stream, bytes(self.buffer[:n]))
+            read += n
@@ -0,0 +1,106 @@
+# Afinidade de CPU e distribuição dos jobs entre núcleos e nós NUMA (--afinidade, --nucleo-fms)
+# Cada job recebe um conjunto de núcleos aplicado no filho com os.sched_setaffinity entre o fork e o exec, então
+# toda a árvore do job herda a afinidade. Os núcleos são escolhidos pela carga (jobs já fixados em cada núcleo):
+# - o job vai para o nó NUMA menos carregado que tenha núcleos suficientes, e dentro dele para os núcleos menos
+#   carregados; um job maior que qualquer nó usa os núcleos menos carregados de vários nós
+# - com mais jobs que núcleos, os núcleos são compartilhados, sempre pelos menos carregados
+# A memória não recebe política própria: o Linux aloca no nó da CPU que toca a página (first touch), então um job
+# fixado nos núcleos de um nó usa a memória local desse nó
+# Com reserve, um núcleo fica só para o FMS: a thread do motor é fixada nele e nenhum job o recebe, o que mantém
+# o atraso das amostras baixo com a máquina inteira ocupada pelos jobs
+# A topologia vem de /sys/devices/system/node/node*/cpulist; sem ela (ou sem NUMA) todos os núcleos formam o nó 0
+
+import glob
+import os
+import re
+import threading
+
+NODE_ROOT = "/sys/devices/system/node"
+
+
+def parse_cpulist(text):
+    # "0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11]
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def numa_nodes(allowed=None, root=NODE_ROOT):
+    # {nó: [núcleos]} com os núcleos que o FMS pode usar (afinidade atual do processo)
+    allowed = set(os.sched_getaffinity(0) if allowed is None else allowed)
+    nodes = {}
+    for path in glob.glob(os.path.join(root, "node[0-9]*", "cpulist")):
+        node = int(re.search(r"node(\d+)", path).group(1))
+        try:
+            with open(path) as f:
+                cpus = [cpu for cpu in parse_cpulist(f.read()) if cpu in allowed]
+        except (OSError, ValueError):
+            continue
+        if cpus:
+            nodes[node] = cpus
+    placed = {cpu for cpus in nodes.values() for cpu in cpus}
+    if not nodes or placed != allowed:
+        # Sem topologia legível (ou incompleta): um único nó com todos os núcleos permitidos
+        return {0: sorted(allowed)}
+    return nodes
+
+
+class CpuPlacement:
+    # Distribui os núcleos entre os jobs; place() e release() são chamados por threads diferentes (lançamento e motor)
+
+    def __init__(self, cores_per_job=None, reserve=False, nodes=None):
+        # cores_per_job = None: cada job recebe todos os núcleos não reservados (só o núcleo do FMS fica de fora)
+        self.cores_per_job = cores_per_job
+        self.nodes = {node: list(cpus) for node, cpus in (nodes or numa_nodes()).items()}
+        self.reserved = None
+        if reserve:
+            if sum(len(cpus) for cpus in self.nodes.values()) < 2:
+                raise ValueError("é preciso mais de um núcleo para reservar um ao FMS")
+            # O último núcleo do maior nó, para tirar o mínimo de capacidade de um nó pequeno
+            node = max(self.nodes, key=lambda node: (len(self.nodes[node]), -node))
+            self.reserved = self.nodes[node].pop()
+            if not self.nodes[node]:
+                del self.nodes[node]
+        self.node_of = {cpu: node for node, cpus in self.nodes.items() for cpu in cpus}
+        self.load = dict.fromkeys(self.node_of, 0)
+        self.lock = threading.Lock()
+
+    def cpus(self):
+        return sorted(self.node_of)
+
+    def node_key(self, node):
+        # Menor carga média primeiro; empate pelo nó maior e depois pelo número do nó
+        cpus = self.nodes[node]
+        return sum(self.load[cpu] for cpu in cpus) / len(cpus), -len(cpus), node
+
+    def place(self, cores=None):
+        # Retorna (núcleos, nós) escolhidos para um job e conta a carga até release()
+        count = cores or self.cores_per_job
+        with self.lock:
+            if count is None or count >= len(self.node_of):
+                chosen = self.cpus()
+            else:
+                order = sorted(self.nodes, key=self.node_key)
+                fitting = [node for node in order if len(self.nodes[node]) >= count]
+                if fitting:
+                    pool = self.nodes[fitting[0]]
+                else:
+                    pool = [cpu for node in order for cpu in self.nodes[node]]
+                chosen = sorted(sorted(pool, key=lambda cpu: self.load[cpu])[:count])
+            for cpu in chosen:
+                self.load[cpu] += 1
+        return chosen, sorted({self.node_of[cpu] for cpu in chosen})
+
+    def release(self, cpus):
+        with self.lock:
+            for cpu in cpus:
+                self.load[cpu] -= 1
+
+    def pin_engine(self, engine):
+        # Fixa a thread do motor no núcleo reservado
+        if self.reserved is not None:
+            engine.pin({self.reserved})
@@ -0,0 +1,325 @@
+# Rastreamento dos descendentes dos jobs por eventos do kernel, sem varrer /proc inteiro (--eventos-processos)
+# Sem rastreador, o ProcSampler descobre os filhos lendo o ppid de todos os processos do host a cada varredura, um
+# custo que cresce com o host e não com os jobs. Os rastreadores daqui respondem children(pid) sem essa varredura:
+# - ProcConnector: assina os eventos FORK e EXIT do proc connector (netlink, NETLINK_CONNECTOR) e mantém as árvores
+#   dos jobs observados em memória; children() é uma consulta a um dicionário. Um processo que sai tem os filhos
+#   passados ao pai rastreado, então um neto que fica órfão (double fork) continua na árvore do job. Exige
+#   CAP_NET_ADMIN no namespace de rede inicial
+# - TaskChildren: lê /proc/<pid>/task/<tid>/children (CONFIG_PROC_CHILDREN), um arquivo por thread do processo
+# children_tracker() escolhe o primeiro disponível; None significa voltar à varredura de ppid
+# Os dois implementam watch(root) e unwatch(root), chamados pelo ProcessTree no início e no fim de cada job
+
+import errno
+import glob
+import os
+import socket
+import struct
+import threading
+import time
+
+NETLINK_CONNECTOR = 11
+CN_IDX_PROC = 1
+CN_VAL_PROC = 1
+PROC_CN_MCAST_LISTEN = 1
+PROC_CN_MCAST_IGNORE = 2
+PROC_EVENT_FORK = 0x00000001
+PROC_EVENT_EXIT = 0x80000000
+
+# nlmsghdr (len, type, flags, seq, pid) + cn_msg (idx, val, seq, ack, len, flags)
+NLMSG_HEADER = struct.Struct("=IHHII")
+CN_HEADER = struct.Struct("=IIIIHH")
+NLMSG_DONE = 3
+# proc_event: what, cpu, timestamp_ns e, depois, os dados do evento
+EVENT_HEADER = struct.Struct("=IIQ")
+EVENT_OFFSET = NLMSG_HEADER.size + CN_HEADER.size
+DATA_OFFSET = EVENT_OFFSET + EVENT_HEADER.size
+# fork: parent_pid, parent_tgid, child_pid, child_tgid; exit: pid, tgid, exit_code, exit_signal
+EVENT_PIDS = struct.Struct("=IIII")
+
+RECV_BUFFER = 4 * 1024 * 1024
+
+
+def task_children(pid, proc_root="/proc"):
+    # Filhos diretos do pid a partir do arquivo children de cada thread (cada filho aparece na thread que o criou)
+    children = []
+    for path in glob.glob(f"{proc_root}/{pid}/task/*/children"):
+        try:
+            with open(path, "rb") as f:
+                children.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return children
+
+
+class TaskChildren:
+    name = "task"
+
+    def __init__(self, proc_root="/proc"):
+        self.proc_root = proc_root
+
+    @staticmethod
+    def available(proc_root="/proc"):
+        return os.path.exists(f"{proc_root}/self/task/{threading.get_native_id()}/children")
+
+    def children(self, pid):
+        return task_children(pid, self.proc_root)
+
+    def watch(self, root):
+        pass
+
+    def unwatch(self, root):
+        pass
+
+    def close(self):
+        pass
+
+
+class ProcConnector:
+    # Só os eventos de processos (pid == tgid) mudam as árvores; os de threads são descartados
+    # Os eventos chegam numa thread própria e as consultas vêm da thread do motor, por isso o estado fica sob lock
+    name = "netlink"
+    # Tempo máximo de espera pelo evento de teste em start()
+    probe_timeout = 1.0
+
+    def __init__(self, proc_root="/proc"):
+        self.proc_root = proc_root
+        self.lock = threading.Lock()
+        # pid -> filhos, pid -> pai (None para as raízes) e pid -> raiz do job
+        self.kids = {}
+        self.parent = {}
+        self.root_of = {}
+        self.roots = set()
+        self.sock = None
+        self.thread = None
+        self.closed = False
+        self.probe = None
+        # Estatísticas: eventos lidos, processos rastreados e ressincronizações por perda de eventos (ENOBUFS)
+        self.events = 0
+        self.forks = 0
+        self.exits = 0
+        self.resyncs = 0
+
+    def message(self, op):
+        payload = struct.pack("=I", op)
+        return (
+            NLMSG_HEADER.pack(EVENT_OFFSET + len(payload), NLMSG_DONE, 0, 0, os.getpid())
+            + CN_HEADER.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(payload), 0)
+            + payload
+        )
+
+    def start(self):
+        # Abre o socket, assina os eventos e confirma com uma thread de teste que eles chegam; OSError se não der
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_CONNECTOR)
+        try:
+            # Um buffer grande absorve rajadas de fork; SO_RCVBUFFORCE passa do rmem_max, mas exige CAP_NET_ADMIN
+            for option in (getattr(socket, "SO_RCVBUFFORCE", 33), socket.SO_RCVBUF):
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, option, RECV_BUFFER)
+                    break
+                except OSError:
+                    continue
+            sock.bind((0, CN_IDX_PROC))
+            sock.send(self.message(PROC_CN_MCAST_LISTEN))
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+        self.probe = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="FMS-ProcConnector", daemon=True)
+        self.thread.start()
+        # O proc connector pode existir sem entregar eventos (namespace de rede não inicial): uma thread de teste
+        # gera um evento FORK do próprio FMS
+        probe = threading.Thread(target=lambda: None, name="FMS-ProcConnector-teste")
+        probe.start()
+        probe.join()
+        if not self.probe.wait(self.probe_timeout):
+            self.close()
+            raise OSError(errno.ENOTSUP, "o proc connector não entregou eventos")
+        return self
+
+    def close(self):
+        if self.closed or self.sock is None:
+            return
+        self.closed = True
+        try:
+            self.sock.send(self.message(PROC_CN_MCAST_IGNORE))
+        except OSError:
+            pass
+        # O shutdown acorda o recv bloqueado da thread de leitura
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def run(self):
+        buf = bytearray(65536)
+        while not self.closed:
+            try:
+                n = self.sock.recv_into(buf)
+            except OSError as e:
+                if self.closed:
+                    return
+                if e.errno == errno.ENOBUFS:
+                    # O buffer transbordou e eventos se perderam: as árvores são refeitas a partir do /proc
+                    self.resync()
+                    continue
+                if e.errno == errno.EINTR:
+                    continue
+                return
+            if n == 0:
+                if self.closed:
+                    return
+                continue
+            offset = 0
+            # Um datagrama pode trazer várias mensagens netlink
+            while offset + DATA_OFFSET + EVENT_PIDS.size <= n:
+                length = NLMSG_HEADER.unpack_from(buf, offset)[0]
+                self.event(buf, offset)
+                if length < NLMSG_HEADER.size:
+                    break
+                offset += (length + 3) & ~3
+
+    def event(self, buf, offset):
+        what = EVENT_HEADER.unpack_from(buf, offset + EVENT_OFFSET)[0]
+        if what == PROC_EVENT_FORK:
+            _, parent, child, child_tgid = EVENT_PIDS.unpack_from(buf, offset + DATA_OFFSET)
+            if child != child_tgid:
+                # Thread nova (o "pai" informado é o pai do processo): só interessa ao teste do start()
+                if child_tgid == os.getpid():
+                    self.probe.set()
+                return
+            self.events += 1
+            self.forked(parent, child)
+        elif what == PROC_EVENT_EXIT:
+            pid, tgid = EVENT_PIDS.unpack_from(buf, offset + DATA_OFFSET)[:2]
+            if pid != tgid:
+                return
+            self.events += 1
+            self.exited(pid)
+
+    def forked(self, parent, child):
+        with self.lock:
+            root = self.root_of.get(parent)
+            if root is None:
+                return
+            self.add(child, parent, root)
+            self.forks += 1
+
+    def add(self, pid, parent, root):
+        # Chamado com o lock: insere o pid abaixo do pai na árvore da raiz
+        self.kids.setdefault(pid, set())
+        self.parent[pid] = parent
+        self.root_of[pid] = root
+        if parent is not None:
+            self.kids.setdefault(parent, set()).add(pid)
+
+    def exited(self, pid):
+        with self.lock:
+            if pid not in self.root_of:
+                return
+            self.exits += 1
+            # A raiz fica até o unwatch; os filhos continuam abaixo dela
+            if pid not in self.roots:
+                self.remove(pid)
+
+    def remove(self, pid):
+        # Chamado com o lock: tira o pid da árvore e passa os filhos dele ao pai rastreado
+        parent = self.parent.pop(pid)
+        del self.root_of[pid]
+        kids = self.kids.pop(pid)
+        siblings = self.kids.get(parent)
+        if siblings is not None:
+            siblings.discard(pid)
+            siblings.update(kids)
+        for kid in kids:
+            self.parent[kid] = parent
+
+    def scan(self, root):
+        # Chamado com o lock: acrescenta à árvore da raiz os descendentes vivos lidos do /proc
+        stack = [root]
+        while stack:
+            pid = stack.pop()
+            for child in task_children(pid, self.proc_root):
+                if self.root_of.get(child) != root:
+                    self.add(child, pid, root)
+                stack.append(child)
+
+    def watch(self, root):
+        # A raiz entra antes da leitura do /proc: um fork que acontece durante a leitura chega como evento
+        with self.lock:
+            if root in self.roots:
+                return
+            self.roots.add(root)
+            self.add(root, None, root)
+            self.scan(root)
+
+    def unwatch(self, root):
+        with self.lock:
+            if root not in self.roots:
+                return
+            self.roots.discard(root)
+            for pid in [pid for pid, owner in self.root_of.items() if owner == root]:
+                del self.root_of[pid]
+                self.parent.pop(pid, None)
+                self.kids.pop(pid, None)
+
+    def resync(self):
+        # Depois de perder eventos, os processos que saíram são removidos e os que nasceram são relidos do /proc
+        with self.lock:
+            self.resyncs += 1
+            for pid in [pid for pid in self.root_of if pid not in self.roots]:
+                if not os.path.exists(f"{self.proc_root}/{pid}"):
+                    self.exits += 1
+                    self.remove(pid)
+            for pid, root in list(self.root_of.items()):
+                for child in task_children(pid, self.proc_root):
+                    if child not in self.root_of:
+                        self.add(child, pid, root)
+
+    def children(self, pid):
+        with self.lock:
+            return list(self.kids.get(pid, ()))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "events": self.events,
+                "forks": self.forks,
+                "exits": self.exits,
+                "resyncs": self.resyncs,
+                "tracked": len(self.root_of),
+                "roots": len(self.roots),
+            }
+
+
+def children_tracker(proc_root="/proc"):
+    # O proc connector quando os eventos chegam; senão o arquivo children por thread; senão None (varredura de ppid)
+    try:
+        return ProcConnector(proc_root).start()
+    except (OSError, AttributeError):
+        pass
+    if TaskChildren.available(proc_root):
+        return TaskChildren(proc_root)
+    return None
+
+
+if __name__ == "__main__":
+    # Diagnóstico: mostra o rastreador escolhido e acompanha a árvore de um comando
+    import subprocess
+    import sys
+
+    tracker = children_tracker()
+    print(f"rastreador: {tracker.name if tracker else 'varredura de ppid'}")
+    if tracker is not None and len(sys.argv) > 1:
+        process = subprocess.Popen(sys.argv[1:])
+        tracker.watch(process.pid)
+        while process.poll() is None:
+            stack, tree = [process.pid], []
+            while stack:
+                for child in tracker.children(stack.pop()):
+                    tree.append(child)
+                    stack.append(child)
+            print(f"{len(tree)} descendentes: {sorted(tree)[:20]}")
+            time.sleep(0.5)
+        tracker.unwatch(process.pid)
@@ -0,0 +1,177 @@
+# Autoperfilamento do FMS (--profile)
+# Mede o tempo dos caminhos quentes do próprio FMS e a espera nos locks compartilhados, para saber se uma
+# amostragem atrasada é custo de leitura do /proc, contenção de lock ou percurso da árvore de processos
+# A instrumentação só existe quando ativada: install() troca os métodos por versões cronometradas e os locks por
+# TimedLock; sem --profile nenhum código extra roda no caminho do tick
+# O resumo é impresso na saída de erro ao sair do programa e a cada SIGUSR1 (kill -USR1 <pid do FMS>)
+#
+# Os tempos são inclusivos: FMS.tick contém FMS.measure, que contém ProcessTree.update, que contém as leituras
+# do backend. Com vários escritores simultâneos algumas contagens podem se perder, o que não muda o resumo
+
+import atexit
+import functools
+import signal
+import sys
+import threading
+import time
+
+from metrics import Histogram
+
+# Buckets de 1 us a ~1 s em passos de ~2x, em segundos
+PROFILE_BUCKETS = tuple(1e-6 * 2 ** i for i in range(21))
+
+
+class TimedLock:
+    # Lock que registra quanto tempo cada aquisição esperou; a aquisição sem disputa não consulta o relógio
+
+    def __init__(self, lock, histogram):
+        self.lock = lock
+        self.histogram = histogram
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self.lock.acquire(False):
+            self.histogram.observe(0.0)
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        acquired = self.lock.acquire(True, timeout)
+        if acquired:
+            self.histogram.observe(time.perf_counter() - start)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def locked(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Profiler:
+
+    def __init__(self):
+        self.histograms = {}
+        self.installed = []
+        self.locks = []
+        self.started = time.monotonic()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(PROFILE_BUCKETS)
+        return histogram
+
+    def wrap(self, owner, name, label=None):
+        # Troca owner.name por uma versão cronometrada (funções e classmethods)
+        original = owner.__dict__[name]
+        is_classmethod = isinstance(original, classmethod)
+        func = original.__func__ if is_classmethod else original
+        observe = self.histogram(label or f"{owner.__name__}.{name}").observe
+        perf_counter = time.perf_counter
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(perf_counter() - start)
+
+        setattr(owner, name, classmethod(timed) if is_classmethod else timed)
+        self.installed.append((owner, name, original))
+
+    def wrap_lock(self, owner, name, label):
+        lock = getattr(owner, name)
+        setattr(owner, name, TimedLock(lock, self.histogram(f"espera de lock: {label}")))
+        self.locks.append((owner, name, lock))
+
+    def install(self, engine=None):
+        from main import FMS, CreditLease, CreditManagerPrePago, PostpaidAccrual, SamplerEngine
+        from sampling import ProcessTree, ProcSampler, PsutilSampler
+
+        # Leitura do backend (/proc ou psutil) e percurso da árvore
+        for sampler in (ProcSampler, PsutilSampler):
+            self.wrap(sampler, "sample")
+            self.wrap(sampler, "children")
+        self.wrap(ProcessTree, "update")
+        # Métodos do FMS e uma iteração completa do monitoramento (tick) e da varredura do motor
+        for name in ("get_cpu_time", "get_memory_usage", "get_childrens", "measure", "memory_detail", "tick"):
+            self.wrap(FMS, name)
+        self.wrap(SamplerEngine, "sweep")
+        # Cobrança: débito direto, débito pela lease, renovação da lease e acúmulo pós-pago
+        self.wrap(CreditManagerPrePago, "debit")
+        self.wrap(CreditManagerPrePago, "reserve")
+        self.wrap(CreditLease, "debit")
+        self.wrap(PostpaidAccrual, "flush")
+        # Locks compartilhados: créditos, total pós-pago e o lock do motor
+        self.wrap_lock(CreditManagerPrePago, "lock", "CreditManagerPrePago.lock")
+        self.wrap_lock(FMS, "total_cpu_lock", "FMS.total_cpu_lock")
+        if engine is not None:
+            self.wrap_lock(engine, "lock", "SamplerEngine.lock")
+        return self
+
+    def uninstall(self):
+        for owner, name, original in reversed(self.installed):
+            setattr(owner, name, original)
+        for owner, name, lock in reversed(self.locks):
+            setattr(owner, name, lock)
+        self.installed = []
+        self.locks = []
+
+    def enable_dump(self, stream=None):
+        # Resumo ao sair e a cada SIGUSR1 (o handler precisa ser instalado pela thread principal)
+        stream = stream or sys.stderr
+        atexit.register(self.dump, stream)
+        if threading.current_thread() is threading.main_thread() and hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.dump(stream))
+        return self
+
+    @staticmethod
+    def quantile(histogram, counts, total, q):
+        # Limite superior do bucket que contém o quantil
+        target = q * total
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float("inf")
+
+    def summary(self):
+        rows = []
+        for name, histogram in self.histograms.items():
+            counts = list(histogram.counts)
+            total = sum(counts)
+            if not total:
+                continue
+            rows.append({
+                "nome": name,
+                "chamadas": total,
+                "total_s": histogram.sum,
+                "media_us": 1e6 * histogram.sum / total,
+                "p50_us": 1e6 * self.quantile(histogram, counts, total, 0.50),
+                "p99_us": 1e6 * self.quantile(histogram, counts, total, 0.99),
+            })
+        rows.sort(key=lambda row: row["total_s"], reverse=True)
+        return rows
+
+    def dump(self, stream=None):
+        stream = stream or sys.stderr
+        elapsed = time.monotonic() - self.started
+        print(f"\n=== FMS profile ({elapsed:.1f}s) ===", file=stream)
+        print(f"{'caminho':<45} {'chamadas':>10} {'total (s)':>10} {'média (us)':>11} "
+              f"{'p50 (us)':>9} {'p99 (us)':>9}", file=stream)
+        for row in self.summary():
+            print(
+                f"{row['nome']:<45} {row['chamadas']:>10} {row['total_s']:>10.3f} {row['media_us']:>11.1f} "
+                f"{row['p50_us']:>9.0f} {row['p99_us']:>9.0f}",
+                file=stream,
+            )
+        stream.flush()
@@ -0,0 +1,382 @@
+# Backends de amostragem de processos usados pelo FMS
+# Cada backend entrega, para um pid, um registro compacto (Sample) com o estado, o pai, o tempo de CPU e a RSS
+# - ProcSampler: leitura direta de /proc/<pid>/stat e /proc/<pid>/statm (Linux), uma passada por pid
+# - PsutilSampler: implementação portátil usando psutil, utilizada quando /proc não está disponível
+# Além da amostra, memory_detail() faz a leitura cara de memória (pico por processo, PSS e USS), que o FMS chama com
+# baixa frequência
+# O ProcessTree usa um backend para acompanhar a árvore inteira de descendentes de um job
+# Com um rastreador de processos (ProcSampler.tracker, ver proc_connector.py) os filhos vêm dos eventos do kernel em
+# vez da varredura do ppid de todos os processos do host
+
+import errno
+import os
+import resource
+from collections import namedtuple
+
+import psutil
+
+# Registro de uma amostra: cpu em segundos (usuário + sistema), children_cpu com a CPU dos filhos já recolhidos
+# pelo processo (cutime + cstime) e rss em bytes
+Sample = namedtuple("Sample", "pid ppid status cpu children_cpu rss")
+
+# Tradução da letra de estado do /proc/<pid>/stat para os nomes usados pelo psutil
+PROC_STATUS = {
+    b"R": psutil.STATUS_RUNNING,
+    b"S": psutil.STATUS_SLEEPING,
+    b"D": psutil.STATUS_DISK_SLEEP,
+    b"Z": psutil.STATUS_ZOMBIE,
+    b"T": psutil.STATUS_STOPPED,
+    b"t": psutil.STATUS_TRACING_STOP,
+    b"X": psutil.STATUS_DEAD,
+    b"x": psutil.STATUS_DEAD,
+    b"K": "wake-kill",
+    b"W": psutil.STATUS_WAKING,
+    b"P": psutil.STATUS_PARKED,
+    b"I": psutil.STATUS_IDLE,
+}
+
+
+class ProcSampler:
+    # Backend Linux: mantém abertos os arquivos stat e statm de cada pid e os relê com preadv
+    # O descritor aberto continua ligado ao processo original, então a reutilização de pid não confunde as leituras
+    # Os buffers são reaproveitados entre amostras; a instância não é thread-safe (o SamplerEngine usa uma só thread)
+    # Os descritores abertos ficam limitados a max_open pids (dois por pid) e a um quarto do RLIMIT_NOFILE; além
+    # disso, e quando o limite de descritores do processo ou do sistema é atingido (EMFILE/ENFILE), os pids que não
+    # estão no cache são lidos abrindo e fechando os arquivos a cada amostra
+    name = "proc"
+    # Rastreador compartilhado (ProcConnector ou TaskChildren) ou None para a varredura de ppid
+    tracker = None
+    max_open = 4096
+
+    def __init__(self, proc_root="/proc"):
+        self.proc_root = proc_root
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self.fds = {}
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != resource.RLIM_INFINITY:
+            self.max_open = min(self.max_open, soft // 8)
+        self.stat_buf = bytearray(4096)
+        self.statm_buf = bytearray(512)
+        # Mapa pai -> filhos montado no máximo uma vez por varredura do motor
+        self.ppid_map = None
+
+    @staticmethod
+    def available(proc_root="/proc"):
+        return os.path.exists(os.path.join(proc_root, "self", "stat"))
+
+    @staticmethod
+    def read_kb(data, keys):
+        # Valores em bytes das linhas "Chave:   123 kB" de status e smaps_rollup
+        values = dict.fromkeys(keys, 0)
+        for line in data.splitlines():
+            key, _, rest = line.partition(b":")
+            if key in values:
+                values[key] = int(rest.split()[0]) * 1024
+        return values
+
+    def open(self, pid):
+        base = f"{self.proc_root}/{pid}/"
+        stat_fd = os.open(base + "stat", os.O_RDONLY | os.O_CLOEXEC)
+        try:
+            statm_fd = os.open(base + "statm", os.O_RDONLY | os.O_CLOEXEC)
+        except OSError:
+            os.close(stat_fd)
+            raise
+        fds = self.fds[pid] = (stat_fd, statm_fd)
+        return fds
+
+    def read(self, pid):
+        # Lê stat e statm do pid para os buffers; devolve os tamanhos lidos
+        fds = self.fds.get(pid)
+        if fds is None and len(self.fds) < self.max_open:
+            try:
+                fds = self.open(pid)
+            except OSError as e:
+                if e.errno not in (errno.EMFILE, errno.ENFILE):
+                    raise
+                # Sem descritores livres: o cache para de crescer e este pid é lido sem cache
+                self.max_open = len(self.fds)
+        if fds is None:
+            return self.read_once(pid)
+        return os.preadv(fds[0], [self.stat_buf], 0), os.preadv(fds[1], [self.statm_buf], 0)
+
+    def read_once(self, pid):
+        # Leitura sem cache; se nem os dois descritores dela estão disponíveis, um pid do cache é liberado
+        base = f"{self.proc_root}/{pid}/"
+        while True:
+            try:
+                sizes = []
+                for name, buf in (("stat", self.stat_buf), ("statm", self.statm_buf)):
+                    fd = os.open(base + name, os.O_RDONLY | os.O_CLOEXEC)
+                    try:
+                        sizes.append(os.preadv(fd, [buf], 0))
+                    finally:
+                        os.close(fd)
+                return sizes
+            except OSError as e:
+                if e.errno not in (errno.EMFILE, errno.ENFILE) or not self.fds:
+                    raise
+                self.forget(next(iter(self.fds)))
+                self.max_open = len(self.fds)
+
+    def sample(self, pid):
+        # Retorna o Sample do pid ou None se o processo não existe mais
+        try:
+            n, m = self.read(pid)
+        except (FileNotFoundError, ProcessLookupError):
+            self.forget(pid)
+            return None
+        buf = self.stat_buf
+        # O nome do comando pode conter espaços e parênteses, por isso o corte é feito no último ')'
+        fields = buf[buf.rindex(b")", 0, n) + 2:n].split()
+        ticks = self.clock_ticks
+        rss = int(self.statm_buf[:m].split(None, 2)[1]) * self.page_size
+        return Sample(
+            pid,
+            int(fields[1]),
+            PROC_STATUS.get(bytes(fields[0]), "?"),
+            (int(fields[11]) + int(fields[12])) / ticks,
+            (int(fields[13]) + int(fields[14])) / ticks,
+            rss,
+        )
+
+    def memory_detail(self, pid, pss=False):
+        # (pico de RSS do processo, PSS, USS) em bytes, ou None se o processo não existe mais
+        # O VmHWM do status é o pico mantido pelo kernel, então vale para todo o tempo até a leitura; o smaps_rollup
+        # (só com pss) percorre as tabelas de páginas do processo, por isso custa proporcionalmente à memória dele
+        base = f"{self.proc_root}/{pid}/"
+        try:
+            with open(base + "status", "rb") as f:
+                hwm = self.read_kb(f.read(), (b"VmHWM",))[b"VmHWM"]
+            if not pss:
+                return hwm, None, None
+            with open(base + "smaps_rollup", "rb") as f:
+                rollup = self.read_kb(f.read(), (b"Pss", b"Private_Clean", b"Private_Dirty"))
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            return None
+        return hwm, rollup[b"Pss"], rollup[b"Private_Clean"] + rollup[b"Private_Dirty"]
+
+    def begin_sweep(self):
+        self.ppid_map = None
+
+    def watch(self, root):
+        if self.tracker is not None:
+            self.tracker.watch(root)
+
+    def unwatch(self, root):
+        if self.tracker is not None:
+            self.tracker.unwatch(root)
+
+    def children(self, pid):
+        # Filhos diretos do pid, pelo rastreador ou a partir do campo ppid de todos os processos do host
+        # (uma leitura por varredura)
+        if self.tracker is not None:
+            return self.tracker.children(pid)
+        if self.ppid_map is None:
+            ppid_map = {}
+            for entry in os.listdir(self.proc_root):
+                if not entry.isdigit():
+                    continue
+                try:
+                    with open(f"{self.proc_root}/{entry}/stat", "rb") as f:
+                        data = f.read()
+                except OSError:
+                    continue
+                ppid = int(data[data.rindex(b")") + 2:].split(None, 2)[1])
+                ppid_map.setdefault(ppid, []).append(int(entry))
+            self.ppid_map = ppid_map
+        return self.ppid_map.get(pid, [])
+
+    def forget(self, pid):
+        # Fecha os descritores de um pid que saiu do monitoramento
+        fds = self.fds.pop(pid, None)
+        if fds:
+            for fd in fds:
+                os.close(fd)
+
+
+class PsutilSampler:
+    # Backend portátil: um psutil.Process por pid e oneshot() para agrupar as leituras de cada amostra
+    name = "psutil"
+
+    def __init__(self):
+        self.processes = {}
+
+    def sample(self, pid):
+        try:
+            process = self.processes.get(pid)
+            if process is None:
+                process = self.processes[pid] = psutil.Process(pid)
+            with process.oneshot():
+                cpu_times = process.cpu_times()
+                return Sample(
+                    pid,
+                    process.ppid(),
+                    process.status(),
+                    cpu_times.user + cpu_times.system,
+                    cpu_times.children_user + cpu_times.children_system,
+                    process.memory_info().rss,
+                )
+        except psutil.NoSuchProcess:
+            self.forget(pid)
+            return None
+        except psutil.AccessDenied:
+            return None
+
+    def memory_detail(self, pid, pss=False):
+        # O psutil não expõe o VmHWM; PSS e USS vêm do memory_full_info (smaps)
+        if not pss:
+            return None, None, None
+        try:
+            info = (self.processes.get(pid) or psutil.Process(pid)).memory_full_info()
+        except psutil.Error:
+            return None
+        return None, info.pss, info.uss
+
+    def begin_sweep(self):
+        pass
+
+    def watch(self, root):
+        pass
+
+    def unwatch(self, root):
+        pass
+
+    def children(self, pid):
+        try:
+            return [child.pid for child in psutil.Process(pid).children(recursive=False)]
+        except psutil.NoSuchProcess:
+            return []
+
+    def forget(self, pid):
+        self.processes.pop(pid, None)
+
+
+class ProcessTree:
+    # Árvore de processos de um job, atualizada de forma incremental a cada amostra
+    # Os pids conhecidos são reamostrados, os filhos novos são adicionados e os que sumiram são finalizados,
+    # sem reconstruir a estrutura inteira
+    # A CPU da árvore soma, para cada processo vivo, a própria CPU e a dos filhos que ele já recolheu (cutime/cstime);
+    # assim processos curtos que nasceram e morreram entre duas amostras também são contados.
+    # Um processo que some sem um pai monitorado para recolhê-lo (órfão) tem a última CPU conhecida guardada em exited_cpu
+
+    def __init__(self, root_pid):
+        self.root = root_pid
+        self.nodes = {}
+        self.exited_cpu = 0.0
+        self.exited = 0
+        self.cpu = 0.0
+        self.rss = 0
+        self.peak_rss = 0
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def update(self, sampler):
+        # Retorna o Sample da raiz (ou None se a raiz não pôde ser lida)
+        nodes = self.nodes
+        gone = []
+        for pid in nodes:
+            sample = sampler.sample(pid)
+            if sample is None:
+                gone.append(pid)
+            else:
+                nodes[pid] = sample
+        if not nodes:
+            # Primeira amostra: a árvore começa pela raiz
+            sample = sampler.sample(self.root)
+            if sample is not None:
+                nodes[self.root] = sample
+                sampler.watch(self.root)
+        if gone:
+            self.finalize({pid: nodes.pop(pid) for pid in gone}, sampler)
+
+        # Descoberta dos descendentes novos a partir de todos os processos vivos da árvore
+        stack = list(nodes)
+        while stack:
+            for child in sampler.children(stack.pop()):
+                if child in nodes:
+                    continue
+                sample = sampler.sample(child)
+                if sample is not None:
+                    nodes[child] = sample
+                    stack.append(child)
+
+        cpu = self.exited_cpu
+        rss = 0
+        for sample in nodes.values():
+            cpu += sample.cpu + sample.children_cpu
+            rss += sample.rss
+        # Entre o momento em que um filho é recolhido e a leitura do pai a soma pode oscilar; a CPU nunca diminui
+        self.cpu = max(self.cpu, cpu)
+        self.rss = rss
+        self.peak_rss = max(self.peak_rss, rss)
+        return nodes.get(self.root)
+
+    def finalize(self, gone, sampler):
+        # Se o primeiro ancestral que não sumiu junto ainda está vivo na árvore, a CPU do processo já aparece
+        # no cutime/cstime dele; caso contrário o processo foi recolhido fora da árvore e a CPU é guardada aqui
+        for pid, sample in gone.items():
+            sampler.forget(pid)
+            self.exited += 1
+            if pid == self.root:
+                continue
+            ancestor = sample.ppid
+            while ancestor in gone:
+                ancestor = gone[ancestor].ppid
+            if ancestor not in self.nodes:
+                self.exited_cpu += sample.cpu + sample.children_cpu
+
+    def close(self, root_cpu, sampler):
+        # Fechamento quando a raiz terminou: root_cpu é a CPU total da raiz medida pelo kernel (rusage do wait4),
+        # que já inclui os descendentes que ela recolheu; os descendentes ainda vivos são relidos e somados por cima
+        gone = {}
+        for pid in list(self.nodes):
+            if pid == self.root:
+                continue
+            sample = sampler.sample(pid)
+            if sample is None:
+                gone[pid] = self.nodes.pop(pid)
+            else:
+                self.nodes[pid] = sample
+        # A raiz continua na árvore durante a finalização, pois o que ela recolheu já está em root_cpu
+        if gone:
+            self.finalize(gone, sampler)
+        if self.nodes.pop(self.root, None) is not None:
+            sampler.forget(self.root)
+        sampler.unwatch(self.root)
+        cpu = root_cpu + self.exited_cpu
+        rss = 0
+        for sample in self.nodes.values():
+            cpu += sample.cpu + sample.children_cpu
+            rss += sample.rss
+        self.cpu = max(self.cpu, cpu)
+        self.rss = rss
+        return self.cpu
+
+    def memory_detail(self, sampler, pss=False):
+        # Leitura cara de memória da árvore (ver memory_detail() dos backends): (maior pico de RSS de um processo,
+        # PSS, USS) em bytes; PSS e USS são a soma dos processos e ficam zerados sem pss
+        hwm = pss_total = uss_total = 0
+        for pid in list(self.nodes):
+            detail = sampler.memory_detail(pid, pss)
+            if detail is None:
+                continue
+            process_hwm, process_pss, process_uss = detail
+            hwm = max(hwm, process_hwm or 0)
+            pss_total += process_pss or 0
+            uss_total += process_uss or 0
+        return hwm, pss_total, uss_total
+
+    def forget(self, sampler):
+        for pid in self.nodes:
+            sampler.forget(pid)
+        sampler.unwatch(self.root)
+
+
+def default_sampler():
+    # Escolhe o backend nativo quando /proc existe e usa o psutil como alternativa portátil
+    if ProcSampler.available():
+        return ProcSampler()
+    return PsutilSampler()
@@ -0,0 +1,243 @@
+# Fila de jobs com controle de admissão
+# Os jobs submetidos esperam na fila até caberem nos recursos do host; só então são lançados no SamplerEngine:
+# - concorrência: no máximo max_running jobs (padrão: número de núcleos)
+# - memória: limit_mem cabe na memória disponível do host menos o que os jobs em execução ainda podem crescer
+#   até os próprios limites (limit_mem - RSS atual) e menos mem_reserve_mb
+# - créditos: no pré-pago, limit_cpu cabe no saldo menos o que os jobs pré-pagos em execução ainda podem gastar
+# A ordem é por prioridade (maior primeiro); entre submissores com a mesma prioridade vai antes quem tem menos jobs
+# em execução e, depois, quem consumiu menos CPU (terminados, com decaimento, mais os em execução)
+# A fila não pula o primeiro da ordem quando ele não cabe, para que jobs grandes não fiquem esperando para sempre;
+# um job que não caberia nem com o host vazio é recusado
+#
+# Exemplo:
+#     queue = JobQueue().start()
+#     queue.submit(fms, ["./prog"], priority=1, submitter="ana")
+
+import heapq
+import itertools
+import os
+import threading
+import time
+
+import psutil
+
+from metrics import Histogram
+
+# Buckets do tempo de espera na fila, em segundos
+QUEUE_BUCKETS = (0.001, 0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+class QueuedJob:
+    def __init__(self, fms, command, priority, submitter, on_reject, seq):
+        self.fms = fms
+        self.command = command
+        self.priority = priority
+        self.submitter = submitter
+        self.on_reject = on_reject
+        self.seq = seq
+        self.submitted_at = time.monotonic()
+
+
+class JobQueue:
+    # Intervalo de reavaliação da fila enquanto há jobs esperando (a memória livre muda sem aviso)
+    poll_interval = 0.25
+    mem_reserve_mb = 256
+    # Meia-vida (s) do consumo de cada submissor usado no fair share
+    share_half_life = 300.0
+
+    def __init__(self, engine=None, max_running=None):
+        from main import SamplerEngine
+        self.engine = engine or SamplerEngine.default()
+        self.max_running = max_running or os.cpu_count() or 1
+        self.condition = threading.Condition()
+        self.waiting = {}
+        self.running = set()
+        self.usage = {}
+        self.usage_time = time.monotonic()
+        self.seq = itertools.count()
+        self.thread = None
+        # Métricas (lidas pelo endpoint de métricas)
+        self.submitted = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.started_at = time.monotonic()
+        self.wait_time = Histogram(QUEUE_BUCKETS)
+        self.blocked_by = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="FMS-JobQueue", daemon=True)
+        self.thread.start()
+        return self
+
+    def submit(self, fms, command, priority=0, submitter="padrao", on_reject=None):
+        # Enfileira o job; on_reject(fms, motivo) é chamado se ele for recusado ou não puder ser lançado
+        job = QueuedJob(fms, list(command), priority, submitter, on_reject, next(self.seq))
+        with self.condition:
+            heapq.heappush(self.waiting.setdefault(submitter, []), (-priority, job.seq, job))
+            self.submitted += 1
+            self.condition.notify()
+        return job
+
+    def queued(self):
+        with self.condition:
+            return sum(len(jobs) for jobs in self.waiting.values())
+
+    def position(self, job):
+        with self.condition:
+            shares = self.shares()
+            return 1 + sum(
+                1 for jobs in self.waiting.values() for _, _, other in jobs if self.before(other, job, shares)
+            )
+
+    def cancel(self, job):
+        # Tira da fila um job que ainda não foi admitido; False se ele já foi lançado, recusado ou cancelado
+        with self.condition:
+            jobs = self.waiting.get(job.submitter, [])
+            for index, (_, _, other) in enumerate(jobs):
+                if other is job:
+                    jobs.pop(index)
+                    heapq.heapify(jobs)
+                    if not jobs:
+                        del self.waiting[job.submitter]
+                    self.condition.notify()
+                    return True
+        return False
+
+    def shares(self):
+        # Por submissor: [jobs em execução, CPU consumida pelos terminados (com decaimento) e pelos em execução]
+        shares = {submitter: [0, cpu] for submitter, cpu in self.usage.items()}
+        for fms in self.running:
+            share = shares.setdefault(fms.submitter, [0, 0.0])
+            share[0] += 1
+            share[1] += getattr(fms, "cpu_total", 0.0)
+        return shares
+
+    @staticmethod
+    def before(a, b, shares):
+        empty = [0, 0.0]
+        return (-a.priority, shares.get(a.submitter, empty), a.seq) < (-b.priority, shares.get(b.submitter, empty), b.seq)
+
+    def run(self):
+        # O lançamento (fork/exec) acontece fora do lock, para não atrasar o motor quando ele avisa um término
+        while True:
+            with self.condition:
+                self.condition.wait(self.poll_interval if self.waiting else None)
+                admitted, rejected = self.schedule()
+            for job, reason in rejected:
+                self.reject(job, reason)
+            for job in admitted:
+                self.launch(job)
+
+    def decay(self):
+        now = time.monotonic()
+        factor = 0.5 ** ((now - self.usage_time) / self.share_half_life)
+        self.usage_time = now
+        for submitter in self.usage:
+            self.usage[submitter] *= factor
+
+    def head(self, shares):
+        # Próximo job pela ordem: maior prioridade; empate pelo submissor que consumiu menos; depois, pela chegada
+        best = None
+        for jobs in self.waiting.values():
+            job = jobs[0][2]
+            if best is None or self.before(job, best, shares):
+                best = job
+        return best
+
+    def fits(self, job):
+        # Retorna None se o job cabe agora ou o motivo da espera
+        from main import CreditManagerPrePago
+        fms = job.fms
+        memory = psutil.virtual_memory()
+        # Maior que a memória total do host: não adianta esperar
+        if fms.limit_mem > memory.total / (1024 * 1024) - self.mem_reserve_mb:
+            return "memoria_total"
+        if len(self.running) >= self.max_running:
+            return "concorrencia"
+        # Jobs admitidos e ainda não amostrados contam com o limite inteiro
+        committed_mem = sum(max(0.0, other.limit_mem - getattr(other, "mem_rss_mb", 0.0)) for other in self.running)
+        available_mb = memory.available / (1024 * 1024) - self.mem_reserve_mb
+        if fms.limit_mem > available_mb - committed_mem:
+            return "memoria"
+        if fms.pre_pago:
+            committed_cpu = sum(
+                max(0.0, other.limit_cpu - getattr(other, "cpu_total", 0.0)) for other in self.running if other.pre_pago
+            )
+            if fms.limit_cpu > CreditManagerPrePago.get_balance() - committed_cpu:
+                return "creditos"
+        return None
+
+    def schedule(self):
+        # Chamado com o condition adquirido: separa, pela ordem, os jobs admitidos enquanto o primeiro couber
+        # Os admitidos já entram em running, então a próxima decisão conta com os recursos reservados para eles
+        self.decay()
+        shares = self.shares()
+        admitted, rejected = [], []
+        while self.waiting:
+            job = self.head(shares)
+            reason = self.fits(job)
+            self.blocked_by = reason
+            if reason is not None:
+                # Sem nenhum job em execução o recurso não vai ser liberado: o job nunca caberia
+                if reason == "memoria_total" or reason != "concorrencia" and not self.running:
+                    self.pop(job)
+                    rejected.append((job, f"não cabe no host ({reason})"))
+                    continue
+                break
+            self.pop(job)
+            job.fms.submitter = job.submitter
+            job.fms.on_finish.append(self.job_finished)
+            self.running.add(job.fms)
+            shares.setdefault(job.submitter, [0, 0.0])[0] += 1
+            admitted.append(job)
+        return admitted, rejected
+
+    def pop(self, job):
+        jobs = self.waiting[job.submitter]
+        heapq.heappop(jobs)
+        if not jobs:
+            del self.waiting[job.submitter]
+
+    def reject(self, job, reason):
+        with self.condition:
+            self.rejected += 1
+        if job.on_reject is not None:
+            job.on_reject(job.fms, reason)
+
+    def launch(self, job):
+        fms = job.fms
+        try:
+            fms.start_process(job.command, engine=self.engine)
+        except OSError as e:
+            with self.condition:
+                self.running.discard(fms)
+                fms.on_finish.remove(self.job_finished)
+                self.condition.notify()
+            self.reject(job, f"falha ao lançar: {e}")
+            return
+        with self.condition:
+            self.admitted += 1
+            self.wait_time.observe(time.monotonic() - job.submitted_at)
+
+    def job_finished(self, fms):
+        # Chamado na thread do motor: libera a vaga, soma a CPU do job ao submissor e reavalia a fila
+        with self.condition:
+            self.running.discard(fms)
+            self.usage[fms.submitter] = self.usage.get(fms.submitter, 0.0) + fms.cpu_total
+            self.completed += 1
+            self.condition.notify()
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started_at
+        with self.condition:
+            return {
+                "queued": sum(len(jobs) for jobs in self.waiting.values()),
+                "running": len(self.running),
+                "submitted": self.submitted,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "throughput": self.completed / elapsed if elapsed > 0 else 0.0,
+                "blocked_by": self.blocked_by,
+            }
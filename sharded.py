@@ -0,0 +1,227 @@
+# Monitoramento dividido entre processos (--monitores N)
+# Numa só thread, a leitura do /proc de milhares de pids fica presa a um núcleo (GIL). Com um ShardPool, o
+# SamplerEngine distribui os jobs entre N processos monitores (multiprocessing), cada um dono das árvores de
+# processos (ProcessTree) dos seus jobs:
+# - o monitor amostra cada job no prazo pedido pelo motor e envia, por varredura, um relatório com a CPU e a RSS
+#   acumuladas de cada árvore amostrada (valores acumulados: um relatório perdido ou atrasado não distorce a cobrança,
+#   o motor calcula o delta no tick)
+# - o motor continua dono das decisões: a cada relatório roda o tick do job (cobrança, limites, SIGTERM/SIGKILL) e
+#   devolve ao monitor o próximo intervalo adaptativo; término (pidfd), saída capturada e cancelamentos seguem no motor
+# - a leitura detalhada de memória (VmHWM e, com --pss, PSS/USS) é feita no monitor, no ritmo memory_detail_interval de
+#   cada job, e vai junto com a amostra; os pids da árvore vão quando mudam, para o motor sinalizar também os
+#   descendentes que saíram do grupo do job (ver FMS.signal_tree())
+# Com mais de um monitor é preciso um rastreador de filhos (--eventos-processos, ver proc_connector.py): com a
+# varredura de ppid cada monitor leria o /proc do host inteiro a cada varredura, e o custo cresceria com o número de
+# monitores em vez de ser dividido entre eles
+# Se um monitor morre, os jobs dele voltam a ser amostrados pela thread do motor
+#
+# Mensagens (multiprocessing.Connection, um socket Unix por monitor):
+#     motor -> monitor: lista de ("add", pid, (intervalo, pss, intervalo da leitura detalhada)), ("next", pid, intervalo),
+#                       ("remove", pid, None); None encerra
+#     monitor -> motor: ([(pid, cpu, rss, processos, atraso, (hwm, pss, uss) ou None, pids ou None), ...],
+#                        CPU gasta na varredura)
+
+import heapq
+import multiprocessing
+import signal
+import socket
+import time
+
+from sampling import ProcessTree, ProcSampler, default_sampler
+
+# Buffers dos sockets motor <-> monitor: com os dois lados enviando lotes grandes ao mesmo tempo, um buffer cheio
+# em cada sentido travaria os dois processos
+PIPE_BUFFER = 8 * 1024 * 1024
+
+
+def enlarge(conn):
+    sock = socket.socket(fileno=conn.fileno())
+    try:
+        for option in (socket.SO_SNDBUF, socket.SO_RCVBUF):
+            sock.setsockopt(socket.SOL_SOCKET, option, PIPE_BUFFER)
+    finally:
+        sock.detach()
+
+
+class WorkerJob:
+    # Estado de um job no processo monitor
+
+    def __init__(self, pid, pss, detail_interval):
+        self.tree = ProcessTree(pid)
+        self.pss = pss
+        self.detail_interval = detail_interval
+        self.next_detail = 0.0
+        # Pids da árvore no último relatório
+        self.members = frozenset()
+        self.deadline = None
+
+    def report(self, sampler, late):
+        tree = self.tree
+        tree.update(sampler)
+        now = time.monotonic()
+        detail = None
+        if now >= self.next_detail and tree.nodes:
+            self.next_detail = now + self.detail_interval
+            detail = tree.memory_detail(sampler, self.pss)
+        pids = None
+        if tree.nodes.keys() != self.members:
+            self.members = frozenset(tree.nodes)
+            pids = list(self.members)
+        return tree.root, tree.cpu, tree.rss, len(tree), late, detail, pids
+
+
+def worker_main(conn, tracker=None):
+    # Laço do monitor: recebe os pedidos do motor e amostra os jobs vencidos
+    # tracker é o nome do rastreador de filhos do motor (ver proc_connector.py), None para a varredura de ppid
+    # O Ctrl+C do terminal chega ao grupo inteiro; quem encerra o monitor é o motor
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sampler = default_sampler()
+    if tracker is not None and isinstance(sampler, ProcSampler):
+        from proc_connector import TaskChildren, children_tracker
+        sampler.tracker = TaskChildren() if tracker == "task" else children_tracker()
+    jobs = {}
+    heap = []
+    enlarge(conn)
+    while True:
+        timeout = max(0.0, heap[0][0] - time.monotonic()) if heap else None
+        if conn.poll(timeout):
+            # Todos os pedidos já recebidos são atendidos antes da varredura
+            while conn.poll(0):
+                message = conn.recv()
+                if message is None:
+                    return
+                now = time.monotonic()
+                for op, pid, value in message:
+                    if op == "remove":
+                        job = jobs.pop(pid, None)
+                        if job is not None:
+                            job.tree.forget(sampler)
+                        continue
+                    if op == "add":
+                        value, pss, detail_interval = value
+                        jobs[pid] = WorkerJob(pid, pss, detail_interval)
+                    job = jobs.get(pid)
+                    if job is not None:
+                        job.deadline = now + value
+                        heapq.heappush(heap, (job.deadline, pid))
+        cpu_start = time.thread_time()
+        now = time.monotonic()
+        report = []
+        sampler.begin_sweep()
+        while heap and heap[0][0] <= now:
+            deadline, pid = heapq.heappop(heap)
+            job = jobs.get(pid)
+            # Entradas antigas (job removido ou reagendado) são descartadas
+            if job is None or job.deadline != deadline:
+                continue
+            # O próximo prazo vem do motor, depois do tick
+            job.deadline = None
+            report.append(job.report(sampler, time.monotonic() - deadline))
+        if report:
+            conn.send((report, time.thread_time() - cpu_start))
+
+
+class Shard:
+    # Um processo monitor visto pelo motor; os pedidos se acumulam em outbox até flush()
+    def __init__(self, context, index, tracker=None):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=worker_main, args=(child, tracker), name=f"FMS-Monitor-{index}", daemon=True,
+        )
+        self.process.start()
+        child.close()
+        enlarge(self.conn)
+        self.jobs = 0
+        self.outbox = []
+
+    def fileno(self):
+        return self.conn.fileno()
+
+    def receive(self):
+        # None quando o monitor morreu
+        try:
+            return self.conn.recv()
+        except (EOFError, OSError):
+            return None
+
+    def flush(self):
+        if self.outbox:
+            try:
+                self.conn.send(self.outbox)
+            except OSError:
+                # Monitor morto: a perda é tratada quando o motor vê o fim da conexão
+                pass
+            self.outbox = []
+
+
+class ShardPool:
+    # Usado só pela thread do motor (ver SamplerEngine): cada job vai para o monitor com menos jobs
+    def __init__(self, workers, tracker=None, start_method="spawn"):
+        if workers > 1 and tracker is None:
+            raise ValueError("mais de um monitor exige um rastreador de filhos (--eventos-processos)")
+        context = multiprocessing.get_context(start_method)
+        self.shards = [Shard(context, index, tracker) for index in range(workers)]
+        self.shard_of = {}
+        # Estatísticas: relatórios recebidos e CPU gasta pelos monitores nas varreduras
+        self.reports = 0
+        self.worker_cpu = 0.0
+
+    def __len__(self):
+        return len(self.shards)
+
+    def add(self, fms):
+        # False quando não resta monitor vivo e o job fica com o motor
+        if not self.shards:
+            return False
+        pid = fms.process.pid
+        shard = min(self.shards, key=lambda shard: shard.jobs)
+        shard.jobs += 1
+        self.shard_of[pid] = shard
+        shard.outbox.append(("add", pid, (0.0, fms.pss, fms.memory_detail_interval)))
+        return True
+
+    def schedule(self, fms, interval):
+        shard = self.shard_of.get(fms.process.pid)
+        if shard is not None:
+            shard.outbox.append(("next", fms.process.pid, interval))
+
+    def remove(self, fms):
+        shard = self.shard_of.pop(fms.process.pid, None)
+        if shard is not None:
+            shard.jobs -= 1
+            shard.outbox.append(("remove", fms.process.pid, None))
+
+    def receive(self, shard):
+        message = shard.receive()
+        if message is None:
+            return None
+        report, cpu = message
+        self.reports += 1
+        self.worker_cpu += cpu
+        return report
+
+    def drop(self, shard):
+        # Tira um monitor morto do pool e devolve os pids dos jobs que eram dele
+        self.shards.remove(shard)
+        shard.conn.close()
+        pids = [pid for pid, owner in self.shard_of.items() if owner is shard]
+        for pid in pids:
+            del self.shard_of[pid]
+        return pids
+
+    def flush(self):
+        for shard in self.shards:
+            shard.flush()
+
+    def close(self):
+        shards = list(self.shards)
+        for shard in shards:
+            try:
+                shard.conn.send(None)
+            except OSError:
+                pass
+        for shard in shards:
+            shard.process.join(1.0)
+            if shard.process.is_alive():
+                shard.process.kill()
+            shard.conn.close()
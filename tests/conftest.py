@@ -0,0 +1,19 @@
+# Os módulos do FMS ficam na raiz do repositório, como nos benchmarks
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from main import FMS, CreditManagerPrePago, PostpaidAccrual
+
+
+@pytest.fixture(autouse=True)
+def billing(monkeypatch):
+    # Saldo, leases, CPU pós-paga e ledger são estado de classe: cada teste começa do zero
+    monkeypatch.setattr(CreditManagerPrePago, "total_credits", 0)
+    monkeypatch.setattr(CreditManagerPrePago, "leases", set())
+    monkeypatch.setattr(PostpaidAccrual, "accruals", set())
+    monkeypatch.setattr(FMS, "total_cpu_used", 0)
+    monkeypatch.setattr(FMS, "ledger", None)
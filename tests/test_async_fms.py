@@ -0,0 +1,45 @@
+# Motor asyncio (async_fms.py): término pelo pidfd, acerto final pelo rusage e limites
+
+import asyncio
+
+import pytest
+
+from async_fms import AsyncFMS
+from main import FMS, CreditManagerPrePago
+
+# Dorme e depois gasta CPU: com o intervalo adaptativo recuando durante o sono, o trecho de CPU cai entre a última
+# amostra e o término
+SLEEP_THEN_SPIN = "import time\ntime.sleep(1.0)\nt = time.process_time()\nwhile time.process_time() - t < 0.5: pass"
+
+
+def run(command, limits=(10, 500, 10), pre_pago=False):
+    limit_cpu, limit_mem, limit_time = limits
+    return asyncio.run(AsyncFMS(pre_pago=pre_pago).run(
+        command, {"limit_cpu": limit_cpu, "limit_mem": limit_mem, "limit_time": limit_time},
+    ))
+
+
+def test_cpu_after_last_sample_is_billed_postpaid():
+    result = run(["python3", "-c", SLEEP_THEN_SPIN])
+    assert result["exit_status"] == 0
+    assert result["cpu_time"] >= 0.45
+    assert FMS.total_cpu_used == pytest.approx(result["cpu_time"], abs=1e-4)
+
+
+def test_cpu_after_last_sample_is_billed_prepaid():
+    CreditManagerPrePago.set_total(10.0)
+    result = run(["python3", "-c", SLEEP_THEN_SPIN], pre_pago=True)
+    assert result["cpu_time"] >= 0.45
+    assert CreditManagerPrePago.get_balance() == pytest.approx(10.0 - result["cpu_time"], abs=1e-4)
+
+
+def test_exit_status_and_short_job():
+    result = run(["sh", "-c", "exit 3"])
+    assert result["exit_status"] == 3
+    assert result["kill_reason"] is None
+
+
+def test_time_limit():
+    result = run(["sleep", "30"], limits=(10, 500, 0.3))
+    assert result["kill_reason"] == "tempo"
+    assert result["exit_status"] == -15
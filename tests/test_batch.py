@@ -0,0 +1,81 @@
+# Modo batch (batch.py): leitura do manifesto JSONL, concorrência e resultados
+
+import io
+import json
+
+import pytest
+
+from batch import BatchRunner, parse_job, read_manifest
+from main import CreditManagerPrePago, SamplerEngine
+
+
+def write_manifest(tmp_path, lines):
+    path = tmp_path / "jobs.jsonl"
+    path.write_text("\n".join(line if isinstance(line, str) else json.dumps(line) for line in lines) + "\n")
+    return str(path)
+
+
+def run_manifest(tmp_path, lines, concurrency=2):
+    output = io.StringIO()
+    summary = BatchRunner(output, concurrency, engine=SamplerEngine()).run(write_manifest(tmp_path, lines))
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    return summary, sorted(records, key=lambda record: record["line"])
+
+
+def job(command, **fields):
+    return {"command": command, "limit_cpu": 10, "limit_mem": 256, "limit_time": 10, **fields}
+
+
+def test_parse_job_defaults():
+    parsed = parse_job({"command": "sleep 1", "limit_cpu": "2", "limit_mem": 64, "limit_time": 5})
+    assert parsed["command"] == ["sleep", "1"]
+    assert parsed["limit_cpu"] == 2.0
+    assert not parsed["pre_pago"]
+    assert parsed["priority"] == 0 and parsed["submitter"] == "padrao" and parsed["cores"] is None
+
+
+@pytest.mark.parametrize("bad", [
+    {"command": [], "limit_cpu": 1, "limit_mem": 1, "limit_time": 1},
+    {"command": ["ls", 1], "limit_cpu": 1, "limit_mem": 1, "limit_time": 1},
+    {"command": "ls", "limit_cpu": 1, "limit_mem": 1},
+    {"command": "ls", "limit_cpu": "x", "limit_mem": 1, "limit_time": 1},
+])
+def test_parse_job_rejects_invalid(bad):
+    with pytest.raises((ValueError, KeyError, TypeError)):
+        parse_job(bad)
+
+
+def test_read_manifest_skips_comments_and_reports_bad_lines(tmp_path):
+    path = write_manifest(tmp_path, ["# comentário", "", job("true"), "{não é json"])
+    entries = list(read_manifest(path))
+    assert [number for number, _ in entries] == [3, 4]
+    assert entries[0][1]["command"] == ["true"]
+    assert entries[1][1]["error"].startswith("linha inválida")
+
+
+def test_run_writes_one_result_per_line(tmp_path):
+    summary, records = run_manifest(tmp_path, [
+        job(["sh", "-c", "exit 3"]),
+        job(["sleep", "30"], limit_time=0.3),
+        job(["/nao/existe"]),
+        "{quebrada",
+    ])
+    assert summary["jobs"] == 2 and summary["falhas"] == 2
+    exited, timed_out, missing, broken = records
+    assert exited["exit_status"] == 3 and exited["kill_reason"] is None
+    assert timed_out["kill_reason"] == "tempo"
+    assert missing["error"].startswith("falha ao lançar")
+    assert broken["error"].startswith("linha inválida")
+
+
+def test_concurrency_limit(tmp_path):
+    summary, records = run_manifest(tmp_path, [job(["sleep", "0.3"])] * 3, concurrency=1)
+    assert summary["jobs"] == 3
+    assert summary["tempo"] >= 0.9
+
+
+def test_prepaid_jobs_stop_when_credits_run_out(tmp_path):
+    CreditManagerPrePago.set_total(0.3)
+    summary, records = run_manifest(tmp_path, [job(["sh", "-c", "while :; do :; done"], mode="pre-pago")])
+    assert records[0]["kill_reason"] == "creditos"
+    assert CreditManagerPrePago.get_balance() == pytest.approx(0.0, abs=1e-6)
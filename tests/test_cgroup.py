@@ -0,0 +1,102 @@
+# Backend cgroup v2 (cgroup.py) contra um diretório montado como um cgroupfs falso
+# Os arquivos de interface do kernel são arquivos comuns: o teste confere o que o FMS grava neles (limites, entrada do
+# job) e simula o que o kernel escreveria (cpu.stat, memory.current, memory.events)
+
+import threading
+
+import pytest
+
+from cgroup import CgroupJob, CgroupV2
+from main import FMS, SamplerEngine
+
+
+@pytest.fixture
+def cgroupfs(tmp_path, monkeypatch):
+    # Raiz delegada: controladores disponíveis e nenhum habilitado para os filhos
+    (tmp_path / "cgroup.controllers").write_text("cpuset cpu io memory pids\n")
+    (tmp_path / "cgroup.subtree_control").write_text("")
+    monkeypatch.setenv("FMS_CGROUP_ROOT", str(tmp_path))
+    return tmp_path
+
+
+def run_job(cgroupfs, command, limits, kernel=None):
+    # Lança o job no cgroup falso; kernel(job_dir) grava os arquivos que o kernel manteria, antes da primeira amostra
+    cgroups = CgroupV2.detect()
+    fms = FMS(pre_pago=False)
+    fms.verbose = False
+    fms.cgroups = cgroups
+    fms.limit_cpu, fms.limit_mem, fms.limit_time = limits
+    done = threading.Event()
+    fms.on_finish.append(lambda job: done.set())
+    engine = SamplerEngine()
+    fms.sampler = engine.sampler
+    fms.launch_process(command)
+    job_dir = cgroupfs / fms.cgroup.path.rsplit("/", 1)[1]
+    (job_dir / "cpu.stat").write_text("usage_usec 0\nuser_usec 0\nsystem_usec 0\n")
+    (job_dir / "memory.current").write_text("0\n")
+    if kernel is not None:
+        kernel(job_dir)
+    fms.start_monitoring()
+    engine.add(fms)
+    assert done.wait(10)
+    return fms, job_dir
+
+
+def test_detect_enables_controllers(cgroupfs):
+    cgroups = CgroupV2.detect()
+    assert cgroups is not None and cgroups.root == str(cgroupfs)
+    assert (cgroupfs / "cgroup.subtree_control").read_text() == "+memory +cpu"
+
+
+def test_detect_without_delegation(cgroupfs, monkeypatch):
+    (cgroupfs / "cgroup.controllers").write_text("cpu io pids\n")
+    assert CgroupV2.detect() is None
+    monkeypatch.delenv("FMS_CGROUP_ROOT")
+    assert CgroupV2.detect() is None
+
+
+def test_limits_written(cgroupfs):
+    job = CgroupV2.detect().create(limit_mem_mb=64, cpu_max=0.5)
+    assert (cgroupfs / job.path).is_dir()
+    with open(job.file("memory.max")) as f:
+        assert f.read() == str(64 * 1024 * 1024)
+    with open(job.file("cpu.max")) as f:
+        assert f.read() == "50000 100000"
+
+
+def test_swap_disabled_when_available(tmp_path):
+    (tmp_path / "memory.swap.max").write_text("max\n")
+    CgroupJob(str(tmp_path)).set_limits(limit_mem_mb=16)
+    assert (tmp_path / "memory.swap.max").read_text() == "0"
+
+
+def test_launch_attaches_job(cgroupfs):
+    # O filho grava "0" em cgroup.procs antes do exec, então o job inteiro nasce no cgroup
+    fms, job_dir = run_job(cgroupfs, ["true"], (10, 100, 10))
+    assert (job_dir / "cgroup.procs").read_text() == "0"
+    assert fms.child_spec()["cgroup"] == str(job_dir)
+
+
+def test_accounting_from_cpu_stat(cgroupfs):
+    # A CPU vem de cpu.stat (usage_usec), não da árvore de processos
+    def kernel(job_dir):
+        (job_dir / "cpu.stat").write_text("usage_usec 2500000\nuser_usec 2000000\nsystem_usec 500000\n")
+        (job_dir / "memory.current").write_text(str(8 * 1024 * 1024))
+    fms, _ = run_job(cgroupfs, ["sleep", "5"], (1, 100, 10), kernel)
+    result = fms.result()
+    assert result["kill_reason"] == "cpu"
+    assert result["cpu_time"] == 2.5
+
+
+def test_oom_kill_decoded_from_memory_events(cgroupfs):
+    # Um OOM kill do cgroup (oom_kill em memory.events) vira o motivo "memoria", mesmo sem o FMS ter sinalizado
+    def kernel(job_dir):
+        (job_dir / "memory.events").write_text("low 0\nhigh 0\nmax 4\noom 1\noom_kill 1\noom_group_kill 0\n")
+    fms, job_dir = run_job(cgroupfs, ["sh", "-c", "kill -9 $$"], (10, 100, 10), kernel)
+    assert fms.cgroup.oom_kills == 1
+    assert fms.result()["kill_reason"] == "memoria"
+
+
+def test_memory_events_without_oom(tmp_path):
+    (tmp_path / "memory.events").write_text("low 0\nhigh 2\nmax 0\noom 0\noom_kill 0\n")
+    assert not CgroupJob(str(tmp_path)).oom_killed()
@@ -0,0 +1,158 @@
+# Execução em vários nós (cluster.py): coordenador neste processo e agentes em subprocessos, como em produção
+# O saldo pré-pago e a CPU pós-paga são estado de classe, então cada agente precisa do próprio processo
+
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from batch import parse_job
+from cluster import AgentLink, Coordinator, UsageStream, parse_address
+from main import FMS, CreditManagerPrePago
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_parse_address():
+    assert parse_address("10.0.0.1:7000") == ("10.0.0.1", 7000)
+    assert parse_address("7000") == ("127.0.0.1", 7000)
+
+
+class FakeChannel:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+
+def test_usage_stream_batches_consumption(monkeypatch):
+    monkeypatch.setattr(UsageStream, "flush_interval", 60.0)
+    stream = UsageStream(FakeChannel())
+    try:
+        stream.flush()
+        assert stream.channel.sent == []
+        for op, amount in [("debit", 0.5), ("accrual", 1.0), ("set", 9.0), ("deposit", 2.0), ("debit", 0.25)]:
+            stream.append(op, amount)
+        stream.flush()
+        (message,) = stream.channel.sent
+        assert message["op"] == "usage" and message["debit"] == 0.75 and message["accrual"] == 1.0
+        assert message["first"] <= time.time()
+        stream.flush()
+        assert len(stream.channel.sent) == 1
+    finally:
+        stream.close()
+
+
+def test_choose_least_loaded_agent_with_memory():
+    coordinator = Coordinator()
+    try:
+        big = AgentLink(None, {"name": "a", "slots": 4, "mem_total_mb": 8000, "mem_available_mb": 6000})
+        small = AgentLink(None, {"name": "b", "slots": 1, "mem_total_mb": 1000, "mem_available_mb": 500})
+        coordinator.agents = [big, small]
+        job = coordinator.submit(parse_job({"command": "true", "limit_cpu": 1, "limit_mem": 100, "limit_time": 1}))
+        # Empate de carga (nenhum job): vai para o de mais memória livre
+        assert coordinator.choose(job) is big
+        big.running = {1: None, 2: None}
+        assert coordinator.choose(job) is small
+        small.running = {3: None}
+        assert coordinator.choose(job) is big
+        job.spec["limit_mem"] = 7000
+        assert coordinator.choose(job) is None
+    finally:
+        coordinator.agents = []
+        coordinator.close()
+
+
+@pytest.fixture
+def coordinator():
+    coordinator = Coordinator().start()
+    agents = []
+
+    def add_agent(slots=2):
+        host, port = coordinator.address
+        agent = subprocess.Popen(
+            [sys.executable, "-c", f"from cluster import run_agent; run_agent(({host!r}, {port}), {slots})"],
+            cwd=ROOT, stderr=subprocess.DEVNULL,
+        )
+        agents.append(agent)
+        assert coordinator.wait_agents(len(agents), timeout=10)
+        return agent
+
+    coordinator.add_agent = add_agent
+    yield coordinator
+    coordinator.close()
+    for agent in agents:
+        agent.kill()
+        agent.wait()
+
+
+def submit(coordinator, command, **fields):
+    return coordinator.submit(parse_job({"command": command, "limit_cpu": 10, "limit_mem": 256, "limit_time": 10,
+                                         **fields}))
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_postpaid_jobs_run_on_the_agent(coordinator):
+    coordinator.add_agent()
+    jobs = [submit(coordinator, ["sh", "-c", "exit 5"]), submit(coordinator, ["/nao/existe"]),
+            submit(coordinator, ["true"], limit_mem=10 ** 9)]
+    assert coordinator.wait(10)
+    exited, missing, huge = jobs
+    assert exited.state == "encerrado" and exited.result["exit_status"] == 5 and exited.pid
+    assert exited.result["agent"] == coordinator.agents[0].name
+    assert missing.state == "recusado" and missing.error.startswith("falha ao lançar")
+    assert huge.state == "recusado" and huge.error == "não cabe em nenhum agente (memoria_total)"
+    stats = coordinator.stats()
+    assert stats["dispatched"] == 2 and stats["completed"] == 3 and stats["running"] == 0
+
+
+def test_usage_reaches_the_coordinator(coordinator):
+    coordinator.add_agent()
+    CreditManagerPrePago.set_total(5.0)
+    spin = ["sh", "-c", "while :; do :; done"]
+    prepaid = submit(coordinator, spin, limit_cpu=0.3, mode="pre-pago")
+    postpaid = submit(coordinator, spin, limit_cpu=0.3)
+    assert coordinator.wait(10)
+    assert prepaid.result["kill_reason"] == "cpu" and postpaid.result["kill_reason"] == "cpu"
+    # A CPU pós-paga chega pelos lotes de uso; a sobra da lease volta quando o agente fica sem jobs pré-pagos
+    assert FMS.total_cpu_used == pytest.approx(postpaid.result["cpu_time"], abs=1e-3)
+    link = coordinator.agents[0]
+    # A lease do agente continua aberta enquanto ele estiver conectado
+    assert wait_for(lambda: abs(link.lease.available) < 1e-6)
+    assert CreditManagerPrePago.get_balance() == pytest.approx(5.0 - prepaid.result["cpu_time"], abs=1e-3)
+    assert coordinator.ledger_lag.count >= 1
+
+
+def test_lost_agent_returns_its_lease(coordinator):
+    agent = coordinator.add_agent()
+    CreditManagerPrePago.set_total(5.0)
+    # O agente morto não mata o job (que tem a própria sessão): ele termina sozinho logo depois do teste
+    job = submit(coordinator, ["sleep", "3"], limit_cpu=2.0, mode="pre-pago")
+    assert wait_for(lambda: job.state == "executando")
+    assert CreditManagerPrePago.total_credits == pytest.approx(3.0)
+    agent.kill()
+    assert coordinator.wait(10)
+    assert job.state == "perdido" and "perdida" in job.error
+    assert CreditManagerPrePago.total_credits == pytest.approx(5.0, abs=1e-3)
+    assert coordinator.agents == []
+
+
+def test_cancel(coordinator):
+    queued = submit(coordinator, ["sleep", "30"])
+    assert coordinator.cancel(queued) and queued.state == "cancelado"
+    coordinator.add_agent()
+    running = submit(coordinator, ["sleep", "30"])
+    assert wait_for(lambda: running.state == "executando")
+    assert coordinator.cancel(running)
+    assert coordinator.wait(10)
+    assert running.result["kill_reason"] == "cancelado"
+    assert not coordinator.cancel(running)
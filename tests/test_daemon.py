@@ -0,0 +1,166 @@
+# Modo daemon (daemon.py) e cliente fmsctl.py: protocolo pelo socket Unix, jobs, fila e cobrança
+
+import os
+import socket
+import stat
+import threading
+import time
+
+import pytest
+
+import fmsctl
+from daemon import Daemon, DaemonServer
+from fmsctl import Client
+from main import CreditManagerPrePago, PostpaidAccrual, SamplerEngine
+from scheduler import JobQueue
+
+
+def start_server(path, queue=None):
+    engine = queue.engine if queue is not None else SamplerEngine()
+    server = DaemonServer(str(path), Daemon(engine, queue))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "fms.sock"
+
+
+@pytest.fixture
+def server(path):
+    server = start_server(path)
+    yield server
+    server.shutdown()
+    server.server_close()
+    server.daemon.shutdown(timeout=5)
+
+
+@pytest.fixture
+def client(server):
+    client = Client(server.path)
+    yield client
+    client.close()
+
+
+def job(command, **fields):
+    return {"command": command, "limit_cpu": 10, "limit_mem": 256, "limit_time": 10, **fields}
+
+
+def test_submit_and_watch_until_the_end(client):
+    response = client.request("submit", **job(["sh", "-c", "sleep 0.2; exit 3"]))
+    assert response["ok"] and response["job"]["state"] == "executando" and response["job"]["pid"]
+    job_id = response["job"]["job"]
+    updates = list(client.stream("watch", job=job_id, interval=0.05))
+    assert all(update["ok"] for update in updates)
+    assert [update["final"] for update in updates][-1] and not any(update["final"] for update in updates[:-1])
+    final = updates[-1]["job"]
+    assert final["state"] == "encerrado" and final["exit_status"] == 3 and final["kill_reason"] is None
+    # A mesma conexão continua atendendo depois do watch
+    assert client.request("status", job=job_id)["job"]["exit_status"] == 3
+    assert [entry["job"] for entry in client.request("jobs")["jobs"]] == [job_id]
+
+
+def test_cancel_running_job(client):
+    job_id = client.request("submit", **job(["sleep", "30"]))["job"]["job"]
+    assert client.request("cancel", job=job_id)["ok"]
+    final = list(client.stream("watch", job=job_id, interval=0.05))[-1]["job"]
+    assert final["kill_reason"] == "cancelado"
+    assert client.request("cancel", job=job_id) == {"ok": False, "error": "o job já está encerrado"}
+
+
+def test_errors_keep_the_connection(client):
+    assert client.request("submit", **job(["/nao/existe"]))["error"].startswith("falha ao lançar")
+    assert client.request("status", job=99) == {"ok": False, "error": "job desconhecido: 99"}
+    assert not client.request("submit", command=[])["ok"]
+    assert client.request("voar") == {"ok": False, "error": "operação desconhecida: voar"}
+    assert not client.request("deposit", amount=-1)["ok"]
+    client.sock.sendall(b"{nao e json\n[1, 2]\n")
+    assert not client.receive()["ok"]
+    assert client.receive() == {"ok": False, "error": "a requisição deve ser um objeto JSON"}
+    assert client.request("balance")["ok"]
+
+
+def test_balance_deposit_and_pay(client):
+    assert client.request("deposit", amount=5)["credits"] == pytest.approx(5.0)
+    accrual = PostpaidAccrual()
+    accrual.debit(2.0)
+    accrual.close()
+    assert client.request("balance") == {"ok": True, "credits": pytest.approx(5.0), "postpaid_cpu": pytest.approx(2.0)}
+    # O pagamento quita até o devido; o excedente não vira crédito
+    response = client.request("pay", amount=3.0)
+    assert response["paid"] == pytest.approx(2.0) and response["postpaid_cpu"] == pytest.approx(0.0)
+    assert CreditManagerPrePago.get_balance() == pytest.approx(5.0)
+
+
+def test_stats(client):
+    response = client.request("stats")
+    assert response["ok"] and response["queue"] is None
+    assert "samples" in response["engine"]
+
+
+def test_queue_states(path):
+    queue = JobQueue(engine=SamplerEngine(), max_running=1).start()
+    server = start_server(path, queue)
+    client = Client(server.path)
+    try:
+        first = client.request("submit", **job(["sleep", "30"]))["job"]
+        # A fila lança o job na própria thread
+        deadline = time.monotonic() + 5
+        while client.request("status", job=first["job"])["job"]["state"] == "fila" and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert client.request("status", job=first["job"])["job"]["state"] == "executando"
+        second = client.request("submit", **job(["true"]))["job"]
+        assert second["state"] == "fila" and second["position"] == 1
+        assert client.request("cancel", job=second["job"])["job"]["state"] == "cancelado"
+        assert client.request("cancel", job=first["job"])["ok"]
+        final = list(client.stream("watch", job=first["job"], interval=0.05))[-1]["job"]
+        assert final["state"] == "encerrado" and final["kill_reason"] == "cancelado"
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_socket_permissions_and_stale_socket(path):
+    # Socket deixado por um daemon que morreu: removido; com um daemon atendendo: recusado
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(str(path))
+    stale.close()
+    server = start_server(path)
+    try:
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+        with pytest.raises(OSError):
+            DaemonServer(str(path), Daemon(SamplerEngine()))
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert not path.exists()
+
+
+def test_history_keeps_the_newest_finished_jobs(monkeypatch):
+    monkeypatch.setattr(Daemon, "history", 2)
+    daemon = Daemon(SamplerEngine())
+    entries = [daemon.submit(job(["/nao/existe"])) for _ in range(4)]
+    assert list(daemon.jobs) == [entry.id for entry in entries[2:]]
+
+
+def test_fmsctl(server, capsys):
+    assert fmsctl.main(["--socket", server.path, "creditos", "2.5"]) == 0
+    assert capsys.readouterr().out == "Créditos: R$2.50 | CPU pós-paga: 0.00s\n"
+    assert fmsctl.main(["--socket", server.path, "enviar", "--cpu", "5", "--mem", "64", "--tempo", "5",
+                        "--acompanhar", "--", "sh", "-c", "exit 4"]) == 0
+    assert capsys.readouterr().out.splitlines()[-1].endswith("| saída 4")
+    assert fmsctl.main(["--socket", server.path, "status", "42"]) == 1
+    assert capsys.readouterr().err == "Erro: job desconhecido: 42\n"
+    assert fmsctl.main(["--socket", server.path + ".outro", "saldo"]) == 2
+
+
+def test_socket_path(monkeypatch):
+    monkeypatch.setenv("FMS_SOCKET", "/tmp/x.sock")
+    assert fmsctl.socket_path() == "/tmp/x.sock"
+    monkeypatch.delenv("FMS_SOCKET")
+    monkeypatch.setenv("XDG_RUNTIME_DIR", "/run/user/1000")
+    assert fmsctl.socket_path() == "/run/user/1000/fms.sock"
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    assert fmsctl.socket_path() == f"/tmp/fms-{os.getuid()}.sock"
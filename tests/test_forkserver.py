@@ -0,0 +1,120 @@
+# Fork server (forkserver.py): lançamento, pipes de saída por SCM_RIGHTS, aviso de término e pool de interpretadores
+
+import os
+import resource
+import select
+import sys
+import threading
+
+import pytest
+
+from forkserver import ForkServer, python_entry
+from main import FMS, SamplerEngine
+
+
+def test_python_entry():
+    env = {"PATH": os.path.dirname(sys.executable)}
+    python = sys.executable
+    assert python_entry([python, "-c", "pass", "x"], env) == ("code", "pass", ["-c", "x"])
+    assert python_entry([python, "-m", "json.tool"], env) == ("module", "json.tool", ["-m"])
+    assert python_entry([python, "job.py", "1"], env) == ("script", "job.py", ["job.py", "1"])
+    # Opções do interpretador e outros executáveis rodam por exec
+    assert python_entry([python, "-u", "job.py"], env) is None
+    assert python_entry(["sh", "-c", "true"], env) is None
+    assert python_entry([python], env) is None
+
+
+@pytest.fixture
+def server():
+    server = ForkServer()
+    yield server
+    server.close()
+
+
+def read_all(fd):
+    chunks = []
+    while chunk := os.read(fd, 4096):
+        chunks.append(chunk)
+    os.close(fd)
+    return b"".join(chunks)
+
+
+def spawn(server, argv, spec=None):
+    # Lança com stdout e stderr em pipes próprios e devolve (handle, saída, erro)
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    try:
+        handle = server.spawn(argv, spec, stdout=out_w, stderr=err_w)
+    finally:
+        os.close(out_w)
+        os.close(err_w)
+    handle.release()
+    return handle, read_all(out_r), read_all(err_r)
+
+
+def test_spawn_passes_the_output_pipes(server):
+    handle, out, err = spawn(server, ["sh", "-c", "echo saida; echo erro >&2; exit 3"])
+    assert (out, err) == (b"saida\n", b"erro\n")
+    assert handle.wait(5) == 3
+    assert handle.rusage is not None and handle.launcher_maxrss > 0
+
+
+def test_exit_fd_becomes_readable(server):
+    handle = server.spawn(["sleep", "0.1"])
+    fd = handle.exit_fd()
+    assert handle.exit_fd() is None
+    assert select.select([fd], [], [], 0)[0] == []
+    # O servidor só recolhe o job depois do release()
+    handle.release()
+    assert select.select([fd], [], [], 5)[0] == [fd]
+    os.close(fd)
+    assert handle.poll() == 0
+
+
+def test_spec_is_applied_in_the_child(server, tmp_path, monkeypatch):
+    # Com rlimits e outro diretório o servidor usa fork e exec em vez do posix_spawn
+    spec = {"session": True, "rlimits": [[resource.RLIMIT_NOFILE, 64, 64]]}
+    monkeypatch.chdir(tmp_path)
+    handle, out, _ = spawn(server, ["sh", "-c", 'ulimit -n; pwd; test "$(ps -o sid= -p $$)" -eq $$'], spec)
+    assert out.split() == [b"64", str(tmp_path).encode()]
+    assert handle.wait(5) == 0
+
+
+@pytest.mark.parametrize("spec", [None, {"rlimits": [[resource.RLIMIT_NOFILE, 64, 64]]}])
+def test_exec_failure_raises(server, spec):
+    with pytest.raises(FileNotFoundError):
+        server.spawn(["/nao/existe"], spec)
+
+
+def test_pool_runs_python_jobs():
+    server = ForkServer(pool_size=1)
+    try:
+        handle, out, _ = spawn(server, [sys.executable, "-c", "import sys; print(sys.argv); sys.exit(4)", "a"])
+        assert out == b"['-c', 'a']\n"
+        assert handle.wait(5) == 4
+        # O membro do pool é o próprio job: o ru_maxrss dele não tem a imagem de outro lançador
+        assert handle.launcher_maxrss == 0
+    finally:
+        server.close()
+
+
+def test_lost_server_ends_the_jobs(server):
+    handle = server.spawn(["sleep", "30"])
+    handle.release()
+    server.process.kill()
+    assert handle.wait(5) == -9
+    with pytest.raises(OSError):
+        server.spawn(["true"])
+
+
+def test_fms_job_through_the_fork_server(server):
+    fms = FMS(pre_pago=False)
+    fms.verbose = False
+    fms.forkserver = server
+    fms.limit_cpu, fms.limit_mem, fms.limit_time = 10, 512, 10
+    done = threading.Event()
+    fms.on_finish.append(lambda job: done.set())
+    fms.start_process(["sh", "-c", "exit 2"], SamplerEngine())
+    assert done.wait(10)
+    assert fms.popen.returncode == 2
+    assert fms.launcher_maxrss == fms.popen.launcher_maxrss > 0
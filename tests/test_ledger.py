@@ -0,0 +1,94 @@
+# Ledger persistente (ledger.py): reaplicação do log, cauda incompleta e compactação por snapshot
+
+import json
+
+import pytest
+
+from ledger import Ledger
+from main import FMS, CreditLease, CreditManagerPrePago
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "fms.ledger")
+
+
+def write_log(path, records, tail=b""):
+    with open(path, "wb") as f:
+        for seq, (op, amount) in enumerate(records, 1):
+            f.write(json.dumps({"seq": seq, "op": op, "amount": amount}).encode() + b"\n")
+        f.write(tail)
+
+
+def test_replay_after_crash(path):
+    # Sem close(): o que passou pelo sync() está no log e é reaplicado na abertura seguinte
+    ledger = Ledger(path)
+    for op, amount in [("set", 10.0), ("debit", 2.0), ("refund", 0.5), ("deposit", 1.0),
+                       ("accrual", 1.5), ("payment", 0.5)]:
+        ledger.append(op, amount)
+    ledger.sync()
+    reopened = Ledger(path)
+    assert reopened.credits == pytest.approx(9.5)
+    assert reopened.cpu_used == pytest.approx(1.0)
+    assert reopened.seq == 6
+    reopened.close()
+    ledger.close()
+
+
+@pytest.mark.parametrize("tail", [
+    b'{"seq": 3, "op": "deb',
+    # JSON completo, mas sem o fim de linha: a escrita pode ter parado antes do "\n"
+    b'{"seq": 3, "op": "debit", "amount": 1.0}',
+])
+def test_torn_tail_is_discarded(path, tail):
+    write_log(path, [("set", 5.0), ("debit", 1.0)], tail)
+    ledger = Ledger(path)
+    assert ledger.credits == pytest.approx(4.0) and ledger.seq == 2
+    # O próximo registro começa numa linha nova e sobrevive à próxima abertura
+    ledger.append("debit", 0.5)
+    ledger.sync()
+    with open(path, "rb") as f:
+        lines = f.read().splitlines()
+    assert [json.loads(line)["seq"] for line in lines] == [1, 2, 3]
+    assert Ledger(path).credits == pytest.approx(3.5)
+
+
+def test_snapshot_compacts_the_log(path):
+    ledger = Ledger(path)
+    ledger.snapshot_every = 3
+    for amount in (10.0, 1.0, 1.0, 1.0):
+        ledger.append("set" if amount == 10.0 else "debit", amount)
+        ledger.sync()
+    with open(path + ".snapshot") as f:
+        assert json.load(f) == {"seq": 3, "credits": 8.0, "cpu_used": 0.0}
+    with open(path, "rb") as f:
+        assert [json.loads(line)["seq"] for line in f] == [4]
+    assert Ledger(path).credits == pytest.approx(7.0)
+
+
+def test_records_already_in_snapshot_are_skipped(path):
+    # Queda entre o snapshot e o truncamento do log: os registros até o seq do snapshot não são reaplicados
+    write_log(path, [("set", 10.0), ("debit", 1.0), ("debit", 1.0)])
+    with open(path + ".snapshot", "w") as f:
+        json.dump({"seq": 2, "credits": 9.0, "cpu_used": 0.0}, f)
+    assert Ledger(path).credits == pytest.approx(8.0)
+
+
+def test_close_leaves_only_the_snapshot(path):
+    ledger = Ledger(path)
+    ledger.append("set", 3.0)
+    ledger.close()
+    with open(path, "rb") as f:
+        assert f.read() == b""
+    assert Ledger(path).credits == pytest.approx(3.0)
+
+
+def test_open_ledger_restores_and_records_billing(path):
+    ledger = FMS.open_ledger(path)
+    CreditManagerPrePago.set_total(2.0)
+    lease = CreditLease()
+    assert lease.debit(0.5)
+    lease.close()
+    ledger.sync()
+    FMS.open_ledger(path)
+    assert CreditManagerPrePago.total_credits == pytest.approx(1.5)
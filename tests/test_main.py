@@ -0,0 +1,400 @@
+# Cobrança, limites e motor de amostragem do FMS (main.py)
+
+import resource
+import signal
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from main import FMS, CreditLease, CreditManagerPrePago, PostpaidAccrual, SamplerEngine
+from sampling import ProcessTree, ProcSampler, Sample
+
+
+def test_lease_debits_from_reserved_chunk():
+    CreditManagerPrePago.set_total(10.0)
+    lease = CreditLease()
+    assert lease.debit(0.5)
+    # Bloco de lease_chunk (1.0), do qual o débito já saiu
+    assert lease.available == pytest.approx(0.5)
+    assert CreditManagerPrePago.total_credits == pytest.approx(9.0)
+    assert CreditManagerPrePago.get_balance() == pytest.approx(9.5)
+    lease.close()
+    assert CreditManagerPrePago.total_credits == pytest.approx(9.5)
+    assert not CreditManagerPrePago.leases
+
+
+def test_failed_debit_keeps_nothing():
+    CreditManagerPrePago.set_total(1.0)
+    lease = CreditLease()
+    assert not lease.debit(5.0)
+    assert lease.available == 0.0 and lease.spent == 0.0
+    assert CreditManagerPrePago.total_credits == pytest.approx(1.0)
+
+
+def test_failed_debit_leaves_free_balance_to_other_leases():
+    # O débito que falha em uma lease não pode levar o saldo livre de que a outra precisa
+    CreditManagerPrePago.set_total(1.0)
+    a, b = CreditLease(), CreditLease()
+    assert b.debit(0.01)
+    assert b.available == pytest.approx(0.24)
+    assert not a.debit(5.0)
+    assert a.available == 0.0
+    assert CreditManagerPrePago.total_credits == pytest.approx(0.75)
+    assert b.debit(0.3)
+    assert CreditManagerPrePago.get_balance() == pytest.approx(0.69)
+
+
+def test_exhaustion_is_exact():
+    # Com uma lease só, o débito que cabe no saldo passa e o seguinte, que não cabe, falha sem gastar nada
+    CreditManagerPrePago.set_total(1.0)
+    lease = CreditLease()
+    assert lease.debit(0.6)
+    assert lease.debit(0.4)
+    assert not lease.debit(0.01)
+    assert lease.spent == pytest.approx(1.0)
+    assert CreditManagerPrePago.get_balance() == pytest.approx(0.0)
+
+
+def test_drain_takes_what_is_left():
+    CreditManagerPrePago.set_total(1.0)
+    lease = CreditLease()
+    assert lease.debit(0.2)
+    lease.drain(5.0)
+    assert lease.spent == pytest.approx(1.0)
+    assert CreditManagerPrePago.get_balance() == pytest.approx(0.0)
+
+
+def test_postpaid_total_includes_running_jobs():
+    # Abaixo de flush_threshold nada chega ao FMS.total_cpu_used, mas a conta já inclui o acumulado
+    running, finished = PostpaidAccrual(), PostpaidAccrual()
+    running.debit(0.4)
+    finished.debit(0.3)
+    finished.close()
+    assert FMS.total_cpu_used == pytest.approx(0.3)
+    assert PostpaidAccrual.total() == pytest.approx(0.7)
+    assert PostpaidAccrual.accruals == {running}
+
+
+def test_postpaid_pay_covers_pending():
+    running = PostpaidAccrual()
+    running.debit(0.4)
+    assert PostpaidAccrual.pay(1.0) == pytest.approx(0.4)
+    assert PostpaidAccrual.total() == pytest.approx(0.0)
+    running.debit(0.1)
+    running.close()
+    assert FMS.total_cpu_used == pytest.approx(0.1)
+    assert PostpaidAccrual.total() == pytest.approx(0.1)
+
+
+def test_partial_reserve_for_agents():
+    # O coordenador reserva o que houver para um agente (ver cluster.py), mesmo abaixo do pedido
+    CreditManagerPrePago.set_total(1.0)
+    lease = CreditLease()
+    assert CreditManagerPrePago.reserve(lease, 3.0) == pytest.approx(1.0)
+    CreditManagerPrePago.release(lease, 0.4)
+    assert lease.available == pytest.approx(0.6)
+    assert CreditManagerPrePago.total_credits == pytest.approx(0.4)
+
+
+def run_job(command, limits, pre_pago=False, engine=None, **options):
+    # Lança o job num motor próprio e espera o término; options sobrescreve atributos do FMS (use_rlimits, ...)
+    fms = FMS(pre_pago=pre_pago)
+    fms.verbose = False
+    for name, value in options.items():
+        setattr(fms, name, value)
+    fms.limit_cpu, fms.limit_mem, fms.limit_time = limits
+    done = threading.Event()
+    fms.on_finish.append(lambda job: done.set())
+    fms.start_process(command, engine or SamplerEngine())
+    assert done.wait(20)
+    return fms
+
+
+def exited_job(returncode, own_cpu=0.0, children_cpu=0.0, cpu_limit=2):
+    # Job já recolhido, com rlimits armados, para conferir só a decodificação do status de saída
+    fms = FMS()
+    fms.use_rlimits = True
+    fms.terminating = False
+    fms.rlimit_values = {
+        resource.RLIMIT_CPU: (cpu_limit, cpu_limit + 1),
+        resource.RLIMIT_AS: (2 ** 30, 2 ** 30),
+    }
+    fms.process = SimpleNamespace(pid=1234)
+    fms.popen = SimpleNamespace(returncode=returncode)
+    fms.rusage = SimpleNamespace(ru_utime=own_cpu + children_cpu, ru_stime=0.0)
+    fms.tree_process = ProcessTree(1234)
+    fms.tree_process.nodes[1234] = Sample(1234, 1, "R", own_cpu, children_cpu, 0)
+    return fms
+
+
+def test_kernel_reason_sigxcpu():
+    assert exited_job(-signal.SIGXCPU).kernel_exit_reason()[1] == "cpu"
+
+
+def test_kernel_reason_sigkill_at_hard_limit():
+    assert exited_job(-signal.SIGKILL, own_cpu=3.01).kernel_exit_reason()[1] == "cpu"
+
+
+def test_kernel_reason_sigkill_counts_only_the_root():
+    # CPU dos filhos recolhidos pela raiz não conta para o RLIMIT_CPU dela
+    assert exited_job(-signal.SIGKILL, own_cpu=1.0, children_cpu=5.0).kernel_exit_reason() is None
+
+
+@pytest.mark.parametrize("returncode", [12, -signal.SIGSEGV, -signal.SIGABRT, -signal.SIGBUS])
+def test_kernel_reason_ignores_plain_exit_status(returncode):
+    assert exited_job(returncode).kernel_exit_reason() is None
+
+
+def test_rlimit_exit_12_is_not_memory():
+    fms = run_job(["sh", "-c", "exit 12"], (10, 256, 10), use_rlimits=True)
+    assert fms.popen.returncode == 12
+    assert fms.reason is None
+
+
+def test_rlimit_cpu_kills_with_sigxcpu():
+    # Com a amostra seguinte marcada para depois do limite, quem barra o job é o kernel, no "soft" do RLIMIT_CPU
+    fms = run_job(
+        ["sh", "-c", "while :; do :; done"], (1, 256, 20),
+        use_rlimits=True, adaptive_interval=False, interval=10.0,
+    )
+    assert fms.popen.returncode == -signal.SIGXCPU
+    assert fms.reason == "cpu"
+
+
+# A raiz dorme e só depois cria o filho que gasta CPU: ele nasce depois da primeira amostra
+LATE_SPINNER = ["sh", "-c", "sleep 0.3; sh -c 'while :; do :; done'; true"]
+
+
+def test_monitor_loop_sees_late_descendants():
+    fms = FMS(pre_pago=False, sampler=ProcSampler())
+    fms.verbose = False
+    fms.limit_cpu, fms.limit_mem, fms.limit_time = 0.5, 256, 5
+    fms.launch_process(LATE_SPINNER)
+    fms.monitor_loop()
+    assert fms.reason == "cpu"
+    assert fms.cpu_total >= 0.5
+
+
+def test_engine_sees_late_descendants():
+    fms = run_job(LATE_SPINNER, (0.5, 256, 5))
+    assert fms.reason == "cpu"
+
+
+def test_engine_job_lookup():
+    engine = SamplerEngine()
+    fms = FMS(pre_pago=False)
+    fms.verbose = False
+    fms.limit_cpu, fms.limit_mem, fms.limit_time = 10, 256, 10
+    fms.start_process(["sleep", "0.2"], engine)
+    assert engine.job(fms.process.pid) is fms
+    deadline = time.monotonic() + 5
+    while engine.active_jobs() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert engine.job(fms.process.pid) is None
+
+
+def test_monitoring_error_kills_and_reaps_the_job(capsys):
+    # Um erro no tick (por exemplo, do backend) mata o job, que é recolhido: sem zumbi e com status de saída
+    def measure():
+        raise RuntimeError("falha de leitura")
+
+    fms = run_job(["sleep", "30"], (10, 256, 60), measure=measure)
+    assert fms.reason == "erro"
+    assert fms.popen.returncode == -signal.SIGKILL
+    assert "falha de leitura" in capsys.readouterr().out
+
+
+def test_exit_detected_by_pidfd():
+    # Com a próxima amostra marcada para daqui a 10 s, o término só pode chegar pelo pidfd
+    engine = SamplerEngine()
+    if not engine.use_pidfd:
+        pytest.skip("sem pidfd_open")
+    start = time.monotonic()
+    fms = run_job(["sleep", "0.3"], (10, 256, 60), engine=engine, adaptive_interval=False, interval=10.0)
+    assert time.monotonic() - start < 2
+    assert fms.popen.returncode == 0
+    assert engine.exit_events == 1
+
+
+def test_exit_detected_by_polling_without_pidfd():
+    engine = SamplerEngine(use_pidfd=False)
+    fms = run_job(["sleep", "0.1"], (10, 256, 60), engine=engine, adaptive_interval=False, interval=0.05)
+    assert fms.popen.returncode == 0
+    assert engine.exit_events == 0 and not engine.pidfds
+
+
+def monitored(limits=(100, 1000, 100)):
+    # FMS no estado do início do monitoramento, sem processo: só o cálculo do intervalo é exercitado
+    fms = FMS(pre_pago=False)
+    fms.limit_cpu, fms.limit_mem, fms.limit_time = limits
+    fms.start_monitoring()
+    # Já depois da amostra do registro (ver test_registration_sample_keeps_the_interval)
+    fms.samples = 2
+    return fms
+
+
+def test_registration_sample_keeps_the_interval():
+    fms = monitored()
+    fms.samples = 1
+    assert fms.next_interval(0.0, 0.0, 0.001) == FMS.interval
+
+
+def test_idle_job_backs_off_to_max_interval():
+    fms = monitored()
+    intervals = [fms.next_interval(0.0, 0.0, fms.current_interval) for _ in range(20)]
+    assert intervals[0] == pytest.approx(FMS.interval * FMS.interval_backoff)
+    assert intervals == sorted(intervals)
+    assert intervals[-1] == FMS.max_interval
+
+
+def test_interval_shrinks_near_cpu_limit():
+    # 1 s de CPU por segundo e 1 s até o limite: a próxima amostra vem em metade do tempo previsto
+    fms = monitored(limits=(10, 1000, 100))
+    fms.cpu_total = 9.0
+    assert fms.next_interval(0.5, 0.0, 0.5) == pytest.approx(0.5)
+    fms.cpu_total = 9.9
+    assert fms.next_interval(0.5, 0.0, 0.5) == FMS.min_interval
+
+
+def test_interval_shrinks_near_memory_limit():
+    fms = monitored(limits=(100, 100, 100))
+    fms.mem_rss_mb = 90.0
+    # 20 MB/s e 10 MB até o limite
+    assert fms.next_interval(0.0, 10.0, 0.5) == pytest.approx(0.25)
+
+
+def test_interval_lands_after_time_limit():
+    fms = monitored(limits=(100, 1000, 10))
+    fms.wall_clock = 9.8
+    fms.current_interval = FMS.max_interval
+    assert fms.next_interval(0.0, 0.0, 1.0) == pytest.approx(0.2 + FMS.min_interval)
+
+
+def test_fixed_interval():
+    fms = monitored()
+    fms.adaptive_interval = False
+    assert fms.next_interval(5.0, 100.0, 0.5) == FMS.interval
+
+
+def test_credit_exhaustion_charges_what_is_left():
+    # O débito que não cabe no saldo encerra o job, mas a CPU já gasta leva o resto do saldo
+    CreditManagerPrePago.set_total(0.3)
+    fms = run_job(["sh", "-c", "while :; do :; done"], (10, 256, 10), pre_pago=True)
+    assert fms.reason == "creditos"
+    assert fms.cpu_total >= 0.3
+    assert CreditManagerPrePago.get_balance() == pytest.approx(0.0, abs=1e-9)
+    assert fms.billing.spent == pytest.approx(0.3)
+
+
+def gone(pid, timeout=2):
+    # Espera o SIGKILL ser entregue; zumbi conta como encerrado, pois o órfão pode ficar esperando o init recolhê-lo
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                if f.read().rsplit(")", 1)[1].split()[0] == "Z":
+                    return True
+        except FileNotFoundError:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_time_limit_kills_the_whole_group(tmp_path):
+    pids = tmp_path / "pids"
+    fms = run_job(["sh", "-c", f"sleep 30 & echo $! >> {pids}; sleep 30 & echo $! >> {pids}; wait"], (10, 256, 0.3))
+    assert fms.reason == "tempo"
+    assert all(gone(pid) for pid in map(int, pids.read_text().split()))
+    assert 0 <= fms.kill_latency < 1
+
+
+def test_setsid_descendant_is_killed(tmp_path):
+    # O descendente com sessão própria escapa do killpg; como estava na árvore amostrada, é sinalizado pelo pid
+    pid_file = tmp_path / "pid"
+    fms = run_job(
+        ["sh", "-c", f"setsid sh -c 'echo $$ > {pid_file}; exec sleep 30' & sleep 30"], (10, 256, 0.5),
+        adaptive_interval=False, interval=0.05,
+    )
+    assert fms.reason == "tempo"
+    assert gone(int(pid_file.read_text()))
+
+
+def test_sigterm_ignored_escalates_to_sigkill():
+    # O motor não fica preso esperando: passado kill_grace, o grupo recebe SIGKILL
+    engine = SamplerEngine()
+    fms = run_job(["sh", "-c", "trap '' TERM; sleep 30"], (10, 256, 0.2), engine=engine, kill_grace=0.3)
+    assert fms.reason == "tempo"
+    assert fms.kill_time is not None
+    assert fms.popen.returncode == -signal.SIGKILL
+    assert 0.3 <= fms.kill_latency < 2
+    # O motor contabiliza o job depois dos callbacks de término, e só então o tira de jobs
+    deadline = time.monotonic() + 2
+    while engine.active_jobs() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert engine.kill_latency.count == 1 and engine.kills == {"tempo": 1}
+    assert fms.result()["kill_latency_s"] == pytest.approx(fms.kill_latency, abs=1e-4)
+
+
+def test_without_process_groups_descendants_are_signaled(tmp_path):
+    pids = tmp_path / "pids"
+    fms = run_job(
+        ["sh", "-c", f"sleep 30 & echo $! > {pids}; wait"], (10, 256, 0.5),
+        process_groups=False, adaptive_interval=False, interval=0.05,
+    )
+    assert fms.pgid is None and fms.reason == "tempo"
+    assert gone(int(pids.read_text()))
+
+
+# Aloca 150 MB, libera e dorme: o pico fica entre as amostras de RSS
+SPIKE = ["python3", "-c", "import time\nx = bytearray(150 * 2**20)\nx[::4096] = b'x' * len(x[::4096])\ndel x\n"
+         "time.sleep(1.2)"]
+
+
+def test_hwm_catches_peak_between_samples():
+    fms = run_job(SPIKE, (10, 1024, 10), adaptive_interval=False, interval=0.5, memory_detail_interval=0.1)
+    result = fms.result()
+    assert max(fms.series.values("rss")) < 100 * 2**20
+    assert result["hwm_rss_mb"] >= 150 and result["peak_rss_mb"] >= 150
+    assert result["peak_rss_bound_mb"] is None
+
+
+class UnreadableSampler(ProcSampler):
+    # Job que sai antes da primeira leitura do /proc
+    def sample(self, pid):
+        return None
+
+
+def test_short_job_keeps_only_the_bound():
+    # Lançado pelo FMS e sem nenhuma amostra, o ru_maxrss do job não passa da imagem do FMS: o pico fica desconhecido
+    fms = run_job(["true"], (10, 256, 10), sampler=UnreadableSampler())
+    result = fms.result()
+    assert fms.samples == 0
+    assert result["peak_rss_mb"] is None and result["hwm_rss_mb"] is None
+    assert 0 < result["peak_rss_bound_mb"] <= fms.launcher_maxrss / 1024
+    assert fms.peak_label().startswith("<= ")
+
+
+def test_fork_server_gives_the_exact_peak():
+    from forkserver import ForkServer
+
+    server = ForkServer()
+    try:
+        fms = run_job(SPIKE[:2] + [SPIKE[2].replace("time.sleep(1.2)", "pass")], (10, 1024, 10), forkserver=server)
+    finally:
+        server.close()
+    result = fms.result()
+    assert fms.launcher_maxrss < 150 * 1024
+    assert result["peak_rss_mb"] >= 150 and result["peak_rss_bound_mb"] is None
+
+
+def test_pss_mode_reports_and_charges_pss():
+    fms = run_job(["sleep", "0.5"], (10, 256, 10), pss=True, memory_detail_interval=0.05)
+    result = fms.result()
+    assert result["pss_mb"] is not None and 0 < result["uss_mb"] <= result["pss_mb"] <= result["peak_pss_mb"]
+    # O limite usa a PSS da última leitura mais o crescimento da RSS desde ela
+    fms.mem_pss_mb, fms.pss_base_rss_mb, fms.mem_rss_mb = 10.0, 30.0, 35.0
+    assert fms.charged_memory_mb() == pytest.approx(15.0)
+    fms.mem_rss_mb = 20.0
+    assert fms.charged_memory_mb() == pytest.approx(10.0)
@@ -0,0 +1,76 @@
+# Endpoint de métricas (metrics.py): histogramas, texto do Prometheus e cache de scrapes
+
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from main import FMS, CreditManagerPrePago, SamplerEngine
+from metrics import Histogram, MetricsServer, label
+
+
+def test_histogram_is_cumulative():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(value)
+    lines = list(histogram.lines("fms_x_seconds", "X"))
+    assert lines == [
+        "# HELP fms_x_seconds X",
+        "# TYPE fms_x_seconds histogram",
+        'fms_x_seconds_bucket{le="0.1"} 2',
+        'fms_x_seconds_bucket{le="1.0"} 3',
+        'fms_x_seconds_bucket{le="+Inf"} 4',
+        "fms_x_seconds_sum 5.65",
+        "fms_x_seconds_count 4",
+    ]
+
+
+def test_label_escaping():
+    assert label('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
+
+
+@pytest.fixture
+def server():
+    server = MetricsServer(SamplerEngine(), port=0).start()
+    yield server
+    server.stop()
+
+
+def scrape(server, path="/metrics"):
+    with urllib.request.urlopen(f"http://127.0.0.1:{server.port}{path}", timeout=5) as response:
+        return response.read().decode()
+
+
+def test_scrape_reports_running_jobs(server):
+    CreditManagerPrePago.set_total(3.0)
+    fms = FMS(pre_pago=False)
+    fms.verbose = False
+    fms.limit_cpu, fms.limit_mem, fms.limit_time = 10, 256, 10
+    fms.start_process(["sleep", "0.5"], server.engine)
+    deadline = time.monotonic() + 5
+    while fms.samples == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    text = scrape(server)
+    assert "fms_active_jobs 1" in text.splitlines()
+    assert "fms_prepaid_credits 3.0" in text.splitlines()
+    assert f'fms_job_processes{{pid="{fms.process.pid}",command="sleep"}} 1' in text
+    assert 'fms_tick_duration_seconds_bucket{le="+Inf"}' in text
+
+
+def test_scrapes_within_ttl_share_the_render(server, monkeypatch):
+    renders = []
+    render = server.render
+    monkeypatch.setattr(server, "render", lambda: renders.append(1) or render())
+    first = scrape(server)
+    assert scrape(server, "/") == first
+    assert len(renders) == 1 and server.scrapes == 2
+    server.cache_time -= server.cache_ttl
+    scrape(server)
+    assert len(renders) == 2
+
+
+def test_unknown_path(server):
+    with pytest.raises(urllib.error.HTTPError) as error:
+        scrape(server, "/outro")
+    assert error.value.code == 404
@@ -0,0 +1,121 @@
+# Captura da saída dos jobs (output.py): arquivos de log, rotação, cauda em memória e erros de gravação
+
+import errno
+import gzip
+import os
+
+import pytest
+
+from output import JobOutput, LogWriter
+
+
+class FailingFile:
+    # Arquivo cujo write() falha como num disco cheio
+    def __init__(self):
+        self.closed = False
+
+    def write(self, data):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def writer():
+    return LogWriter()
+
+
+def job_output(tmp_path, writer, **options):
+    output = JobOutput(str(tmp_path), writer=writer, **options)
+    output.started(4321)
+    return output
+
+
+def test_streams_go_to_their_logs(tmp_path, writer):
+    output = job_output(tmp_path, writer)
+    out, err = output.streams
+    output.received(out, b"saida\n")
+    output.received(err, b"erro\n")
+    output.close()
+    assert writer.flush(5)
+    assert (tmp_path / "4321.out.log").read_bytes() == b"saida\n"
+    assert (tmp_path / "4321.err.log").read_bytes() == b"erro\n"
+    assert output.tail() == b"saida\nerro\n"
+
+
+def test_tail_is_bounded(tmp_path, writer):
+    output = job_output(tmp_path, writer, tail_bytes=4)
+    output.received(output.streams[0], b"abcdef")
+    output.received(output.streams[0], b"gh")
+    assert output.tail() == b"efgh"
+    output.close()
+
+
+def test_rotation(tmp_path, writer):
+    output = job_output(tmp_path, writer, max_bytes=4, backups=2)
+    out = output.streams[0]
+    for chunk in (b"1111", b"2222", b"3333", b"44"):
+        output.received(out, chunk)
+    output.close()
+    assert writer.flush(5)
+    assert (tmp_path / "4321.out.log").read_bytes() == b"44"
+    assert (tmp_path / "4321.out.1.log").read_bytes() == b"3333"
+    assert (tmp_path / "4321.out.2.log").read_bytes() == b"2222"
+    assert not (tmp_path / "4321.out.3.log").exists()
+
+
+def test_gzip(tmp_path, writer):
+    output = job_output(tmp_path, writer, compress=True)
+    output.received(output.streams[0], b"comprimido\n")
+    output.close()
+    assert writer.flush(5)
+    with gzip.open(tmp_path / "4321.out.log.gz") as f:
+        assert f.read() == b"comprimido\n"
+
+
+def test_write_error_keeps_writer_alive(tmp_path, writer):
+    # O erro fica no stream; a fila esvazia, os pipes voltam a ser lidos e os outros streams seguem gravando
+    output = job_output(tmp_path, writer)
+    out, err = output.streams
+    out.file.close()
+    out.file = FailingFile()
+    output.received(out, b"perdido")
+    output.received(out, b"tambem")
+    output.received(err, b"gravado")
+    assert writer.flush(5)
+    assert writer.pending == 0 and writer.ready()
+    assert out.error.errno == errno.ENOSPC
+    assert out.dropped == len(b"perdido") + len(b"tambem")
+    output.close()
+    assert writer.flush(5)
+    assert writer.thread.is_alive()
+    assert (tmp_path / "4321.err.log").read_bytes() == b"gravado"
+
+
+def test_rotation_error_keeps_writer_alive(tmp_path, writer, monkeypatch):
+    output = job_output(tmp_path, writer, max_bytes=4)
+    out = output.streams[0]
+
+    def replace(src, dst):
+        raise OSError(errno.EIO, "Input/output error")
+
+    monkeypatch.setattr(os, "replace", replace)
+    output.received(out, b"1111")
+    output.received(out, b"2222")
+    assert writer.flush(5)
+    assert out.error.errno == errno.EIO
+    assert out.dropped == 4
+    output.close()
+    assert writer.flush(5)
+    assert writer.thread.is_alive()
+
+
+def test_flush_times_out(writer):
+    # Com a thread presa (um write que não volta), flush() desiste no prazo em vez de travar a saída do programa
+    with writer.condition:
+        writer.pending += 1
+    assert not writer.flush(0.05)
+    with writer.condition:
+        writer.pending -= 1
+    assert writer.flush(1)
@@ -0,0 +1,92 @@
+# Afinidade de CPU (placement.py): topologia NUMA, escolha dos núcleos pela carga e núcleo reservado ao FMS
+
+import os
+import threading
+
+import pytest
+
+from main import FMS, SamplerEngine
+from placement import CpuPlacement, numa_nodes, parse_cpulist
+
+
+def test_parse_cpulist():
+    assert parse_cpulist("0-3,8,10-11\n") == [0, 1, 2, 3, 8, 10, 11]
+    assert parse_cpulist("") == []
+
+
+def write_nodes(root, nodes):
+    for node, cpulist in nodes.items():
+        (root / f"node{node}").mkdir()
+        (root / f"node{node}" / "cpulist").write_text(cpulist + "\n")
+
+
+def test_numa_nodes_from_sysfs(tmp_path):
+    write_nodes(tmp_path, {0: "0-3", 1: "4-7"})
+    assert numa_nodes(range(8), str(tmp_path)) == {0: [0, 1, 2, 3], 1: [4, 5, 6, 7]}
+    # Só os núcleos permitidos ao FMS; um nó sem nenhum deles some
+    assert numa_nodes({4, 5}, str(tmp_path)) == {1: [4, 5]}
+
+
+def test_numa_nodes_falls_back_to_a_single_node(tmp_path):
+    assert numa_nodes({0, 1}, str(tmp_path)) == {0: [0, 1]}
+    # Topologia incompleta (núcleo 8 permitido sem nó): também um nó só
+    write_nodes(tmp_path, {0: "0-3", 1: "4-7"})
+    assert numa_nodes(range(9), str(tmp_path)) == {0: list(range(9))}
+
+
+@pytest.fixture
+def two_nodes():
+    return {0: [0, 1, 2, 3], 1: [4, 5, 6, 7]}
+
+
+def test_jobs_spread_over_nodes_and_cores(two_nodes):
+    placement = CpuPlacement(2, nodes=two_nodes)
+    assert placement.place() == ([0, 1], [0])
+    assert placement.place() == ([4, 5], [1])
+    assert placement.place() == ([2, 3], [0])
+    assert placement.place() == ([6, 7], [1])
+    # Mais jobs que núcleos: compartilham os menos carregados
+    assert placement.place() == ([0, 1], [0])
+    assert placement.load[0] == 2 and placement.load[2] == 1
+
+
+def test_release_returns_the_cores(two_nodes):
+    placement = CpuPlacement(2, nodes=two_nodes)
+    first, _ = placement.place()
+    placement.place()
+    placement.release(first)
+    assert placement.place() == (first, [0])
+
+
+def test_job_larger_than_a_node(two_nodes):
+    placement = CpuPlacement(nodes=two_nodes)
+    cpus, nodes = placement.place(6)
+    assert len(cpus) == 6 and nodes == [0, 1]
+    # Sem cores_per_job, o job recebe todos os núcleos
+    assert placement.place() == (list(range(8)), [0, 1])
+
+
+def test_reserve_keeps_a_core_for_the_fms():
+    placement = CpuPlacement(nodes={0: [0, 1], 1: [2, 3, 4]}, reserve=True)
+    assert placement.reserved == 4
+    assert placement.cpus() == [0, 1, 2, 3]
+    assert placement.place(8)[0] == [0, 1, 2, 3]
+    with pytest.raises(ValueError):
+        CpuPlacement(nodes={0: [0]}, reserve=True)
+
+
+def test_job_is_pinned_and_releases_its_cores():
+    cpu = min(os.sched_getaffinity(0))
+    placement = CpuPlacement(1, nodes={0: [cpu]})
+    fms = FMS(pre_pago=False)
+    fms.verbose = False
+    fms.placement = placement
+    fms.limit_cpu, fms.limit_mem, fms.limit_time = 10, 256, 10
+    done = threading.Event()
+    fms.on_finish.append(lambda job: done.set())
+    # nproc mostra os núcleos da afinidade herdada do fork
+    fms.start_process(["sh", "-c", 'test "$(nproc)" = 1'], SamplerEngine())
+    assert done.wait(10)
+    assert fms.popen.returncode == 0
+    assert fms.result()["placement"] == {"cpus": [cpu], "numa_nodes": [0]}
+    assert placement.load[cpu] == 0
@@ -0,0 +1,129 @@
+# Rastreadores de descendentes (proc_connector.py): arquivo children por thread e eventos do proc connector
+# Os eventos netlink são montados no formato do kernel e entregues ao ProcConnector sem socket; o teste com o
+# socket real é pulado onde o proc connector não entrega eventos (sem CAP_NET_ADMIN, namespace de rede não inicial)
+
+import os
+import signal
+import subprocess
+import threading
+import time
+
+import pytest
+
+from proc_connector import (
+    CN_HEADER, EVENT_HEADER, EVENT_PIDS, NLMSG_HEADER, PROC_EVENT_EXIT, PROC_EVENT_FORK, ProcConnector, TaskChildren,
+    task_children,
+)
+from sampling import ProcessTree, ProcSampler
+
+
+def write_children(root, pid, threads):
+    # threads: {tid: [filhos criados pela thread]}
+    for tid, children in threads.items():
+        directory = root / str(pid) / "task" / str(tid)
+        directory.mkdir(parents=True)
+        (directory / "children").write_text("".join(f"{child} " for child in children))
+
+
+def test_task_children_reads_every_thread(tmp_path):
+    write_children(tmp_path, 100, {100: [101, 102], 105: [103]})
+    assert sorted(task_children(100, str(tmp_path))) == [101, 102, 103]
+    assert task_children(999, str(tmp_path)) == []
+
+
+def event(what, pid, tgid, other=0):
+    # Mensagem netlink com um proc_event; fork: (pai, pai, filho, tgid do filho), exit: (pid, tgid, status, sinal)
+    payload = EVENT_HEADER.pack(what, 0, 0) + EVENT_PIDS.pack(*((other, other, pid, tgid) if what == PROC_EVENT_FORK
+                                                                 else (pid, tgid, 0, 0)))
+    return NLMSG_HEADER.pack(NLMSG_HEADER.size + CN_HEADER.size + len(payload), 3, 0, 0, 0) \
+        + CN_HEADER.pack(1, 1, 0, 0, len(payload), 0) + payload
+
+
+@pytest.fixture
+def connector(tmp_path):
+    # Raiz 100 com um filho 101 já existente no /proc falso
+    write_children(tmp_path, 100, {100: [101]})
+    connector = ProcConnector(str(tmp_path))
+    connector.watch(100)
+    return connector
+
+
+def deliver(connector, *messages):
+    for message in messages:
+        connector.event(message, 0)
+
+
+def test_watch_reads_existing_children(connector):
+    assert connector.children(100) == [101]
+    assert connector.stats()["tracked"] == 2 and connector.stats()["roots"] == 1
+
+
+def test_fork_and_exit_events(connector):
+    deliver(connector, event(PROC_EVENT_FORK, 102, 102, 101), event(PROC_EVENT_FORK, 500, 500, 1))
+    assert connector.children(101) == [102]
+    # Processo fora dos jobs e threads (pid != tgid) não entram na árvore
+    deliver(connector, event(PROC_EVENT_FORK, 103, 101, 101), event(PROC_EVENT_EXIT, 103, 101))
+    assert 500 not in connector.root_of and 103 not in connector.root_of
+    # O filho sai: o neto órfão passa para a raiz
+    deliver(connector, event(PROC_EVENT_EXIT, 101, 101))
+    assert connector.children(100) == [102]
+    # A raiz só sai da árvore no unwatch
+    deliver(connector, event(PROC_EVENT_EXIT, 100, 100))
+    assert connector.children(100) == [102]
+    # Os eventos de processos fora dos jobs também são contados; os de threads, não
+    assert connector.stats() == {"events": 4, "forks": 1, "exits": 2, "resyncs": 0, "tracked": 2, "roots": 1}
+    connector.unwatch(100)
+    assert not connector.root_of and not connector.kids and not connector.parent
+
+
+def test_probe_thread_event(connector):
+    connector.probe = threading.Event()
+    deliver(connector, event(PROC_EVENT_FORK, 12345, os.getpid(), os.getpid()))
+    assert connector.probe.is_set()
+
+
+def test_resync_after_lost_events(connector, tmp_path):
+    # 101 saiu (o neto 102 foi para o init) e 104 nasceu sem que os eventos chegassem
+    deliver(connector, event(PROC_EVENT_FORK, 102, 102, 101))
+    (tmp_path / "100" / "task" / "100" / "children").write_text("")
+    write_children(tmp_path, 102, {102: [104]})
+    connector.resync()
+    assert connector.children(100) == [102]
+    assert connector.children(102) == [104]
+    assert connector.resyncs == 1
+
+
+@pytest.fixture
+def live_connector():
+    connector = ProcConnector()
+    try:
+        connector.start()
+    except OSError as e:
+        pytest.skip(f"proc connector indisponível: {e}")
+    yield connector
+    connector.close()
+
+
+@pytest.mark.parametrize("tracker", ["task", "netlink"])
+def test_tree_with_tracker(tracker, request):
+    if tracker == "task":
+        if not TaskChildren.available():
+            pytest.skip("sem /proc/<pid>/task/<tid>/children")
+        tracker = TaskChildren()
+    else:
+        tracker = request.getfixturevalue("live_connector")
+    sampler = ProcSampler()
+    sampler.tracker = tracker
+    process = subprocess.Popen(["sh", "-c", "sleep 5 & sleep 5 & wait"], start_new_session=True)
+    try:
+        # O ProcessTree chama watch() na primeira atualização e unwatch() no forget()
+        tree = ProcessTree(process.pid)
+        deadline = time.monotonic() + 5
+        while len(tree) < 3 and time.monotonic() < deadline:
+            tree.update(sampler)
+            time.sleep(0.02)
+        assert len(tree) == 3
+    finally:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+        tree.forget(sampler)
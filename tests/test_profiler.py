@@ -0,0 +1,81 @@
+# Autoperfilamento (profiler.py): métodos cronometrados, espera nos locks e resumo
+
+import io
+import threading
+import time
+
+import pytest
+
+from main import FMS, CreditManagerPrePago, SamplerEngine
+from metrics import Histogram
+from profiler import PROFILE_BUCKETS, Profiler, TimedLock
+from sampling import ProcSampler
+
+
+def test_timed_lock_measures_contention():
+    histogram = Histogram(PROFILE_BUCKETS)
+    lock = TimedLock(threading.Lock(), histogram)
+    with lock:
+        pass
+    # Aquisição sem disputa: registrada como espera zero
+    assert histogram.count == 1 and histogram.sum == 0.0
+    lock.acquire()
+    releaser = threading.Timer(0.05, lock.release)
+    releaser.start()
+    with lock:
+        assert lock.locked()
+    releaser.join()
+    assert histogram.count == 3 and histogram.sum >= 0.04
+    assert not lock.locked()
+
+
+def test_install_and_uninstall_restore_originals():
+    engine = SamplerEngine()
+    originals = (FMS.__dict__["tick"], CreditManagerPrePago.__dict__["debit"], FMS.total_cpu_lock, engine.lock)
+    profiler = Profiler().install(engine)
+    try:
+        assert FMS.__dict__["tick"] is not originals[0]
+        assert isinstance(CreditManagerPrePago.__dict__["debit"], classmethod)
+        assert isinstance(FMS.total_cpu_lock, TimedLock) and isinstance(engine.lock, TimedLock)
+    finally:
+        profiler.uninstall()
+    assert (FMS.__dict__["tick"], CreditManagerPrePago.__dict__["debit"], FMS.total_cpu_lock, engine.lock) == originals
+    assert not profiler.installed and not profiler.locks
+
+
+def test_profiled_job(monkeypatch):
+    # O job roda com a instrumentação e o resumo traz os caminhos quentes
+    engine = SamplerEngine(sampler=ProcSampler())
+    profiler = Profiler().install(engine)
+    try:
+        CreditManagerPrePago.set_total(5.0)
+        fms = FMS(pre_pago=True)
+        fms.verbose = False
+        fms.limit_cpu, fms.limit_mem, fms.limit_time = 10, 256, 10
+        done = threading.Event()
+        fms.on_finish.append(lambda job: done.set())
+        fms.start_process(["sleep", "0.3"], engine)
+        assert done.wait(10)
+    finally:
+        profiler.uninstall()
+    calls = {row["nome"]: row["chamadas"] for row in profiler.summary()}
+    assert calls["FMS.tick"] >= 1 and calls["SamplerEngine.sweep"] >= 1
+    assert calls["ProcSampler.sample"] >= 1 and calls["ProcessTree.update"] >= 1
+    assert calls["espera de lock: CreditManagerPrePago.lock"] >= 1
+    stream = io.StringIO()
+    profiler.dump(stream)
+    assert "=== FMS profile" in stream.getvalue() and "FMS.tick" in stream.getvalue()
+
+
+def test_summary_quantiles():
+    profiler = Profiler()
+    histogram = profiler.histogram("caminho")
+    for _ in range(99):
+        histogram.observe(1.5e-6)
+    histogram.observe(0.1)
+    profiler.histogram("sem chamadas")
+    (row,) = profiler.summary()
+    assert row["nome"] == "caminho" and row["chamadas"] == 100
+    # Limite superior do bucket: 2 us para a mediana, e o p99 ainda cai no mesmo bucket
+    assert row["p50_us"] == pytest.approx(2.0) and row["p99_us"] == pytest.approx(2.0)
+    assert row["media_us"] == pytest.approx((99 * 1.5e-6 + 0.1) / 100 * 1e6)
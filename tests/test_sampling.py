@@ -0,0 +1,251 @@
+# Backends de amostragem (sampling.py) contra um /proc falso num diretório temporário
+# Os arquivos stat e statm seguem o formato do kernel; o teste reescreve o conteúdo para simular o processo andando
+# O ProcessTree é testado com um backend em memória (FakeSampler), onde processos somem e são recolhidos à vontade
+
+import errno
+import os
+import signal
+import subprocess
+import time
+
+import pytest
+
+import sampling
+from sampling import ProcessTree, ProcSampler, Sample
+
+TICKS = os.sysconf("SC_CLK_TCK")
+PAGE = os.sysconf("SC_PAGE_SIZE")
+
+
+def write_proc(root, pid, ppid=1, cpu=(0, 0), children_cpu=(0, 0), rss_pages=0, comm="job", state="S"):
+    # cpu e children_cpu em ticks: (utime, stime) e (cutime, cstime)
+    directory = root / str(pid)
+    directory.mkdir(exist_ok=True)
+    fields = [state, ppid, pid, pid, 0, -1, 0, 0, 0, 0, 0, *cpu, *children_cpu, 20, 0, 1, 0, 100]
+    (directory / "stat").write_text(f"{pid} ({comm}) {' '.join(map(str, fields))}\n")
+    (directory / "statm").write_text(f"1000 {rss_pages} 10 1 0 100 0\n")
+
+
+@pytest.fixture
+def proc(tmp_path):
+    (tmp_path / "self").mkdir()
+    (tmp_path / "self" / "stat").write_text("")
+    return tmp_path
+
+
+def test_sample_fields(proc):
+    # O nome do comando pode ter espaços e parênteses
+    write_proc(proc, 100, ppid=7, cpu=(3 * TICKS, TICKS), children_cpu=(2 * TICKS, 0), rss_pages=5,
+               comm="a (b) c", state="R")
+    sample = ProcSampler(str(proc)).sample(100)
+    assert sample.pid == 100 and sample.ppid == 7 and sample.status == "running"
+    assert sample.cpu == pytest.approx(4.0)
+    assert sample.children_cpu == pytest.approx(2.0)
+    assert sample.rss == 5 * PAGE
+
+
+def test_cached_descriptors_are_reread(proc):
+    sampler = ProcSampler(str(proc))
+    write_proc(proc, 100, cpu=(TICKS, 0))
+    assert sampler.sample(100).cpu == pytest.approx(1.0)
+    assert 100 in sampler.fds
+    write_proc(proc, 100, cpu=(5 * TICKS, 0))
+    assert sampler.sample(100).cpu == pytest.approx(5.0)
+    sampler.forget(100)
+    assert 100 not in sampler.fds
+
+
+def test_missing_pid(proc):
+    assert ProcSampler(str(proc)).sample(12345) is None
+
+
+def test_cache_is_bounded(proc):
+    sampler = ProcSampler(str(proc))
+    sampler.max_open = 2
+    for pid in (100, 101, 102):
+        write_proc(proc, pid, rss_pages=pid)
+    assert [sampler.sample(pid).rss for pid in (100, 101, 102)] == [100 * PAGE, 101 * PAGE, 102 * PAGE]
+    assert set(sampler.fds) == {100, 101}
+
+
+def test_max_open_follows_nofile_limit(proc, monkeypatch):
+    monkeypatch.setattr(sampling.resource, "getrlimit", lambda which: (256, 4096))
+    assert ProcSampler(str(proc)).max_open == 32
+
+
+def fail_opens(monkeypatch, count):
+    # Os próximos count os.open falham com EMFILE, como num processo sem descritores livres
+    real_open = os.open
+    state = {"left": count}
+
+    def open_(*args, **kwargs):
+        if state["left"]:
+            state["left"] -= 1
+            raise OSError(errno.EMFILE, "Too many open files")
+        return real_open(*args, **kwargs)
+
+    monkeypatch.setattr(sampling.os, "open", open_)
+
+
+def test_emfile_falls_back_to_uncached_read(proc, monkeypatch):
+    sampler = ProcSampler(str(proc))
+    write_proc(proc, 100)
+    write_proc(proc, 101, cpu=(TICKS, 0))
+    sampler.sample(100)
+    fail_opens(monkeypatch, 1)
+    assert sampler.sample(101).cpu == pytest.approx(1.0)
+    # O cache para de crescer no tamanho em que o limite foi atingido
+    assert sampler.max_open == 1 and set(sampler.fds) == {100}
+
+
+def test_emfile_on_uncached_read_frees_a_cached_pid(proc, monkeypatch):
+    sampler = ProcSampler(str(proc))
+    write_proc(proc, 100)
+    write_proc(proc, 101, cpu=(TICKS, 0))
+    sampler.sample(100)
+    fail_opens(monkeypatch, 2)
+    assert sampler.sample(101).cpu == pytest.approx(1.0)
+    assert sampler.max_open == 0 and not sampler.fds
+    # Sem cache, a próxima leitura de 100 também é feita abrindo e fechando os arquivos
+    assert sampler.sample(100) is not None and not sampler.fds
+
+
+def test_children_from_ppid_scan(proc):
+    sampler = ProcSampler(str(proc))
+    write_proc(proc, 100)
+    write_proc(proc, 101, ppid=100)
+    assert sampler.children(100) == [101]
+    write_proc(proc, 102, ppid=100)
+    # O mapa de ppid vale pela varredura inteira; só é relido na próxima
+    assert sampler.children(100) == [101]
+    sampler.begin_sweep()
+    assert sorted(sampler.children(100)) == [101, 102]
+
+
+def test_matches_live_process():
+    sample = ProcSampler().sample(os.getpid())
+    assert sample.pid == os.getpid() and sample.ppid == os.getppid()
+    assert sample.cpu > 0 and sample.rss > 0
+
+
+class FakeSampler:
+    # Backend em memória para o ProcessTree: processes[pid] = Sample, filhos pelo campo ppid
+    def __init__(self):
+        self.processes = {}
+        self.forgotten = []
+
+    def set(self, pid, ppid, cpu=0.0, children_cpu=0.0, rss=0):
+        self.processes[pid] = Sample(pid, ppid, "running", cpu, children_cpu, rss)
+
+    def sample(self, pid):
+        return self.processes.get(pid)
+
+    def children(self, pid):
+        return [child for child, sample in self.processes.items() if sample.ppid == pid]
+
+    def watch(self, root):
+        pass
+
+    def unwatch(self, root):
+        pass
+
+    def forget(self, pid):
+        self.forgotten.append(pid)
+
+
+@pytest.fixture
+def tree():
+    # Raiz 100 -> filho 101 -> neto 102
+    sampler = FakeSampler()
+    sampler.set(100, 1, cpu=1.0, rss=10)
+    sampler.set(101, 100, cpu=2.0, rss=20)
+    sampler.set(102, 101, cpu=3.0, rss=30)
+    tree = ProcessTree(100)
+    tree.update(sampler)
+    return tree, sampler
+
+
+def test_tree_sums_all_descendants(tree):
+    tree, sampler = tree
+    assert set(tree.nodes) == {100, 101, 102}
+    assert tree.cpu == pytest.approx(6.0) and tree.rss == 60
+
+
+def test_tree_reaped_descendant_is_not_counted_twice(tree):
+    # O neto sai e é recolhido pelo filho: a CPU dele passa para o cutime do filho
+    tree, sampler = tree
+    del sampler.processes[102]
+    sampler.set(101, 100, cpu=2.0, children_cpu=3.0, rss=20)
+    tree.update(sampler)
+    assert set(tree.nodes) == {100, 101}
+    assert tree.cpu == pytest.approx(6.0) and tree.rss == 30
+    assert tree.exited == 1 and tree.exited_cpu == 0.0
+    assert 102 in sampler.forgotten
+
+
+def test_tree_keeps_cpu_of_orphans(tree):
+    # O filho sai e é recolhido pela raiz; o neto, órfão, passa para o init e sai sem ninguém da árvore recolhê-lo:
+    # a última CPU conhecida dele fica em exited_cpu
+    tree, sampler = tree
+    del sampler.processes[101]
+    sampler.set(100, 1, cpu=1.0, children_cpu=2.0, rss=10)
+    sampler.set(102, 1, cpu=3.0, rss=30)
+    tree.update(sampler)
+    assert set(tree.nodes) == {100, 102} and tree.exited_cpu == 0.0
+    del sampler.processes[102]
+    tree.update(sampler)
+    assert set(tree.nodes) == {100}
+    assert tree.exited_cpu == pytest.approx(3.0)
+    assert tree.cpu == pytest.approx(6.0)
+
+
+def test_tree_picks_up_new_descendants(tree):
+    tree, sampler = tree
+    sampler.set(103, 102, cpu=0.5, rss=5)
+    tree.update(sampler)
+    assert 103 in tree.nodes and tree.cpu == pytest.approx(6.5)
+
+
+def test_tree_close_uses_root_rusage(tree):
+    # O rusage da raiz inclui o que ela recolheu; os descendentes ainda vivos são somados por cima
+    tree, sampler = tree
+    del sampler.processes[100]
+    assert tree.close(1.5, sampler) == pytest.approx(6.5)
+    assert set(tree.nodes) == {101, 102}
+
+
+def test_tree_of_live_processes():
+    process = subprocess.Popen(["sh", "-c", "sleep 5 & sleep 5 & wait"], start_new_session=True)
+    try:
+        sampler = ProcSampler()
+        tree = ProcessTree(process.pid)
+        deadline = time.monotonic() + 5
+        while len(tree) < 3 and time.monotonic() < deadline:
+            sampler.begin_sweep()
+            tree.update(sampler)
+            time.sleep(0.02)
+        assert len(tree) == 3
+        assert tree.rss > 0
+    finally:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def test_memory_detail_reads_hwm_and_rollup(proc):
+    write_proc(proc, 100)
+    (proc / "100" / "status").write_text("Name:\tjob\nVmHWM:\t  2048 kB\nVmRSS:\t  1024 kB\n")
+    (proc / "100" / "smaps_rollup").write_text(
+        "Rss:    1024 kB\nPss:     600 kB\nPrivate_Clean:    100 kB\nPrivate_Dirty:    300 kB\n"
+    )
+    sampler = ProcSampler(str(proc))
+    assert sampler.memory_detail(100) == (2048 * 1024, None, None)
+    assert sampler.memory_detail(100, pss=True) == (2048 * 1024, 600 * 1024, 400 * 1024)
+    assert sampler.memory_detail(12345, pss=True) is None
+
+
+def test_tree_memory_detail(tree):
+    # Pico: o maior de um único processo; PSS e USS: soma da árvore (processos que somem no meio são ignorados)
+    tree, sampler = tree
+    details = {100: (50, 10, 5), 101: (80, 20, 10), 102: None}
+    sampler.memory_detail = lambda pid, pss=False: details[pid]
+    assert tree.memory_detail(sampler, pss=True) == (80, 30, 15)
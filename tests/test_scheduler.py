@@ -0,0 +1,150 @@
+# Fila de admissão (scheduler.py): ordem por prioridade e fair share, recursos do host e lançamento no motor
+
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import scheduler
+from main import FMS, CreditManagerPrePago, SamplerEngine
+from scheduler import JobQueue
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def host(monkeypatch):
+    # Host falso com 8 GB, dos quais 4 GB disponíveis; o teste muda available à vontade
+    memory = SimpleNamespace(total=8192 * MB, available=4096 * MB)
+    monkeypatch.setattr(scheduler.psutil, "virtual_memory", lambda: memory)
+    return memory
+
+
+class Job:
+    # Só o que a fila consulta de um FMS (os admitidos vão para um set, então precisa ser hashable)
+    def __init__(self, limit_mem, limit_cpu, pre_pago):
+        self.limit_mem = limit_mem
+        self.limit_cpu = limit_cpu
+        self.pre_pago = pre_pago
+        self.on_finish = []
+
+
+def job(limit_mem=100, limit_cpu=1.0, pre_pago=False):
+    return Job(limit_mem, limit_cpu, pre_pago)
+
+
+def queue(max_running=4):
+    return JobQueue(engine=SamplerEngine(), max_running=max_running)
+
+
+def admitted(queue):
+    with queue.condition:
+        jobs, rejected = queue.schedule()
+    return [job.command[0] for job in jobs], [(job.command[0], reason) for job, reason in rejected]
+
+
+def test_priority_then_arrival(host):
+    q = queue()
+    q.submit(job(), ["a"])
+    q.submit(job(), ["b"], priority=2)
+    q.submit(job(), ["c"])
+    q.submit(job(), ["d"], priority=2)
+    assert admitted(q) == (["b", "d", "a", "c"], [])
+
+
+def test_fair_share_between_submitters(host):
+    # Mesma prioridade: quem tem menos jobs em execução vai antes, mesmo tendo chegado depois
+    q = queue()
+    for name in ("a1", "a2", "a3"):
+        q.submit(job(), [name], submitter="ana")
+    q.submit(job(), ["b1"], submitter="bruno")
+    assert admitted(q) == (["a1", "b1", "a2", "a3"], [])
+
+
+def test_past_usage_orders_submitters(host):
+    q = queue()
+    q.usage = {"ana": 50.0}
+    q.submit(job(), ["a"], submitter="ana")
+    q.submit(job(), ["b"], submitter="bruno")
+    assert admitted(q)[0] == ["b", "a"]
+
+
+def test_head_of_line_is_not_skipped(host):
+    # O primeiro não cabe na memória livre que sobra: o menor, que caberia, espera atrás dele
+    q = queue()
+    q.submit(job(limit_mem=3000), ["grande"])
+    assert admitted(q) == (["grande"], [])
+    q.submit(job(limit_mem=2000), ["medio"], priority=1)
+    q.submit(job(limit_mem=10), ["pequeno"])
+    assert admitted(q) == ([], [])
+    assert q.blocked_by == "memoria" and q.queued() == 2
+
+
+def test_concurrency_limit(host):
+    q = queue(max_running=1)
+    q.submit(job(), ["a"])
+    q.submit(job(), ["b"])
+    assert admitted(q) == (["a"], [])
+    assert q.blocked_by == "concorrencia"
+    (running,) = q.running
+    running.cpu_total = 2.0
+    q.job_finished(running)
+    assert admitted(q) == (["b"], [])
+    assert q.completed == 1 and q.usage["padrao"] == pytest.approx(2.0, rel=1e-3)
+
+
+def test_rejects_what_never_fits(host):
+    q = queue()
+    q.submit(job(limit_mem=10000), ["enorme"])
+    # Sem jobs em execução a memória livre não vai aumentar: recusado em vez de esperar para sempre
+    host.available = 100 * MB
+    q.submit(job(limit_mem=1000), ["sem_memoria"])
+    assert admitted(q) == ([], [
+        ("enorme", "não cabe no host (memoria_total)"),
+        ("sem_memoria", "não cabe no host (memoria)"),
+    ])
+
+
+def test_prepaid_credits_are_committed_to_running_jobs(host):
+    CreditManagerPrePago.set_total(3.0)
+    q = queue()
+    q.submit(job(limit_cpu=2.0, pre_pago=True), ["a"])
+    q.submit(job(limit_cpu=2.0, pre_pago=True), ["b"])
+    q.submit(job(limit_cpu=2.0), ["pos"])
+    # b espera: o saldo de 3.0 menos os 2.0 que a pode gastar não cobre o limit_cpu dele
+    assert admitted(q) == (["a"], [])
+    assert q.blocked_by == "creditos"
+
+
+def test_cancel_and_position(host):
+    q = queue()
+    first = q.submit(job(), ["a"])
+    second = q.submit(job(), ["b"])
+    assert q.position(second) == 2
+    assert q.cancel(first) and not q.cancel(first)
+    assert q.position(second) == 1
+
+
+def test_started_queue_runs_jobs(host):
+    q = JobQueue(engine=SamplerEngine(), max_running=1).start()
+    finished = threading.Semaphore(0)
+    rejected = []
+    jobs = []
+    for command in (["sleep", "0.1"], ["true"], ["/nao/existe"]):
+        fms = FMS(pre_pago=False)
+        fms.verbose = False
+        fms.limit_cpu, fms.limit_mem, fms.limit_time = 10, 64, 10
+        fms.on_finish.append(lambda fms: finished.release())
+        jobs.append(q.submit(fms, command, on_reject=lambda fms, reason: rejected.append(reason) or finished.release()))
+    for _ in jobs:
+        assert finished.acquire(timeout=10)
+    assert rejected and rejected[0].startswith("falha ao lançar")
+    # O job_finished da fila roda depois do callback do teste, na thread do motor
+    deadline = time.monotonic() + 5
+    while q.stats()["completed"] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    stats = q.stats()
+    assert stats["admitted"] == 2 and stats["completed"] == 2 and stats["rejected"] == 1
+    assert stats["running"] == 0 and stats["queued"] == 0
+    assert q.wait_time.count == 2
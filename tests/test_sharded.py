@@ -0,0 +1,114 @@
+# Monitoramento dividido entre processos (sharded.py): relatórios dos monitores e o motor decidindo pelos relatórios
+
+import threading
+import time
+
+import pytest
+
+from main import FMS, SamplerEngine
+from sampling import Sample
+from sharded import ShardPool, WorkerJob
+
+
+class FakeSampler:
+    # Árvore em memória: processes[pid] = Sample; memory_detail devolve (hwm, pss, uss) fixos e conta as leituras
+    def __init__(self):
+        self.processes = {}
+        self.details = 0
+
+    def set(self, pid, ppid, cpu=0.0, rss=0):
+        self.processes[pid] = Sample(pid, ppid, "running", cpu, 0.0, rss)
+
+    def sample(self, pid):
+        return self.processes.get(pid)
+
+    def children(self, pid):
+        return [child for child, sample in self.processes.items() if sample.ppid == pid]
+
+    def memory_detail(self, pid, pss=False):
+        self.details += 1
+        return 100, 50 if pss else None, 20 if pss else None
+
+    def watch(self, root):
+        pass
+
+    def unwatch(self, root):
+        pass
+
+    def forget(self, pid):
+        pass
+
+
+def test_worker_report():
+    sampler = FakeSampler()
+    sampler.set(100, 1, cpu=1.0, rss=10)
+    sampler.set(101, 100, cpu=2.0, rss=20)
+    job = WorkerJob(100, pss=True, detail_interval=60.0)
+    root, cpu, rss, processes, late, detail, pids = job.report(sampler, 0.01)
+    assert (root, cpu, rss, processes, late) == (100, pytest.approx(3.0), 30, 2, 0.01)
+    # Leitura detalhada: maior pico de um processo e soma de PSS e USS da árvore
+    assert detail == (100, 100, 40)
+    assert sorted(pids) == [100, 101]
+    # Mesma árvore e leitura detalhada ainda não vencida: nada além da amostra
+    assert job.report(sampler, 0.0)[5:] == (None, None)
+    assert sampler.details == 2
+    sampler.set(102, 101, cpu=0.5)
+    assert sorted(job.report(sampler, 0.0)[6]) == [100, 101, 102]
+
+
+def test_several_workers_need_a_tracker():
+    with pytest.raises(ValueError):
+        ShardPool(2)
+
+
+@pytest.fixture
+def pool(request):
+    pool = ShardPool(*request.param)
+    yield pool
+    pool.close()
+
+
+def start(engine, command, limit_cpu=10, limit_time=10):
+    fms = FMS(pre_pago=False)
+    fms.verbose = False
+    fms.limit_cpu, fms.limit_mem, fms.limit_time = limit_cpu, 256, limit_time
+    done = threading.Event()
+    fms.on_finish.append(lambda job: done.set())
+    fms.start_process(command, engine)
+    return fms, done
+
+
+SPIN = ["sh", "-c", "sh -c 'while :; do :; done'"]
+
+
+@pytest.mark.parametrize("pool", [(1,), (2, "task")], indirect=True)
+def test_engine_kills_by_the_reports(pool):
+    engine = SamplerEngine(shards=pool)
+    jobs = [start(engine, SPIN, limit_cpu=0.3), start(engine, ["sleep", "0.3"])]
+    for fms, done in jobs:
+        assert done.wait(20)
+    (spinner, _), (sleeper, _) = jobs
+    # A CPU do neto chega pelo relatório do monitor, que também informa os pids da árvore
+    assert spinner.reason == "cpu" and spinner.cpu_total >= 0.3
+    assert sleeper.reason is None and sleeper.popen.returncode == 0
+    # O motor tira o job do monitor depois dos callbacks de término
+    deadline = time.monotonic() + 5
+    while engine.active_jobs() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert pool.reports > 0 and pool.worker_cpu > 0
+    assert not pool.shard_of
+    if len(pool) == 2:
+        assert all(shard.jobs == 0 for shard in pool.shards)
+
+
+@pytest.mark.parametrize("pool", [(1,)], indirect=True)
+def test_dead_worker_hands_jobs_back_to_the_engine(pool):
+    engine = SamplerEngine(shards=pool)
+    fms, done = start(engine, ["sh", "-c", "sleep 0.5; while :; do :; done"], limit_cpu=0.3)
+    deadline = time.monotonic() + 5
+    while fms.samples < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    pool.shards[0].process.kill()
+    assert done.wait(20)
+    assert fms.reason == "cpu"
+    assert len(pool) == 0
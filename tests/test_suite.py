@@ -0,0 +1,55 @@
+# Suíte de benchmark (benchmarks/suite.py): medição de uma carga e detecção de regressões contra a base
+
+import json
+
+import pytest
+
+from benchmarks import suite
+
+
+def test_percentile():
+    assert suite.percentile([], 0.5) == 0.0
+    assert suite.percentile([3, 1, 2], 0.5) == 2
+    assert suite.percentile([1, 2, 3, 4], 1.0) == 4
+
+
+@pytest.fixture(autouse=True)
+def exit_stamp(monkeypatch):
+    # run_workload aponta FMS_BENCH_EXIT para o arquivo de cada job; o ambiente volta ao original no fim do teste
+    monkeypatch.setenv("FMS_BENCH_EXIT", "")
+
+
+def test_idle_workload(tmp_path, monkeypatch):
+    monkeypatch.setitem(suite.WORKLOADS, "ocioso", ("time.sleep(0.3)", 60.0, 1e6, 60.0))
+    result = suite.run_workload("ocioso", 1, str(tmp_path))
+    assert result["jobs"] == 1 and result["motivos"] == ["saida"]
+    assert result["amostras"] > 0
+    # A carga grava o instante de saída: a latência de detecção é medida e positiva
+    assert 0 < result["latencia_saida_max_ms"] < 1000
+    assert result["erro_final_ms"] == pytest.approx(0.0, abs=1.0)
+    assert result["overshoot_cpu_s"] is None
+
+
+def test_cpu_workload_is_killed_by_limit(tmp_path, monkeypatch):
+    monkeypatch.setitem(suite.WORKLOADS, "cpu", ("while True: pass", 0.3, 1e6, 60.0))
+    result = suite.run_workload("cpu", 1, str(tmp_path))
+    assert result["motivos"] == ["cpu"]
+    assert result["overshoot_cpu_s"] >= 0
+    assert result["latencia_saida_max_ms"] is None
+
+
+def test_regressions(tmp_path):
+    base = tmp_path / "base.jsonl"
+    base.write_text("\n".join(json.dumps(record) for record in [
+        {"carga": "cpu", "cpu_motor_por_amostra_us": 100.0, "overshoot_cpu_s": 0.1, "erro_final_ms": None},
+        {"carga": "ocioso", "latencia_saida_max_ms": 2.0},
+    ]) + "\n")
+    results = [
+        # Piora relativa e absoluta: regressão
+        {"carga": "cpu", "cpu_motor_por_amostra_us": 200.0, "overshoot_cpu_s": 0.12, "erro_final_ms": 5.0},
+        # Dobrou, mas abaixo do piso absoluto de 5 ms: ruído
+        {"carga": "ocioso", "latencia_saida_max_ms": 4.0},
+        # Sem base para comparar
+        {"carga": "memoria", "overshoot_mem_mb": 500.0},
+    ]
+    assert suite.regressions(results, str(base), 0.25) == ["cpu: cpu_motor_por_amostra_us 100.0 -> 200.0"]
@@ -0,0 +1,75 @@
+# Série temporal das amostras (timeseries.py): anel, downsample e resumo do job
+
+import pytest
+
+import timeseries
+from timeseries import SampleSeries, percentile
+
+
+def fill(series, count):
+    # Amostra i: instante i, CPU acumulada i / 2, RSS i e i % 3 processos
+    for i in range(count):
+        series.append(float(i), i / 2, float(i), float(i % 3))
+
+
+def test_percentile_interpolates():
+    assert percentile([], 50) == 0.0
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile([0, 10], 95) == pytest.approx(9.5)
+    assert percentile([1, 2, 3, 4], 100) == 4
+
+
+def test_ring_keeps_the_newest_samples():
+    series = SampleSeries(capacity=4)
+    fill(series, 10)
+    assert len(series) == 4
+    assert series.values("time") == [6.0, 7.0, 8.0, 9.0]
+    # Os agregados valem para o job inteiro, não só para o que ficou no buffer
+    assert series.count == 10 and series.rss_peak == 9.0
+    assert series.summary()["rss_mean"] == pytest.approx(4.5)
+
+
+def test_downsample_covers_the_whole_job():
+    series = SampleSeries(capacity=4, downsample=True)
+    fill(series, 8)
+    # Na quinta amostra os 4 pontos viram 2 e cada ponto novo passa a cobrir 2 amostras
+    assert series.stride == 2
+    assert series.values("time") == [1.0, 3.0, 4.0, 6.0]
+    assert series.values("rss") == [1.0, 3.0, 4.0, 6.0]
+    assert series.values("children") == [1.0, 2.0, 1.0, 2.0]
+    # A oitava amostra fica no ponto em formação até completar o par
+    assert series.bucket_count == 1 and series.count == 8
+
+
+def test_downsample_preserves_peaks():
+    series = SampleSeries(capacity=4, downsample=True)
+    for i, rss in enumerate([1, 50, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1]):
+        series.append(float(i), 0.0, float(rss), 1.0)
+    assert max(series.values("rss")) == 50.0
+    assert series.summary()["rss_peak"] == 50.0
+
+
+def test_summary(monkeypatch):
+    monkeypatch.setattr(timeseries, "numpy", None)
+    series = SampleSeries(capacity=8)
+    fill(series, 5)
+    summary = series.summary()
+    assert summary["samples"] == 5
+    assert summary["rss_p50"] == pytest.approx(2.0)
+    assert summary["rss_p95"] == pytest.approx(3.8)
+    assert summary["children_peak"] == 2.0
+    assert summary["cpu_rate"] == pytest.approx(0.5)
+
+
+def test_summary_of_empty_series():
+    summary = SampleSeries().summary()
+    assert summary["samples"] == 0 and summary["rss_mean"] == 0.0 and summary["cpu_rate"] == 0.0
+
+
+def test_numpy_matches_pure_python(monkeypatch):
+    pytest.importorskip("numpy")
+    series = SampleSeries(capacity=16)
+    fill(series, 40)
+    with_numpy = series.summary()
+    monkeypatch.setattr(timeseries, "numpy", None)
+    assert series.summary() == pytest.approx(with_numpy)
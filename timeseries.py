@@ -0,0 +1,150 @@
+# Série temporal das amostras de um job em memória fixa
+# Cada amostra (instante, CPU acumulada, RSS, processos na árvore) vai para quatro arrays('d') de tamanho fixo:
+# - no modo anel, a amostra nova sobrescreve a mais antiga quando o buffer enche
+# - no modo downsample, o buffer cheio é compactado pela metade (pares viram um ponto) e cada ponto passa a cobrir
+#   o dobro de amostras, então a série continua cobrindo o job inteiro com resolução decrescente
+# O pico, a média e o número de amostras são acumulados à parte e valem para o job inteiro; os percentis são
+# calculados sobre o que está no buffer, com NumPy (sem cópia) quando disponível
+# O uso de memória é capacity * 4 * 8 bytes por job, qualquer que seja a duração
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def percentile(values, q):
+    # Percentil com interpolação linear (mesmo resultado do numpy.percentile padrão)
+    values = sorted(values)
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+class SampleSeries:
+    capacity = 512
+
+    def __init__(self, capacity=None, downsample=False):
+        self.capacity = capacity or self.capacity
+        self.downsample = downsample
+        zeros = bytes(8 * self.capacity)
+        self.time = array("d", zeros)
+        self.cpu = array("d", zeros)
+        self.rss = array("d", zeros)
+        self.children = array("d", zeros)
+        # Posição da amostra mais antiga e quantidade de pontos no buffer
+        self.start = 0
+        self.size = 0
+        # Downsample: amostras por ponto e o ponto em formação (máximos de RSS e processos, último instante e CPU)
+        self.stride = 1
+        self.bucket = None
+        self.bucket_count = 0
+        # Agregados do job inteiro, independentes do que ainda está no buffer
+        self.count = 0
+        self.rss_sum = 0.0
+        self.rss_peak = 0.0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, t, cpu, rss, children):
+        self.count += 1
+        self.rss_sum += rss
+        if rss > self.rss_peak:
+            self.rss_peak = rss
+        if self.stride == 1:
+            self.store(t, cpu, rss, children)
+            return
+        if self.bucket is None:
+            self.bucket = [t, cpu, rss, children]
+        else:
+            bucket = self.bucket
+            bucket[0] = t
+            bucket[1] = cpu
+            bucket[2] = max(bucket[2], rss)
+            bucket[3] = max(bucket[3], children)
+        self.bucket_count += 1
+        if self.bucket_count == self.stride:
+            self.store(*self.bucket)
+            self.bucket = None
+            self.bucket_count = 0
+
+    def store(self, t, cpu, rss, children):
+        if self.size == self.capacity:
+            if self.downsample:
+                self.compact()
+            else:
+                self.start = (self.start + 1) % self.capacity
+                self.size -= 1
+        i = (self.start + self.size) % self.capacity
+        self.time[i] = t
+        self.cpu[i] = cpu
+        self.rss[i] = rss
+        self.children[i] = children
+        self.size += 1
+
+    def compact(self):
+        # Junta os pontos dois a dois: instante e CPU do mais recente, máximos de RSS e processos (picos preservados)
+        # No modo downsample o buffer nunca dá a volta, então start é sempre 0
+        half = self.size // 2
+        for i in range(half):
+            j = 2 * i
+            self.time[i] = self.time[j + 1]
+            self.cpu[i] = self.cpu[j + 1]
+            self.rss[i] = max(self.rss[j], self.rss[j + 1])
+            self.children[i] = max(self.children[j], self.children[j + 1])
+        if self.size % 2:
+            last = self.size - 1
+            self.time[half] = self.time[last]
+            self.cpu[half] = self.cpu[last]
+            self.rss[half] = self.rss[last]
+            self.children[half] = self.children[last]
+            half += 1
+        self.size = half
+        self.stride *= 2
+
+    def values(self, field):
+        # Pontos do buffer em ordem cronológica (lista); para cálculos vetorizados use view()
+        data = getattr(self, field)
+        end = self.start + self.size
+        if end <= self.capacity:
+            return data[self.start:end].tolist()
+        return data[self.start:].tolist() + data[:end - self.capacity].tolist()
+
+    def view(self, field):
+        # Visão NumPy sem cópia dos pontos válidos (fora de ordem cronológica quando o anel deu a volta)
+        data = numpy.frombuffer(getattr(self, field), dtype=numpy.float64)
+        if self.size < self.capacity:
+            return data[self.start:self.start + self.size]
+        return data
+
+    def summary(self, percentiles=(50, 95, 99)):
+        # Resumo da série: pico e média do job inteiro, percentis de RSS e taxa média de CPU no buffer
+        result = {
+            "samples": self.count,
+            "rss_peak": self.rss_peak,
+            "rss_mean": self.rss_sum / self.count if self.count else 0.0,
+        }
+        if numpy is not None and self.size:
+            rss = self.view("rss")
+            for q, value in zip(percentiles, numpy.percentile(rss, percentiles)):
+                result[f"rss_p{q}"] = float(value)
+            result["children_peak"] = float(self.view("children").max())
+        else:
+            rss = self.values("rss")
+            for q in percentiles:
+                result[f"rss_p{q}"] = percentile(rss, q)
+            result["children_peak"] = max(self.values("children"), default=0.0)
+        if self.size > 1:
+            first = self.start
+            last = (self.start + self.size - 1) % self.capacity
+            elapsed = self.time[last] - self.time[first]
+            result["cpu_rate"] = (self.cpu[last] - self.cpu[first]) / elapsed if elapsed > 0 else 0.0
+        else:
+            result["cpu_rate"] = 0.0
+        return result